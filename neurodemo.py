@@ -1,13 +1,24 @@
+import argparse
 import sys
 from pyqtgraph.Qt import QtCore, QtWidgets
 from neurodemo.main_window import DemoWindow
 
 
 if __name__ == '__main__':
-    if '--dbg' in sys.argv:
+    parser = argparse.ArgumentParser(description="NeuroDemo")
+    parser.add_argument('--dbg', action='store_true', help="open the pyqtgraph debug console")
+    parser.add_argument('--serve', nargs='?', const='127.0.0.1:7723', metavar='ADDRESS',
+                        help="mirror the simulation to viewer clients at host:port or a "
+                             "Unix socket path (default 127.0.0.1:7723)")
+    args, _ = parser.parse_known_args()  # leave Qt's own options alone
+
+    if args.dbg:
         import pyqtgraph as pg
         pg.dbg()
 
     win = DemoWindow(multiprocessing=False)
+    if args.serve is not None:
+        from neurodemo.server import parse_address
+        win.start_server(parse_address(args.serve))
     if (sys.flags.interactive != 1) or not hasattr(QtCore, "PYQT_VERSION"):
         QtWidgets.QApplication.instance().exec()
@@ -23,6 +23,49 @@ x = ipulse
 y = vpulse - vbase
 '''
 
+class TrialStore(object):
+    """Growable (signal, trial, time) array of sweeps.
+
+    Storage is preallocated and doubled whenever it fills, so adding a trial
+    costs amortized O(1) instead of copying every stored trial. `view()`
+    returns a MetaArray over the filled trials without copying them.
+    """
+
+    def __init__(self, cols, t, trial_units='A', capacity=16):
+        self.cols = cols
+        self.t = t
+        self.trial_units = trial_units
+        self.data = np.empty((len(cols), capacity, len(t)))
+        self.values = np.empty(capacity)
+        self.n = 0
+
+    def __len__(self):
+        return self.n
+
+    def add(self, data, value):
+        """Append one trial; *data* has shape (signals, time)."""
+        if data.shape != (self.data.shape[0], self.data.shape[2]):
+            raise ValueError("Trial shape %s does not match stored trials %s" %
+                             (data.shape, (self.data.shape[0], self.data.shape[2])))
+        if self.n == self.data.shape[1]:
+            cap = 2 * self.data.shape[1]
+            grown = np.empty((self.data.shape[0], cap, self.data.shape[2]))
+            grown[:, :self.n] = self.data[:, :self.n]
+            self.data = grown
+            self.values = np.concatenate([self.values, np.empty(cap - len(self.values))])
+        self.data[:, self.n] = data
+        self.values[self.n] = value
+        self.n += 1
+
+    def view(self):
+        return MetaArray(self.data[:, :self.n], info=[
+            {'name': 'Signal', 'cols': list(self.cols)},
+            {'name': 'Trial', 'values': self.values[:self.n], 'units': self.trial_units},
+            {'name': 'Time', 'units': 's', 'values': self.t},
+            {}
+        ])
+
+
 class AnalysisPlot(QtGui.QSplitter):
     def __init__(self):
         QtGui.QSplitter.__init__(self, QtCore.Qt.Vertical)
@@ -58,28 +101,20 @@ class AnalysisPlot(QtGui.QSplitter):
     def add_data(self, t, data, info):
         v = data['soma.V']
         i = data['soma.PatchClamp.I']
-        data = np.vstack([v, i])[:, np.newaxis, :]
-        if self.ns['data'] is None:
+        if self.trials is None:
             cols = [
                 {'name': 'Vm', 'units': 'V'},
                 {'name': 'Ipip', 'units': 'A'},
             ]
-            self.ns['data'] = MetaArray(data, info=[
-                {'name': 'Signal', 'cols': cols}, 
-                {'name': 'Trial', 'values': [info['amp']], 'units': 'A'},
-                {'name': 'Time', 'units': 's', 'values': t},
-                {}
-            ])
-        else:
-            data = np.concatenate([self.ns['data'].asarray(), data], axis=1)
-            minfo = self.ns['data'].infoCopy()
-            minfo[1]['values'] = np.append(minfo[1]['values'], info['amp'])
-            self.ns['data'] = MetaArray(data, info=minfo)
+            self.trials = TrialStore(cols, t)
+        self.trials.add(np.vstack([v, i]), info['amp'])
+        self.ns['data'] = self.trials.view()
         self.update_plot()
         
     def clear(self):
         self.ns.clear()
         self.ns['data'] = None
+        self.trials = None
         self.plot.clear()
         
     def update_plot(self):
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+NeuroDemo - Physiological neuron sandbox for educational purposes
+
+Memory-mapped archive of recorded simulation results.
+
+An archive is a directory holding one raw column file per key (float64 for
+'t', a fixed dtype for everything else) and ``meta.json``, which records the
+keys, dtypes and number of samples. Because the layout is fixed, opening an
+archive only maps the files; reads touch just the pages they need, so hours
+of simulated data can be analyzed or plotted without loading them.
+
+The sorted 't' column is the time index: a time range is converted to a
+sample range by bisection.
+"""
+import json
+import os
+import numpy as np
+from .neuronsim import SimState
+
+
+def _column_file(key):
+    return key + '.bin'
+
+
+class ArchiveWriter(object):
+    """Append columns to an archive directory.
+
+    Has the same interface as the other ChunkedRecorder writers, so an
+    archive can be recorded with ``ChunkedRecorder(path, keys,
+    backend='archive')``. The sample count in ``meta.json`` is updated after
+    every chunk, so the archive can be opened while it is being written.
+    Compression is not supported because columns must stay memory-mappable.
+    """
+
+    def __init__(self, path, keys, dtype=np.float32, chunk_size=None, compress=False):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.keys = ['t'] + [k for k in keys if k != 't']
+        self.dtypes = {k: np.dtype(np.float64 if k == 't' else dtype) for k in self.keys}
+        self.files = {k: open(os.path.join(path, _column_file(k)), 'wb') for k in self.keys}
+        self.meta = {
+            'keys': self.keys,
+            'dtypes': {k: dt.name for k, dt in self.dtypes.items()},
+            'files': {k: _column_file(k) for k in self.keys},
+            'n': 0,
+            'events': [],
+        }
+        self.write_meta()
+
+    def write(self, columns):
+        missing = [k for k in self.keys if k not in columns]
+        if len(missing) > 0:
+            raise ValueError("Columns missing from chunk: %s" % missing)
+        n = len(columns['t'])
+        values = {k: np.ascontiguousarray(columns[k], dtype=self.dtypes[k]) for k in self.keys}
+        for k, v in values.items():
+            if v.shape != (n,):
+                raise ValueError("Column %r has shape %s; expected (%d,)" % (k, v.shape, n))
+        for k, v in values.items():
+            self.files[k].write(v.tobytes())
+            self.files[k].flush()
+        self.meta['n'] += n
+        self.write_meta()
+
+    def add_event(self, event):
+        """Store a JSON-serializable *event* (e.g. a trigger) in the metadata."""
+        self.meta['events'].append(event)
+        self.write_meta()
+
+    def write_meta(self):
+        tmp = os.path.join(self.path, 'meta.json.tmp')
+        with open(tmp, 'w') as fh:
+            json.dump(self.meta, fh, indent=1)
+        os.replace(tmp, os.path.join(self.path, 'meta.json'))
+
+    def close(self):
+        for fh in self.files.values():
+            fh.close()
+
+
+class ResultArchive(object):
+    """Random-access, read-only view of an archive directory.
+
+    ``archive[key]`` returns the whole column as a memory-mapped array, and
+    ``archive[t0:t1, keys]`` returns a SimState holding memory-mapped views of
+    the samples with t0 <= t < t1 (either bound may be omitted; *keys* may be
+    a single key or a list and defaults to all keys).
+
+    An archive that is still being recorded can be read while it grows:
+    ``meta.json`` is checked on every length query and column lookup, and
+    samples and events written since are picked up (see `refresh()`).
+    Arrays returned earlier keep their length.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._meta_stat = None
+        self._columns = {}
+        self.refresh()
+
+    def refresh(self):
+        """Re-read ``meta.json`` if it has been rewritten since it was last
+        read. Return True if it was.
+        """
+        fname = os.path.join(self.path, 'meta.json')
+        st = os.stat(fname)
+        stat = (st.st_mtime_ns, st.st_size, st.st_ino)
+        if stat == self._meta_stat:
+            return False
+        with open(fname) as fh:
+            meta = json.load(fh)
+        if self._meta_stat is None or meta['n'] != self.meta['n']:
+            self._columns = {}  # memory maps are sized to the sample count
+        self.meta = meta
+        self._meta_stat = stat
+        return True
+
+    @staticmethod
+    def is_archive(path):
+        return os.path.isfile(os.path.join(path, 'meta.json'))
+
+    def __len__(self):
+        self.refresh()
+        return self.meta['n']
+
+    def keys(self):
+        return list(self.meta['keys'])
+
+    def __contains__(self, key):
+        return key in self.meta['keys']
+
+    @property
+    def events(self):
+        return self.meta.get('events', [])
+
+    @property
+    def t0(self):
+        return self.column('t')[0] if len(self) > 0 else None
+
+    @property
+    def t1(self):
+        return self.column('t')[-1] if len(self) > 0 else None
+
+    def column(self, key):
+        """Return the memory-mapped array for *key*."""
+        self.refresh()
+        col = self._columns.get(key)
+        if col is None:
+            n = len(self)
+            if n == 0:
+                col = np.empty(0, dtype=self.meta['dtypes'][key])
+            else:
+                fname = os.path.join(self.path, self.meta['files'][key])
+                col = np.memmap(fname, dtype=self.meta['dtypes'][key], mode='r', shape=(n,))
+            self._columns[key] = col
+        return col
+
+    def index_range(self, t0=None, t1=None):
+        """Return the sample slice covering t0 <= t < t1."""
+        t = self.column('t')
+        i0 = 0 if t0 is None else int(np.searchsorted(t, t0, side='left'))
+        i1 = len(t) if t1 is None else int(np.searchsorted(t, t1, side='left'))
+        return slice(i0, max(i0, i1))
+
+    def __getitem__(self, item):
+        if isinstance(item, str):
+            return self.column(item)
+        if isinstance(item, tuple):
+            sl, keys = item
+        else:
+            sl, keys = item, None
+        if not isinstance(sl, slice) or sl.step is not None:
+            raise TypeError("Archive reads take a time range: archive[t0:t1, keys]")
+        if keys is None:
+            keys = self.keys()
+        elif isinstance(keys, str):
+            keys = [keys]
+        return self.get_range(sl.start, sl.stop, keys)
+
+    def get_range(self, t0, t1, keys):
+        """Return a SimState holding *keys* for t0 <= t < t1."""
+        return self.get_samples(self.index_range(t0, t1), keys)
+
+    def get_samples(self, sl, keys):
+        """Return a SimState holding *keys* for the sample slice *sl*."""
+        cols = {k: self.column(k)[sl] for k in keys if k != 't' and k in self}
+        cols['t'] = self.column('t')[sl]
+        return SimState([], {}, np.empty((0, len(cols['t']))), **cols)
+
+    def get_state_at_time(self, t):
+        """Return a dictionary of all recorded values at time *t*, using the
+        same sample as `SimState.get_state_at_time()` (the first sample at or
+        after *t*).
+        """
+        index = min(int(np.searchsorted(self.column('t'), t)), len(self) - 1)
+        return {k: self.column(k)[index] for k in self.keys()}
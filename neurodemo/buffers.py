@@ -0,0 +1,466 @@
+# -*- coding: utf-8 -*-
+"""
+NeuroDemo - Physiological neuron sandbox for educational purposes
+
+Fixed-size buffers used to hold recent simulation output for display.
+"""
+import bisect
+import numpy as np
+
+
+class RingBuffer(object):
+    """Fixed-capacity circular buffer of samples along the last axis.
+
+    Every sample is stored twice (at i and i + capacity), so the most recent
+    samples are always available as a single contiguous view, oldest first,
+    without copying. Appending costs O(block length) regardless of how much
+    history is held.
+
+    Parameters
+    ----------
+    capacity : int
+        Maximum number of samples held.
+    shape : tuple
+        Leading shape of each sample, e.g. (nkeys,) to hold several channels
+        that are written together.
+    """
+
+    def __init__(self, capacity, shape=(), dtype=float):
+        self.capacity = int(capacity)
+        self.shape = tuple(shape)
+        self._data = np.zeros(self.shape + (2 * self.capacity,), dtype=dtype)
+        self.clear()
+
+    def clear(self):
+        self._head = 0  # position of the next write, in [0, capacity)
+        self.count = 0  # number of valid samples
+        self.n_written = 0  # total number of samples ever appended
+
+    def __len__(self):
+        return self.count
+
+    def append(self, data):
+        """Append samples (last axis of *data*) to the buffer."""
+        data = np.asarray(data)
+        n_total = data.shape[-1]
+        cap = self.capacity
+        if n_total > cap:
+            data = data[..., -cap:]
+        n = data.shape[-1]
+        i0 = self._head
+        first = min(n, cap - i0)
+        self._data[..., i0:i0 + first] = data[..., :first]
+        self._data[..., i0 + cap:i0 + cap + first] = data[..., :first]
+        rest = n - first
+        if rest > 0:
+            self._data[..., :rest] = data[..., first:]
+            self._data[..., cap:cap + rest] = data[..., first:]
+        self._head = (i0 + n) % cap
+        self.count = min(cap, self.count + n)
+        self.n_written += n_total
+
+    def view(self, n=None):
+        """Return a view of the most recent *n* samples (all by default),
+        oldest first. The view is only valid until the next append.
+        """
+        if n is None or n > self.count:
+            n = self.count
+        end = self._head + self.capacity
+        return self._data[..., end - n:end]
+
+    def resize(self, capacity):
+        """Change the capacity, keeping as much recent data as fits."""
+        recent = self.view().copy()
+        n_written = self.n_written
+        self.__init__(capacity, self.shape, self._data.dtype)
+        self.append(recent)
+        self.n_written = n_written
+
+
+class SampleRing(object):
+    """Most recent samples of several keys, indexed by absolute sample number
+    and by time.
+
+    Each result block is appended once (skipping its first sample when it
+    repeats the newest stored one); the samples of any window still in the
+    ring are then available as a view with `get()`. Keys missing from a block
+    (e.g. a disabled mechanism) are stored as NaN. If time goes backward the
+    ring starts over.
+    """
+
+    def __init__(self, keys, capacity=65536):
+        self.keys = list(keys)
+        self.rows = {k: i for i, k in enumerate(self.keys)}
+        self.rows['t'] = len(self.keys)
+        self.ring = RingBuffer(capacity, shape=(len(self.keys) + 1,))
+
+    @property
+    def capacity(self):
+        return self.ring.capacity
+
+    @property
+    def n_written(self):
+        """Absolute index of the next sample to be written."""
+        return self.ring.n_written
+
+    @property
+    def oldest(self):
+        """Absolute index of the oldest sample still held."""
+        return self.ring.n_written - self.ring.count
+
+    def __len__(self):
+        return self.ring.count
+
+    def clear(self):
+        n_written = self.ring.n_written
+        self.ring.clear()
+        # absolute indexes keep increasing so pending windows never alias
+        self.ring.n_written = n_written
+
+    def resize(self, capacity):
+        self.ring.resize(capacity)
+
+    def times(self):
+        return self.ring.view()[-1]
+
+    def last_time(self):
+        return self.ring.view(1)[-1, 0] if self.ring.count > 0 else None
+
+    def append(self, result):
+        t = result['t']
+        if np.isscalar(t) or len(t) == 0:
+            return
+        start = 0
+        last = self.last_time()
+        if last is not None:
+            if t[0] < last:
+                self.clear()
+            elif t[0] == last:
+                start = 1
+        n = len(t) - start
+        if n <= 0:
+            return
+        block = np.empty((len(self.keys) + 1, n))
+        for i, k in enumerate(self.keys):
+            if k in result:
+                block[i] = result[k][start:]
+            else:
+                block[i] = np.nan
+        block[-1] = t[start:]
+        self.ring.append(block)
+
+    def index_at(self, t):
+        """Absolute index of the held sample nearest to time *t*."""
+        times = self.times()
+        j = int(np.searchsorted(times, t))
+        if j == len(times) or (j > 0 and t - times[j - 1] < times[j] - t):
+            j -= 1
+        return self.oldest + max(j, 0)
+
+    def get(self, start, stop):
+        """Return a (nkeys + 1, n) view of absolute samples [start, stop); the
+        last row is time. Only valid until the next append.
+        """
+        return self.ring.view(self.n_written - start)[:, :stop - start]
+
+    def sweep(self, start, stop):
+        """Return a SweepView of absolute samples [start, stop)."""
+        return SweepView(self, start, stop)
+
+
+class SweepView(object):
+    """Read-only window of samples, used like the structured arrays that
+    hold triggered sweeps: ``sweep[key]`` returns one trace and
+    ``sweep.dtype.names`` lists the keys (including 't').
+
+    A view made with `SampleRing.sweep()` reads straight from the ring, so
+    nothing is copied; it is only valid while the ring still holds its
+    samples. Anything that keeps a sweep around must call `materialize()`,
+    which returns a view that owns a copy of the data.
+    """
+
+    def __init__(self, ring, start, stop, rows=None):
+        self.ring = ring
+        self.start = start
+        self.stop = stop
+        self.keys = ring.keys + ['t']
+        self._rows = rows
+
+    @property
+    def dtype(self):
+        return np.dtype([(str(k), float) for k in self.keys])
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def valid(self):
+        return self._rows is not None or self.start >= self.ring.oldest
+
+    def _data(self):
+        if self._rows is not None:
+            return self._rows
+        if not self.valid():
+            raise RuntimeError("Sweep samples have been overwritten; materialize() it before the ring wraps.")
+        return self.ring.get(self.start, self.stop)
+
+    def __getitem__(self, key):
+        row = self._data()[self.ring.rows[key]]
+        row.flags.writeable = False
+        return row
+
+    def materialize(self):
+        """Return a SweepView holding its own copy of the data."""
+        if self._rows is not None:
+            return self
+        rows = self._data().copy()
+        rows.flags.writeable = False
+        return SweepView(self.ring, self.start, self.stop, rows)
+
+
+class MinMaxPyramid(object):
+    """Multi-resolution min/max summary of a stream of samples.
+
+    Raw samples are held in a RingBuffer. Each level above it stores the
+    minimum and maximum over buckets of ``factor**k`` samples, aligned to the
+    absolute sample index, and is updated incrementally as samples arrive.
+    `get()` picks the coarsest level that still gives about *max_points*
+    buckets over the requested range, so a plot of any length can be drawn
+    with ~2 points per pixel while keeping every peak visible.
+    """
+
+    def __init__(self, capacity, factor=4, min_buckets=64):
+        self.factor = factor
+        self.min_buckets = min_buckets
+        self.raw = RingBuffer(capacity)
+        self.levels = []  # list of (bucket size, RingBuffer of [min, max])
+        size = factor
+        while capacity // size >= min_buckets:
+            self.levels.append((size, RingBuffer(capacity // size + 2, shape=(2,))))
+            size *= factor
+
+    @property
+    def capacity(self):
+        return self.raw.capacity
+
+    @property
+    def n_written(self):
+        return self.raw.n_written
+
+    def __len__(self):
+        return len(self.raw)
+
+    def view(self):
+        return self.raw.view()
+
+    def clear(self):
+        self.raw.clear()
+        for size, level in self.levels:
+            level.clear()
+
+    def resize(self, capacity):
+        """Change the capacity, keeping as much recent data as fits."""
+        recent = self.raw.view()[-capacity:].copy()
+        start = self.raw.n_written - len(recent)
+        self.__init__(capacity, self.factor, self.min_buckets)
+        self.raw.n_written = start
+        self.append(recent)
+
+    def append(self, data):
+        n0 = self.raw.n_written
+        self.raw.append(data)
+        n1 = self.raw.n_written
+        f = self.factor
+        lower, lower_size = self.raw, 1
+        for size, level in self.levels:
+            new = n1 // size - n0 // size
+            if new > 0:
+                # number of newest lower-level items not yet in a complete bucket
+                offset = n1 // lower_size - (n1 // size) * (size // lower_size)
+                avail = (len(lower) - offset) // f
+                if avail < new:
+                    # not enough history to fill every new bucket (e.g. very
+                    # large block); start this level over from what is there
+                    level.clear()
+                    new = avail
+                if new > 0:
+                    src = lower.view(new * f + offset)[..., :new * f]
+                    if lower is self.raw:
+                        src = src.reshape(new, f)
+                        level.append(np.stack([src.min(axis=1), src.max(axis=1)]))
+                    else:
+                        level.append(np.stack([
+                            src[0].reshape(new, f).min(axis=1),
+                            src[1].reshape(new, f).max(axis=1),
+                        ]))
+            lower, lower_size = level, size
+
+    def get(self, start, stop, max_points=1000):
+        """Return (index, values) for absolute sample indexes [start, stop).
+
+        *index* gives the (fractional) sample index of each returned point.
+        At coarse levels each bucket contributes its min and max, both placed
+        at the bucket center.
+        """
+        n = self.raw.n_written
+        oldest = n - len(self.raw)
+        start = max(int(start), oldest)
+        stop = min(int(stop), n)
+        if stop <= start:
+            return np.empty(0), np.empty(0)
+        span = stop - start
+        if span <= max_points or len(self.levels) == 0:
+            values = self.raw.view(n - start)[:span]
+            return np.arange(start, stop, dtype=float), values
+
+        size, level = self.levels[-1]
+        for size, level in self.levels:
+            if span / size <= max_points:
+                break
+        nb = n // size  # number of complete buckets
+        # whole buckets inside the range that the level still holds; the
+        # partial buckets at either end come straight from the raw samples
+        j0 = max(-(-start // size), nb - len(level))
+        j1 = min(stop // size, nb)
+        if j1 > j0:
+            mins, maxs = level.view(nb - j0)[:, :j1 - j0]
+            centers = (np.arange(j0, j1) + 0.5) * size
+            edges = [(start, j0 * size), (j1 * size, stop)]
+        else:
+            mins = maxs = centers = np.empty(0)
+            edges = [(start, stop)]
+        for i, (a, b) in enumerate(edges):
+            if b <= a:
+                continue
+            part = self.raw.view(n - a)[:b - a]
+            pos = 0 if i == 0 else len(mins)
+            mins = np.insert(mins, pos, part.min())
+            maxs = np.insert(maxs, pos, part.max())
+            centers = np.insert(centers, pos, a + 0.5 * len(part))
+        values = np.empty(2 * len(mins))
+        values[0::2] = mins
+        values[1::2] = maxs
+        return np.repeat(centers, 2), values
+
+
+class ResultBuffer(object):
+    """Store recent simulation results for lookup by time.
+
+    Blocks are evicted from the front once they are older than *max_duration*
+    (measured back from the end of the newest block) or once the buffer holds
+    more than *max_bytes*; the newest block is always kept. Block start times
+    are kept sorted so a lookup bisects to the right block instead of scanning.
+
+    If *keys* is given, only those keys (plus 't') are stored from each block;
+    this drops the full diff. eq. state and evaluates the dependent variables
+    once on arrival.
+    """
+
+    def __init__(self, max_duration=10, max_bytes=None, keys=None):
+        self.max_duration = max_duration
+        self.max_bytes = max_bytes
+        self.keys = keys
+        self.clear()
+
+    def clear(self):
+        self.results = []
+        self.start_times = []  # sorted; start_times[i] == results[i]['t'][0]
+        self.block_bytes = []
+        self.nbytes = 0
+        self._scrub_cache = {}
+
+    def __len__(self):
+        return len(self.results)
+
+    def add(self, result):
+        t = result['t']
+        if np.isscalar(t) or len(t) == 0:
+            return
+        if len(self.start_times) > 0 and t[0] < self.start_times[-1]:
+            # simulation time went backward (the sim was reset); start over
+            self.clear()
+        if self.keys is not None:
+            result = result.reduce(self.keys)
+        nbytes = result_nbytes(result)
+        self.results.append(result)
+        self.start_times.append(t[0])
+        self.block_bytes.append(nbytes)
+        self.nbytes += nbytes
+        self._scrub_cache = {}
+        self.evict()
+
+    def evict(self):
+        """Drop the oldest blocks until duration and memory limits are met."""
+        n = 0
+        if self.max_duration is not None:
+            t_min = self.results[-1]['t'][-1] - self.max_duration
+            while n < len(self.results) - 1 and self.results[n]['t'][-1] < t_min:
+                n += 1
+        if self.max_bytes is not None:
+            total = self.nbytes - sum(self.block_bytes[:n])
+            while n < len(self.results) - 1 and total > self.max_bytes:
+                total -= self.block_bytes[n]
+                n += 1
+        if n > 0:
+            self.nbytes -= sum(self.block_bytes[:n])
+            del self.results[:n]
+            del self.start_times[:n]
+            del self.block_bytes[:n]
+
+    def find_block(self, t):
+        """Return the block containing time *t*, or None.
+
+        Negative times are relative to the end of the newest block.
+        """
+        if len(self.results) == 0:
+            return None
+        if t < 0:
+            t = self.results[-1]['t'][-1] + t
+        i = bisect.bisect_right(self.start_times, t) - 1
+        if i < 0:
+            return None
+        result = self.results[i]
+        if t > result['t'][-1]:
+            return None
+        return result
+
+    def get_state_at_time(self, t):
+        if len(self.results) > 0 and t < 0:
+            t = self.results[-1]['t'][-1] + t
+        result = self.find_block(t)
+        if result is None:
+            return None
+        return result.get_state_at_time(t)
+
+
+    def scrub(self, t, keys, max_cached=4096):
+        """Return a dictionary of only *keys* at time *t* (same sample as
+        `get_state_at_time()`), or None.
+
+        Meant for inspecting a paused trace with the mouse: the block and the
+        sample are found by bisection, only the requested keys are computed,
+        and the values for each visited sample are cached until new data
+        arrives.
+        """
+        if len(self.results) > 0 and t < 0:
+            t = self.results[-1]['t'][-1] + t
+        result = self.find_block(t)
+        if result is None:
+            return None
+        index = int(np.searchsorted(result['t'], t))
+        cache_key = (id(result), index, tuple(keys))
+        values = self._scrub_cache.get(cache_key)
+        if values is None:
+            if len(self._scrub_cache) >= max_cached:
+                self._scrub_cache = {}
+            values = result.get_values_at_index(index, keys)
+            self._scrub_cache[cache_key] = values
+        return values
+
+
+def result_nbytes(result):
+    """Approximate memory held by the arrays of a SimState."""
+    nbytes = 0 if result.state is None else np.asarray(result.state).nbytes
+    for v in result.extra.values():
+        if isinstance(v, np.ndarray):
+            nbytes += v.nbytes
+    return nbytes
@@ -12,6 +12,8 @@ class ChannelParameter(pt.parameterTypes.SimpleParameter):
     
     # emitted when a plot should be shown or hidden
     plots_changed = QtCore.Signal(object, object, object, object)  # self, channel, name,    on/off
+    # emitted when the gating curves of the channel should be shown
+    gates_requested = QtCore.Signal(object, object)  # self, channel
     
     def __init__(self, channel):
         self.channel = channel
@@ -25,11 +27,18 @@ class ChannelParameter(pt.parameterTypes.SimpleParameter):
         ]
         for sv in channel.difeq_state():
             ch_params.append(dict(name='Plot ' + sv, type='bool', value=False))
+        if len(channel.difeq_state()) > 0:
+            ch_params.append(dict(name='Show Gates', type='action'))
         
         pt.parameterTypes.SimpleParameter.__init__(self, name=name, type='bool', 
                                                    value=channel.enabled, children=ch_params,
                                                    expanded=False)
         self.sigTreeStateChanged.connect(self.treeChange)
+        if len(channel.difeq_state()) > 0:
+            self.child('Show Gates').sigActivated.connect(self.show_gates)
+
+    def show_gates(self):
+        self.gates_requested.emit(self, self.channel)
         
     def treeChange(self, root, changes):
         for param, change, val in changes:
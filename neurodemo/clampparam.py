@@ -4,19 +4,22 @@ NeuroDemo - Physiological neuron sandbox for educational purposes
 Luke Campagnola 2015
 """
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+import heapq
 import numpy as np
 from pyqtgraph.Qt import QtCore
 import pyqtgraph.parametertree as pt
 from .sequenceplot import SequencePlotWindow
+from .buffers import SampleRing
+from .ivcurve import steady_state_iv
 import neurodemo.units as NU
 
-@dataclass
+@dataclass(order=True)
 class Trigger:
+    # triggers are ordered by time only, so they can be kept in a heap
     trigger_time: float
-    curr_buff_ptr: int
-    buf: object
-    info: dict
+    n: int = field(compare=False)  # number of samples in the sweep
+    info: dict = field(compare=False)
 
 
 class ClampParameter(pt.parameterTypes.SimpleParameter):
@@ -25,6 +28,7 @@ class ClampParameter(pt.parameterTypes.SimpleParameter):
         object, object, object, object
     )  # self, channel, name, on/off
     mode_changed = QtCore.Signal(object, object)  # self, mode
+    trigger_added = QtCore.Signal(object)  # Trigger
 
     def __init__(self, clamp, sim, pencolor):
         self.clamp = clamp
@@ -32,12 +36,11 @@ class ClampParameter(pt.parameterTypes.SimpleParameter):
         self.dt = sim.dt
         self.dt_updated = True
         self.plot_win = SequencePlotWindow(pencolor)
+        self.plot_win.analyzer.analysis_plot.set_iv_source(self.steady_state_iv)
 
-        self.triggers = []  # items are (trigger_time, pointer, trigger_buffer, (mode, amp, cmd, seq_ind, seq_len))
-        self.result_buffer = []  # store a few recent results to ensure triggers are caught
-        self.result_buffer_size = 5
-
+        self.triggers = []  # heap of pending Triggers, earliest first
         self.plot_keys = []
+        self.samples = SampleRing(self.plot_keys)  # recent samples of all plotted keys
         pt.parameterTypes.SimpleParameter.__init__(
             self,
             name="Patch Clamp",
@@ -253,6 +256,18 @@ class ClampParameter(pt.parameterTypes.SimpleParameter):
         finally:
             self.sigTreeStateChanged.connect(self.treeChange)
         self.mode_changed.emit(self, mode)
+        self.plot_win.analyzer.analysis_plot.update_iv_curve()
+
+    def steady_state_iv(self):
+        """Analytic steady-state I-V of the clamped section in voltage clamp,
+        as (cmd, current) with cmd relative to the holding potential like the
+        pulse amplitudes. None in current clamp.
+        """
+        if self.mode() != "vc":
+            return None
+        V = np.linspace(-120, 60, 361) * NU.mV
+        current = steady_state_iv(self.clamp.section, V)[0]
+        return V - self.clamp.holding["vc"], current
 
     def pulse_template(self):
         d0 = self["Pulse", "Hold-duration"]
@@ -280,7 +295,7 @@ class ClampParameter(pt.parameterTypes.SimpleParameter):
             print("No triggers set")
             return
         print("Triggers:\n")
-        for tr in self.triggers:
+        for tr in sorted(self.triggers):
             print(f"    {tr.trigger_time:9.5f}  {tr.info['amp']*1e12:8.1f} pA")
 
     def pulse_once(self):
@@ -342,81 +357,50 @@ class ClampParameter(pt.parameterTypes.SimpleParameter):
         # self.print_triggers()
 
     def add_trigger(self, n, t, info):
-        buf = np.empty(n, dtype=[(str(k), float) for k in self.plot_keys + ["t"]])
-        self.triggers.append(Trigger(t, 0, buf, info))
+        trigger = Trigger(t, n, info)
+        heapq.heappush(self.triggers, trigger)
+        if n > self.samples.capacity // 2:
+            # keep room for a whole sweep plus incoming blocks
+            self.samples.resize(2 * n)
+        self.trigger_added.emit(trigger)
 
     def clear_triggers(self):
         self.triggers = []
         self.clamp.clear_queue()
-        
+
+    def reset_capture(self):
+        """Forget pending triggers and recent samples (the clamp's command
+        queue is left alone).
+        """
+        self.triggers = []
+        self.samples = SampleRing(self.plot_keys, self.samples.capacity)
+
     def add_plot(self, key, label):
         self.plot_keys.append(key)
-        self.triggers = []
+        self.reset_capture()
         self.plot_win.add_plot(key, label)
 
     def remove_plot(self, key):
         self.plot_keys.remove(key)
-        self.triggers = []
+        self.reset_capture()
         self.plot_win.remove_plot(key)
 
-    def get_oldest_result(self):
-        earliest = -1
-        for i, r in enumerate(self.result_buffer):
-            t = r["t"][0]
-            if earliest == -1:
-                earliest = t
-            else:
-                if t < earliest:
-                    earliest = t
-        if i >= 0:
-            return self.result_buffer.pop(i)
-        else:
-            raise ValueError("Cannot find oldest result in queue")
-
     def new_result(self, result):
-
-        # store a few recent results to ensure triggers are handled on time
-        self.result_buffer.append(result)  # add the result to the end of the buffer list
-        if len(self.result_buffer) > self.result_buffer_size: 
-            # find the OLDEST time in the buffer, and return it
-            result = self.get_oldest_result()
-        else:
-            return # wait until the list is full to plot anything
-        # print("new result, time = ", result["t"][0], result["t"][-1])
-        # self.print_triggers()
-        if len(self.triggers) == 0:  # no triggers - nothing to plot
-            return
-
-        time_arr = result["t"]
-        TR = self.triggers[0] 
-        if TR.trigger_time > time_arr[-1]:  # no trigger yet
-            # print(f"*** Trigger detected at {TR.trigger_time:.4f} for time block: {time_arr[0]:.6f} - {time_arr[-1]:.6f}")
-            # print(len(time_arr))
-            return
-        # Copy data from result to trigger buffer
-        trigger_index = max(
-            0, int(np.round((TR.trigger_time - time_arr[0]) / self.dt))
-        )  # index of trigger within new data
-        # number of points available is the smaller of the remainder of the current
-        # part of the unused buffer, or the remainder of the time array
-        npts = min(
-            len(TR.buf) - TR.curr_buff_ptr, len(time_arr) - trigger_index
-        )  # number of samples to copy from new data
-        # print("Trigger index: ", trigger_index, "npts: ", npts, "TR.curr: ", TR.curr_buff_ptr)
-        for k in self.plot_keys:  # self.plot_keys is a list, buf is a recarray
-            if k in result.keys():
-                TR.buf[k][TR.curr_buff_ptr : TR.curr_buff_ptr + npts] = result[k][trigger_index : trigger_index + npts]
-
-        TR.curr_buff_ptr += npts
-        # print('buff shape [0]: ', TR.buf.shape[0], time_arr[0])
-        # print("n triggers: ", len(self.triggers))
-        if TR.curr_buff_ptr >= TR.buf.shape[0]:
-            # If the trigger buffer would run over on next call, plot the current buffer
-            #  and remove it - TR.trigger_time
-            self.plot_win.plot((np.arange(TR.buf.shape[0]) * self.dt), TR.buf, TR.info)
-            self.triggers.pop(0)
-            if len(time_arr) > npts:
-                # If there is data left over, try feeding it to the next trigger
-                result = result[trigger_index+npts:]
-                self.new_result(result)
+        """Store *result* and deliver every triggered sweep whose last sample
+        has now arrived.
+        """
+        samples = self.samples
+        samples.append(result)
+        while len(self.triggers) > 0 and len(samples) > 0:
+            TR = self.triggers[0]
+            if TR.trigger_time > samples.last_time():
+                return  # no trigger yet
+            n = TR.n
+            start = max(samples.index_at(TR.trigger_time), samples.oldest)
+            if samples.n_written < start + n:
+                return  # sweep not complete yet
+            heapq.heappop(self.triggers)
+            # the sweep is a view into the ring; the analyzer copies it if kept
+            sweep = samples.sweep(start, start + n)
+            self.plot_win.plot((np.arange(n) * self.dt), sweep, TR.info)
 
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""
+NeuroDemo - Physiological neuron sandbox for educational purposes
+
+Batched single-exponential fitting.
+
+`fit_exponential()` fits ``y = offset + amp * exp(-(t - t[0]) / tau)`` to
+every row of a 2D array at once. A closed-form estimate (Prony's method when
+the offset is free, a weighted log-linear fit when it is fixed) gives the
+starting point, and a few Levenberg-Marquardt iterations, carried out for
+all rows together with array operations, refine it. A family of traces is
+fit in about the time lmfit needs for one or two of them.
+"""
+import numpy as np
+
+
+def _solve(a, b):
+    """Solve the stacked linear systems a[i] x[i] = b[i]; singular rows give NaN."""
+    out = np.full(b.shape, np.nan)
+    ok = np.isfinite(a).all(axis=(1, 2)) & np.isfinite(b).all(axis=1)
+    ok[ok] = np.abs(np.linalg.det(a[ok])) > 0
+    if ok.any():
+        out[ok] = np.linalg.solve(a[ok], b[ok][..., np.newaxis])[..., 0]
+    return out
+
+
+def _initial_free(x, y):
+    """Prony estimate of (offset, amp, tau) for uniformly sampled rows.
+
+    Successive samples of an exponential obey y[k+1] = r * y[k] + c, so a
+    linear regression of y[1:] on y[:-1] gives the decay ratio r per sample.
+    """
+    dx = x[1] - x[0]
+    y0 = y[:, :-1]
+    y1 = y[:, 1:]
+    m0 = y0.mean(axis=1, keepdims=True)
+    m1 = y1.mean(axis=1, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r = ((y0 - m0) * (y1 - m1)).sum(axis=1) / ((y0 - m0) ** 2).sum(axis=1)
+        tau = -dx / np.log(r)
+    # fall back to a third of the window if the data do not look exponential
+    bad = ~(np.isfinite(tau) & (tau > 0))
+    tau[bad] = (x[-1] - x[0]) / 3.0
+    # with tau known, offset and amplitude are a linear least-squares problem
+    e = np.exp(-x[np.newaxis, :] / tau[:, np.newaxis])
+    se = e.sum(axis=1)
+    see = (e * e).sum(axis=1)
+    sy = y.sum(axis=1)
+    sey = (e * y).sum(axis=1)
+    n = y.shape[1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        det = n * see - se * se
+        amp = (n * sey - se * sy) / det
+        offset = (sy - amp * se) / n
+    return offset, amp, tau
+
+
+def _initial_fixed(x, z):
+    """Weighted log-linear estimate of (amp, tau) for rows of z = y - offset."""
+    sign = np.where(z[:, :1] < 0, -1.0, 1.0)
+    za = z * sign
+    # weight by z**2 so the noisy tail near the offset counts little
+    w = np.where(za > 0, za ** 2, 0.0)
+    with np.errstate(divide='ignore'):
+        lz = np.where(za > 0, np.log(np.where(za > 0, za, 1.0)), 0.0)
+    sw = w.sum(axis=1)
+    swx = (w * x).sum(axis=1)
+    swxx = (w * x * x).sum(axis=1)
+    swl = (w * lz).sum(axis=1)
+    swxl = (w * x * lz).sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        det = sw * swxx - swx * swx
+        slope = (sw * swxl - swx * swl) / det
+        intercept = (swl - slope * swx) / sw
+        tau = -1.0 / slope
+    bad = ~(np.isfinite(tau) & (tau > 0))
+    tau[bad] = (x[-1] - x[0]) / 3.0
+    amp = sign[:, 0] * np.exp(np.where(np.isfinite(intercept), intercept, 0.0))
+    return amp, tau
+
+
+def fit_exponential(t, data, offset=None, iterations=30):
+    """Fit a single exponential to each row of *data*.
+
+    Parameters
+    ----------
+    t : array
+        Sample times (n_samples,), shared by all rows and uniformly spaced.
+    data : array
+        Shape (n_traces, n_samples) or (n_samples,).
+    offset : None | float | array
+        None to fit the offset, otherwise the fixed offset of each row.
+    iterations : int
+        Maximum number of Levenberg-Marquardt iterations.
+
+    Returns
+    -------
+    dict of arrays (one value per row): 'offset', 'amp', 'tau' and 'rss'
+    (residual sum of squares). Rows that cannot be fit are NaN.
+    """
+    data = np.asarray(data, dtype=float)
+    if data.ndim == 1:
+        data = data[np.newaxis]
+    n, ns = data.shape
+    x = np.asarray(t, dtype=float) - t[0]
+    finite = np.isfinite(data).all(axis=1)
+    y = np.where(finite[:, np.newaxis], data, 0.0)
+
+    fit_offset = offset is None
+    if fit_offset:
+        off, amp, tau = _initial_free(x, y)
+        p = np.stack([off, amp, tau], axis=1)
+    else:
+        off = np.broadcast_to(np.asarray(offset, dtype=float), (n,))
+        amp, tau = _initial_fixed(x, y - off[:, np.newaxis])
+        p = np.stack([amp, tau], axis=1)
+    p[~np.isfinite(p)] = 0.0
+
+    def model(p, rows):
+        if fit_offset:
+            o, a, tau = p.T
+        else:
+            o = off[rows]
+            a, tau = p.T
+        with np.errstate(over='ignore', divide='ignore', invalid='ignore'):
+            e = np.exp(-x[np.newaxis, :] / tau[:, np.newaxis])
+        f = o[:, np.newaxis] + a[:, np.newaxis] * e
+        return f, e, a, tau
+
+    def sum_sq(p, rows):
+        with np.errstate(over='ignore', invalid='ignore'):
+            rss = ((y[rows] - model(p, rows)[0]) ** 2).sum(axis=1)
+        return np.where(np.isfinite(rss), rss, np.inf)
+
+    rss = sum_sq(p, np.arange(n))
+    lam = np.full(n, 1e-3)
+    active = finite & (ns > p.shape[1])
+    eye = np.eye(p.shape[1])
+    for i in range(iterations):
+        # only rows that are still improving are refined
+        rows = np.nonzero(active)[0]
+        if len(rows) == 0:
+            break
+        pr = p[rows]
+        f, e, a, tau = model(pr, rows)
+        res = y[rows] - f
+        # Jacobian of the model with respect to each parameter
+        dtau = a[:, np.newaxis] * e * x[np.newaxis, :] / tau[:, np.newaxis] ** 2
+        cols = [np.ones_like(e), e, dtau] if fit_offset else [e, dtau]
+        jac = np.stack(cols, axis=1)  # (rows, params, samples)
+        jtj = jac @ jac.transpose(0, 2, 1)
+        jtr = (jac @ res[:, :, np.newaxis])[..., 0]
+        diag = np.diagonal(jtj, axis1=1, axis2=2)
+        damped = jtj + lam[rows, np.newaxis, np.newaxis] * diag[:, :, np.newaxis] * eye
+        step = _solve(damped, jtr)
+        step[~np.isfinite(step).all(axis=1)] = 0.0
+        p_new = pr + step
+        p_new[:, -1] = np.where(p_new[:, -1] > 0, p_new[:, -1], pr[:, -1] / 2)
+        rss_new = sum_sq(p_new, rows)
+        better = rss_new < rss[rows]
+        converged = better & (rss[rows] - rss_new <= 1e-8 * rss[rows])
+        p[rows[better]] = p_new[better]
+        rss[rows[better]] = rss_new[better]
+        lam[rows] = np.where(better, lam[rows] / 10, lam[rows] * 10)
+        active[rows] = ~converged & (lam[rows] < 1e10)
+
+    if fit_offset:
+        off_out, amp_out, tau_out = p.T.copy()
+    else:
+        off_out = off.astype(float).copy()
+        amp_out, tau_out = p.T.copy()
+    result = {'offset': off_out, 'amp': amp_out, 'tau': tau_out, 'rss': rss}
+    for v in result.values():
+        v[~finite] = np.nan
+    return result
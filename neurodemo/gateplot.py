@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""
+NeuroDemo - Physiological neuron sandbox for educational purposes
+
+Steady-state and time-constant curves of a channel's gating variables.
+"""
+import numpy as np
+import pyqtgraph as pg
+from pyqtgraph.Qt import QtGui
+import neurodemo.units as NU
+
+
+class GatePlotWindow(QtGui.QWidget):
+    """Plot inf(V) and tau(V) for each gate of *channel*.
+
+    The curves come from `Channel.gate_inf_tau()`, which evaluates the whole
+    voltage grid at once and caches it per temperature, so redrawing after a
+    temperature change is immediate.
+    """
+
+    voltages = np.linspace(-120, 60, 721) * NU.mV
+
+    def __init__(self, channel, temp=None):
+        QtGui.QWidget.__init__(self)
+        self.channel = channel
+        self.setWindowTitle("%s gating" % channel.name)
+        self.resize(500, 600)
+        self.layout = QtGui.QGridLayout()
+        self.layout.setContentsMargins(0, 0, 0, 0)
+        self.setLayout(self.layout)
+
+        self.plot_layout = pg.GraphicsLayoutWidget()
+        self.layout.addWidget(self.plot_layout, 0, 0)
+        self.inf_plot = self.plot_layout.addPlot(labels={'left': 'Steady state', 'bottom': ('Membrane potential', 'V')})
+        self.inf_plot.addLegend()
+        self.plot_layout.nextRow()
+        self.tau_plot = self.plot_layout.addPlot(labels={'left': ('Time constant', 's'), 'bottom': ('Membrane potential', 'V')})
+        self.tau_plot.setXLink(self.inf_plot)
+
+        self.inf_curves = {}
+        self.tau_curves = {}
+        gates = list(channel.gate_inf(self.voltages, temp))
+        for i, gate in enumerate(gates):
+            pen = pg.mkPen((i, max(len(gates), 2)), width=1.5)
+            self.inf_curves[gate] = self.inf_plot.plot(pen=pen, name=gate)
+            self.tau_curves[gate] = self.tau_plot.plot(pen=pen)
+        self.update_curves(temp)
+
+    def update_curves(self, temp=None):
+        """Redraw for *temp* (C), or the simulation's temperature if None."""
+        curves = self.channel.gate_inf_tau(self.voltages, temp)
+        for gate, curve in self.inf_curves.items():
+            inf, tau = curves[gate]
+            curve.setData(self.voltages, inf)
+            self.tau_curves[gate].setData(self.voltages, tau)
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+"""
+NeuroDemo - Physiological neuron sandbox for educational purposes
+
+Analytic steady-state current-voltage relation of a section.
+
+Once every gate has relaxed at a clamped potential V, each channel passes
+gmax * OP_inf(V) * (V - Erev). Summing this over the enabled channels for a
+whole voltage grid gives the steady-state I-V curve in one vectorized pass,
+where measuring it in the simulation takes a voltage-clamp pulse sequence.
+"""
+from collections import OrderedDict
+import numpy as np
+from .neuronsim import Channel
+
+
+def steady_state_iv(section, V, temp=None):
+    """Steady-state membrane current of *section* at each potential in *V*.
+
+    Currents are outward-positive: they are the currents a voltage clamp
+    passes to hold the membrane at V after all gates have reached their
+    steady state. *temp* defaults to the simulation's temperature.
+
+    Returns
+    -------
+    total : array
+        Summed current (A), shaped like *V*.
+    currents : OrderedDict
+        Channel name: current (A) for each enabled channel.
+    """
+    V = np.asarray(V, dtype=float)
+    total = np.zeros(V.shape)
+    currents = OrderedDict()
+    for mech in section.mechanisms:
+        if not isinstance(mech, Channel) or not mech.enabled:
+            continue
+        current = mech.gmax * mech.open_probability_inf(V, temp) * (V - mech.erev)
+        currents[mech.name] = current
+        total += current
+    return total, currents
@@ -6,6 +6,7 @@ Luke Campagnola 2015
 
 # make sure we get the right pyqtgraph.
 from dataclasses import dataclass
+import os
 import sys
 import numpy as np
 import pyqtgraph as pg
@@ -19,7 +20,11 @@ import neurodemo.units as NU
 from neurodemo.channelparam import ChannelParameter
 from neurodemo.channelparam import IonConcentrations
 from neurodemo.clampparam import ClampParameter
+from neurodemo.gateplot import GatePlotWindow
+from neurodemo.phaseplane import PhasePlaneWindow
 from neurodemo.neuronview import NeuronView
+from neurodemo.buffers import MinMaxPyramid, ResultBuffer
+from neurodemo.player import SessionPlayer
 
 pg.setConfigOption('antialias', True)
 
@@ -107,12 +112,19 @@ class DemoWindow(QtWidgets.QWidget):
         # loop to run the simulation indefinitely
         self.runner = self.ndemo.SimRunner(self.sim)
         self.runner.set_speed(0.2)
+        # while a recorded session is replayed, self.runner is the player
+        self.sim_runner = self.runner
+        self.player = None
+        self.server = None
 
         # if using remote process (only on Windows):
         if self.proc is not None:
             self.runner.new_result.connect(mp.proxy(self.new_result, autoProxy=False, callSync='off'))
         else: # Darwin (macOS) and Linux:
             self.runner.new_result.connect(self.new_result) 
+            # drawing is decoupled from the simulation so that a slow display
+            # skips frames instead of queueing them
+            self.runner.display_ready.connect(self.update_display, QtCore.Qt.ConnectionType.QueuedConnection)
 
         # set up GUI
         QtGui.QWidget.__init__(self)
@@ -141,6 +153,7 @@ class DemoWindow(QtWidgets.QWidget):
         self.ptree_stim.setParameters(self.clamp_param)
         self.clamp_param.plots_changed.connect(self.plots_changed)
         self.clamp_param.mode_changed.connect(self.mode_changed)
+        self.clamp_param.trigger_added.connect(self.record_trigger)
 
         self.channel_plots = {}
         
@@ -159,6 +172,8 @@ class DemoWindow(QtWidgets.QWidget):
 
         for ch in self.channel_params:
             ch.plots_changed.connect(self.plots_changed)
+            ch.gates_requested.connect(self.show_gates)
+        self.gate_windows = {}
 
         self.ion_concentrations = [
             IonConcentrations(IonClass(name='Na', Cout=140.0, Cin=8.0, valence=+1, enabled=False)),
@@ -179,7 +194,16 @@ class DemoWindow(QtWidgets.QWidget):
             dict(name="dt", type='float', value=20e-6, limits=[2e-6, 200e-6], suffix='s', siPrefix=True),
             dict(name="Method", type='list', value="solve_ivp", values=['solve_ivp', 'odeint']),
             dict(name='Speed', type='float', value=self.runner.speed, limits=[0.001, 10], step=0.5, minStep=0.001, dec=True),
+            dict(name='Display Policy', type='list', value='coalesce', values=['coalesce', 'block']),
+            dict(name='Coalesced Blocks', type='int', value=0, readonly=True),
             dict(name="Plot Duration", type='float', value=1.0, limits=[0.1, 10], suffix='s', siPrefix=True, step=0.2),
+            dict(name='Phase Plane', type='action'),
+            dict(name='Session', type='group', expanded=False, children=[
+                dict(name='Directory', type='str', value=os.path.join(os.path.expanduser('~'), 'neurodemo_session')),
+                dict(name='Record', type='bool', value=False),
+                dict(name='Replay', type='bool', value=False),
+                dict(name='Seek', type='float', value=0, limits=[0, None], suffix='s', siPrefix=True, step=0.1),
+            ]),
             dict(name='Temp', type='float', value=self.sim.temp, limits=[0., 41.], suffix='C', step=1.0),
             dict(name='Capacitance', type='float', value=self.neuron.cap, limits=[0.1e-12, 1000.e-12], suffix='F', siPrefix=True, dec=True, children=[
                 dict(name='Plot Current', type='bool', value=False),
@@ -193,6 +217,8 @@ class DemoWindow(QtWidgets.QWidget):
         ])
         self.ptree.setParameters(self.params)
         self.params.sigTreeStateChanged.connect(self.params_changed)
+        self.phase_plane = None
+        self.clamp_param.sigTreeStateChanged.connect(self.update_phase_plane)
         # make Run/Stop button change color to indicate running state
         p = self.params.child("Run/Stop")
         rsbutton = list(p.items.keys())[0].button
@@ -225,11 +251,15 @@ class DemoWindow(QtWidgets.QWidget):
                     self.stop()
                 else:
                     self.start()
+            if path[0] == "Phase Plane":
+                self.show_phase_plane()
             if change != 'value':
                 continue
 
             elif param is self.params.child('Speed'):
                 self.runner.set_speed(val)
+            elif param is self.params.child('Display Policy'):
+                self.runner.set_display_policy(val)
             elif param is self.params.child('dt'):
                 self.reset_dt(val)
             elif param is self.params.child("Method"):
@@ -237,11 +267,25 @@ class DemoWindow(QtWidgets.QWidget):
                 self.sim.set_integrator(val)
             elif param is self.params.child('Plot Duration'):
                 self.set_scrolling_plot_duration(val)
+            elif param is self.params.child('Session', 'Record'):
+                if val:
+                    self.start_recording(self.params['Session', 'Directory'])
+                else:
+                    self.stop_recording()
+            elif param is self.params.child('Session', 'Replay'):
+                if val:
+                    self.start_replay(self.params['Session', 'Directory'])
+                else:
+                    self.stop_replay()
+            elif param is self.params.child('Session', 'Seek'):
+                self.seek(val)
             elif param is self.params.child('Temp'):
                 self.sim.temp = val
                 # also update the ion channel values = specifically Erev
                 for ion in self.ion_concentrations:
                     ion.updateErev(self.sim.temp)
+                for win in self.gate_windows.values():
+                    win.update_curves(self.sim.temp)
             elif param is self.params.child('Capacitance'):
                 self.neuron.cap = val
             elif param is self.params.child('Capacitance', 'Plot Current'):
@@ -271,6 +315,7 @@ class DemoWindow(QtWidgets.QWidget):
                     self.params.child('Ions', "Cl", "[C]out"),
                 ] and self.params.child('Ions', 'Na').value():
                 self.use_calculated_erev()  # force update of erevs
+        self.update_phase_plane()
 
     def plots_changed(self, param, channel, name, plot):
         key = channel.name + '.' + name
@@ -279,6 +324,26 @@ class DemoWindow(QtWidgets.QWidget):
         else:
             self.remove_plot(key)
 
+    def show_gates(self, param, channel):
+        win = self.gate_windows.get(channel.name)
+        if win is None:
+            win = GatePlotWindow(channel, self.sim.temp)
+            self.gate_windows[channel.name] = win
+        win.show()
+        win.raise_()
+
+    def show_phase_plane(self):
+        if self.phase_plane is None:
+            self.phase_plane = PhasePlaneWindow(self.neuron)
+        self.phase_plane.show()
+        self.phase_plane.raise_()
+        self.update_phase_plane()
+
+    def update_phase_plane(self, *args):
+        # nullclines follow every parameter change while the window is open
+        if self.phase_plane is not None and self.phase_plane.isVisible():
+            self.phase_plane.update_plot()
+
     def command_units(self):
         return 'V' if self.clamp_param['Mode'] == 'vc' else 'A'
 
@@ -371,13 +436,102 @@ class DemoWindow(QtWidgets.QWidget):
         for plt in self.channel_plots.values():
             plt.hover_line.setVisible(True)
             plt.hover_line.setPos(t)
-        state = self.result_buffer.get_state_at_time(t)
+        state = self.result_buffer.scrub(t, self.neuronview.state_keys())
         if state is not None:
             self.neuronview.update_state(state)
 
     def running(self):
         return self.runner.running()
 
+    def start_server(self, address):
+        """Mirror this window's simulation to viewer clients at *address*
+        (see neurodemo.server).
+        """
+        from neurodemo.server import SimServer
+        self.server = SimServer(address)
+        self.server.start()
+        self.runner.new_result.connect(self.server.publish)
+
+    def session_keys(self):
+        """Keys needed to replay the display: the schematic and all plots,
+        for the objects that are currently simulated.
+        """
+        keys = self.neuronview.state_keys()
+        keys += [k for k in self.channel_plots if k not in keys]
+        objs = self.sim.all_objects()
+        return [k for k in keys if k.rpartition('.')[0] in objs]
+
+    def start_recording(self, path):
+        """Record the session (see SimRunner.start_recording) to an archive
+        that can be replayed with `start_replay()`. Only the keys shown at the
+        time recording starts are stored.
+        """
+        if self.player is not None:
+            self.params['Session', 'Replay'] = False
+        self.sim_runner.start_recording(path, self.session_keys(), backend='archive', chunk_size=8192)
+
+    def stop_recording(self):
+        self.sim_runner.stop_recording()
+
+    def record_trigger(self, trigger):
+        recorder = self.runner.recorder
+        if recorder is None:
+            return
+        info = {k: v for k, v in trigger.info.items() if k != 'cmd'}
+        info['amp'] = float(info['amp'])
+        recorder.add_event({'type': 'trigger', 't': float(trigger.trigger_time), 'n': trigger.n, 'info': info})
+
+    def start_replay(self, path):
+        """Play back a recorded session in place of the simulation."""
+        if self.params['Session', 'Record']:
+            self.params['Session', 'Record'] = False
+        self.stop()
+        self.player = SessionPlayer(path)
+        self.player.set_speed(self.params['Speed'])
+        self.player.set_display_policy(self.params['Display Policy'])
+        self.player.new_result.connect(self.new_result)
+        self.player.display_ready.connect(self.update_display, QtCore.Qt.ConnectionType.QueuedConnection)
+        self.player.finished.connect(self.stop)
+        if self.server is not None:
+            self.sim_runner.new_result.disconnect(self.server.publish)
+            self.player.new_result.connect(self.server.publish)
+        self.runner = self.player
+        if self.player.dt > 0 and abs(self.player.dt - self.dt) > 1e-12:
+            self.params['dt'] = self.player.dt
+        self.seek(self.params['Session', 'Seek'])
+
+    def stop_replay(self):
+        if self.player is None:
+            return
+        self.stop()
+        if self.server is not None:
+            self.player.new_result.disconnect(self.server.publish)
+            self.sim_runner.new_result.connect(self.server.publish)
+        self.runner = self.sim_runner
+        self.player = None
+        self.clear_display()
+
+    def seek(self, t):
+        """Move replay to time *t* (relative to the start of the recording)."""
+        if self.player is None:
+            return
+        archive = self.player.archive
+        if len(archive) == 0:
+            return
+        t = archive.t0 + t
+        self.player.seek(t)
+        self.clear_display()
+        # re-arm the clamp triggers recorded after the new position
+        self.clamp_param.reset_capture()
+        for ev in archive.events:
+            if ev.get('type') == 'trigger' and ev['t'] >= self.player.time:
+                self.clamp_param.add_trigger(ev['n'], ev['t'], dict(ev['info'], cmd=None))
+
+    def clear_display(self):
+        for plt in self.channel_plots.values():
+            plt.clear_data()
+        self.result_buffer.clear()
+
     def start(self):
         self.runner.start(blocksize=2048)
         for plt in self.channel_plots.values():
@@ -410,6 +564,7 @@ class DemoWindow(QtWidgets.QWidget):
 
     def set_scrolling_plot_duration(self, val):
         self.scrolling_plot_duration = val
+        self.result_buffer.max_duration = val
         for k in self.channel_plots.keys():
             self.channel_plots[k].set_duration(val)
 
@@ -438,24 +593,52 @@ class DemoWindow(QtWidgets.QWidget):
             self.fullscreen_widget = None
         
     def new_result(self, result):
-        for k, plt in self.channel_plots.items():
-            if k not in result:
-                continue
-            if isinstance(result[k], float):
-                plt.append(result[k])
-            else:
-                plt.append(result[k][1:])
-            
+        """Handle every simulated block; nothing here may be skipped."""
         # Let the clamp decide which triggered regions of the data to extract
         # for pulse plots
         self.clamp_param.new_result(result)
-        
-        # update the schematic
-        self.neuronview.update_state(result.get_final_state())
 
         # store a running buffer of results
         self.result_buffer.add(result)
 
+        if self.proc is not None and self.player is None:
+            # remote runner: there is no display queue on this side
+            self.display_results([result])
+
+    def update_display(self):
+        """Draw the blocks that have accumulated since the last redraw."""
+        queue = self.runner.display_queue
+        self.display_results(self.runner.take_display_blocks())
+        if self.params['Coalesced Blocks'] != queue.n_coalesced:
+            self.params['Coalesced Blocks'] = queue.n_coalesced
+
+    def display_results(self, results):
+        """Append every block in *results* to the plots and redraw once.
+
+        All blocks must be appended, even when the display is behind: the
+        scrolling plots derive time from sample position, so a missing block
+        would shift every earlier sample.
+        """
+        if len(results) == 0:
+            return
+        for k, plt in self.channel_plots.items():
+            chunks = []
+            for result in results:
+                if k not in result:
+                    continue
+                if isinstance(result[k], float):
+                    chunks.append([result[k]])
+                else:
+                    chunks.append(result[k][1:])
+            if len(chunks) > 0:
+                plt.append(np.concatenate(chunks))
+
+        if self.phase_plane is not None and self.phase_plane.isVisible():
+            self.phase_plane.add_results(results)
+
+        # update the schematic
+        self.neuronview.update_state(results[-1].get_final_state())
+
     def _get_Eh(self):
         ENa = self.params.child('Ions', 'Na')
         ena = ENa.param('Erev').value()
@@ -628,6 +811,9 @@ class DemoWindow(QtWidgets.QWidget):
 
     def closeEvent(self, ev):
         self.runner.stop()
+        self.sim_runner.stop_recording()
+        if self.server is not None:
+            self.server.stop()
         # self.proc.close()
         QtWidgets.QApplication.instance().quit()
 
@@ -637,48 +823,47 @@ class ScrollingPlot(pg.PlotWidget):
         pg.PlotWidget.__init__(self, **kwds)
         self.showGrid(True, True)
         self.data_curve = self.plot(pen=pen)
-        self.data = np.array([], dtype=float)
         self.npts = npts
         self.dt = dt
-        self.plot_duration = 1.0
-    
+        self.plot_duration = npts * dt
+        # history is kept in a fixed-size ring with a min/max pyramid on top,
+        # so only ~2 points per pixel are sent to the curve on each redraw
+        self.buffer = MinMaxPyramid(self.npts)
+        self.getViewBox().sigXRangeChanged.connect(self.redraw)
+
+    def _set_npts(self, npts):
+        self.npts = npts
+        self.buffer.resize(npts)
+        self.redraw()
+
     def set_dt(self, dt):
         self.dt = dt
         # update npts as well
-        self.npts=int(self.plot_duration / self.dt)
-        # print(self.plot_duration, self.npts, self.dt)
+        self._set_npts(int(self.plot_duration / self.dt))
 
     def set_duration(self, dur):
         self.plot_duration = dur
-        self.npts=int(self.plot_duration / self.dt)
+        self._set_npts(int(self.plot_duration / self.dt))
         self.setXRange(-self.plot_duration, 0)
-        # print(self.plot_duration, self.npts, self.dt, len(self.data))
 
     def append(self, data):
-        # print("len data, len self.data: ", len(data), len(self.data))
-        self.data = np.concatenate((self.data, data), axis=0)
-        if len(self.data) >= self.npts:
-            self.data = self.data[-self.npts:]
-        t = np.arange(len(self.data)) * self.dt
-        t -= t[-1]
-        # print("appending npts: ", len(self.data), self.npts, self.dt, self.plot_duration)
-        self.data_curve.setData(t, self.data)
-
-
-class ResultBuffer:
-    def __init__(self, max_duration=10):
-        self.max_duration = max_duration
-        self.results = []
-
-    def add(self, result):
-        self.results.append(result)
-
-    def get_state_at_time(self, t):
-        if len(self.results) == 0:
-            return None
-        if t < 0:
-            t = self.results[-1]['t'][-1] + t
-        for result in self.results:
-            if result['t'][0] <= t <= result['t'][-1]:
-                return result.get_state_at_time(t)
-        return None
+        self.buffer.append(data)
+        self.redraw()
+
+    def clear_data(self):
+        self.buffer.clear()
+        self.data_curve.setData([], [])
+
+    def redraw(self):
+        """Send the visible part of the history to the curve, at a resolution
+        matched to the width of the plot.
+        """
+        newest = self.buffer.n_written - 1
+        if newest < 0:
+            return
+        vb = self.getViewBox()
+        x0, x1 = vb.viewRange()[0]
+        start = int(np.floor(x0 / self.dt)) + newest
+        stop = int(np.ceil(x1 / self.dt)) + newest + 1
+        index, values = self.buffer.get(start, stop, max_points=max(int(vb.width()), 100))
+        self.data_curve.setData((index - newest) * self.dt, values)
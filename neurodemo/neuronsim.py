@@ -7,13 +7,116 @@ Luke Campagnola 2015
 """
 
 # import sys, platform
+import asyncio
+import weakref
 from collections import OrderedDict
+from dataclasses import dataclass
 import numpy as np
 import scipy.integrate
 import neurodemo.units as NU
 import warnings
 # warnings.filterwarnings("error")
 
+
+@dataclass
+class RecordingSpec:
+    """Describes what `Sim.run()` should return.
+
+    keys:     names of the variables to keep (diff. eq. or dependent); None
+              keeps the full state. 't' is always kept.
+    decimate: keep one output sample every *decimate* integration samples.
+    interval: output sample interval in seconds; overrides *decimate* and is
+              rounded to a whole number of integration samples.
+    dtype:    dtype of the recorded values (time stays float64).
+    """
+    keys: list = None
+    decimate: int = 1
+    interval: float = None
+    dtype: object = None
+
+    def get_decimation(self, dt):
+        if self.interval is not None:
+            return max(1, int(round(self.interval / dt)))
+        return max(1, int(self.decimate))
+
+
+@dataclass
+class ThresholdEvent:
+    """A diff. eq. variable crossing a level, located by `Sim.run()`.
+
+    key:       name of the variable to watch, e.g. 'soma.V'.
+    level:     value whose crossing is an event.
+    direction: 1 for upward crossings, -1 for downward, 0 for both.
+    name:      key of the event in `SimState.events` (defaults to *key*).
+
+    With solve_ivp the crossing is located by the solver's own event root
+    finding; with odeint, by root finding on a cubic interpolation through
+    the integration samples around the crossing. Either way the event time is
+    not limited to the output sample interval.
+    """
+    key: str
+    level: float
+    direction: int = 1
+    name: str = None
+
+    def __post_init__(self):
+        if self.name is None:
+            self.name = self.key
+
+    def solver_function(self, index):
+        """Return the event function for solve_ivp, watching state[*index*]."""
+        level = self.level
+        def func(t, y):
+            return y[index] - level
+        func.direction = self.direction
+        return func
+
+    def find_crossings(self, t, state, index):
+        """Locate crossings between the samples of a block (for odeint).
+
+        Returns the event times and the (interpolated) state at each event,
+        shape (n_vars, n_events). A crossing is assigned to the interval
+        (t[k], t[k+1]], so an event at the end of one block is not reported
+        again at the start of the next.
+        """
+        y = state[index] - self.level
+        up = (y[:-1] < 0) & (y[1:] >= 0)
+        down = (y[:-1] > 0) & (y[1:] <= 0)
+        cross = up if self.direction > 0 else down if self.direction < 0 else up | down
+        k = np.nonzero(cross)[0]
+        n = len(t)
+        if len(k) == 0 or n < 4:
+            # too few samples for a cubic; interpolate linearly
+            frac = y[k] / (y[k] - y[k + 1]) if len(k) > 0 else np.empty(0)
+            return t[k] + frac * (t[k + 1] - t[k]), state[:, k] + frac * (state[:, k + 1] - state[:, k])
+        # cubic through 4 consecutive samples around each crossing
+        j0 = np.clip(k - 1, 0, n - 4)
+        nodes = np.arange(4)
+        def weights(s):
+            # Lagrange basis on nodes 0..3 at positions s (relative to j0)
+            w = np.ones((4, len(s)))
+            for i in range(4):
+                for j in range(4):
+                    if i != j:
+                        w[i] *= (s - nodes[j]) / (nodes[i] - nodes[j])
+            return w
+        yy = y[j0[:, np.newaxis] + nodes]  # (n_events, 4)
+        lo = (k - j0).astype(float)
+        hi = lo + 1
+        rising = yy[np.arange(len(k)), k - j0] < 0
+        for i in range(40):
+            mid = 0.5 * (lo + hi)
+            ym = (yy * weights(mid).T).sum(axis=1)
+            below = (ym < 0) == rising
+            lo = np.where(below, mid, lo)
+            hi = np.where(below, hi, mid)
+        s = 0.5 * (lo + hi)
+        w = weights(s)
+        ev_state = (state[:, j0[:, np.newaxis] + nodes] * w.T[np.newaxis]).sum(axis=2)
+        ev_t = t[k] + (s - (k - j0)) * (t[k + 1] - t[k])
+        return ev_t, ev_state
+
+
 class Sim(object):
     """Simulator for a collection of objects that derive from SimObject"""
 
@@ -26,6 +129,10 @@ class Sim(object):
         self.temp = temp
         self.dt = dt
         self.integrator = integrator
+        self.pool = BlockPool()
+        self._sample_index = np.arange(0)
+        self.recording = None  # default RecordingSpec used by run()
+        self.events = []  # default ThresholdEvents located by run()
 
     def set_integrator(self, integrator:str):
         if integrator in ["odeint", "solve_ivp"]:
@@ -65,11 +172,30 @@ class Sim(object):
     def time(self):
         return self._time
 
-    def run(self, blocksize:int=1000, **kwds):
+    def run(self, blocksize:int=1000, record=None, events=None, **kwds):
         """Run the simulation until a number of *samples* have been acquired.
 
+        *record* is a RecordingSpec (`self.recording` if None) that limits
+        which variables are returned and how often they are sampled. With
+        decimation the solver only reports every n-th sample, and the block is
+        lengthened to a whole number of output intervals so that the last
+        sample (from which the next block starts) is always on the grid.
+
+        *events* is a list of ThresholdEvents (`self.events` if None). The
+        time and full state of every event in the block are returned in the
+        result's ``events`` dictionary, independent of the output sample
+        interval.
+
         Extra keyword arguments are passed to `scipy.integrate.odeint()`.
         """
+        if record is None:
+            record = self.recording
+        if events is None:
+            events = self.events
+        decimate = 1 if record is None else record.get_decimation(self.dt)
+        # number of output samples, including the first (= previous last) one
+        nout = -(-(blocksize - 1) // decimate) + 1
+
         # print("Integrator: ", self.integrator)
         # reset all_objs cache in case some part of the sim has changed
         self._all_objs = None
@@ -91,25 +217,49 @@ class Sim(object):
             for k, v in o.dep_state_vars.items():
                 dep_vars[pfx + k] = v
         self._simstate = SimState(difeq_vars, dep_vars)
-        t = np.arange(0, blocksize) * self.dt + self._time
+        for ev in events:
+            if ev.key not in difeq_vars:
+                raise ValueError("Events can only watch diff. eq. variables; %r is not one." % ev.key)
+        ev_index = [difeq_vars.index(ev.key) for ev in events]
+
+        nvar = len(difeq_vars)
+        if self.integrator == 'odeint':
+            # odeint returns one row per sample, so its output is copied into
+            # a contiguous buffer from the pool (one row per diff. eq.
+            # variable, plus time in the last row); see `release()`.
+            buf = self.pool.acquire((nvar + 1, nout))
+            t = buf[nvar]
+        else:
+            # solve_ivp's output is already one row per variable and is
+            # handed out as is
+            buf = None
+            t = np.empty(nout)
+        if len(self._sample_index) != nout:
+            self._sample_index = np.arange(nout)
+        np.multiply(self._sample_index, self.dt * decimate, out=t)
+        t += self._time
         # print("\nstarting run at:", self._time)
         opts = {"rtol": 1e-6, "atol": 1e-8, "hmax": 5e-4, "full_output": 1}
         opts.update(kwds)
         # Run the simulation
 
+        event_data = []  # (times, states) for each event
         if self.integrator == 'odeint':
-            result, info = scipy.integrate.odeint(self.derivatives, init_state, t, tfirst=True, **opts)
-            p = 0
-            for o in all_objs:
-                nvar = len(o.difeq_state())
-                # print("odeint state: ", p, nvar, result[-1, p:p+nvar])
-                o.update_state(result[-1, p : p + nvar])
-                p += nvar
-            self._time = t[-1]
+            if len(events) > 0 and decimate > 1:
+                # odeint has no event detection; report every integration
+                # sample so that no crossing falls between output samples
+                t_fine = t[0] + np.arange((nout - 1) * decimate + 1) * self.dt
+                result, info = scipy.integrate.odeint(self.derivatives, init_state, t_fine, tfirst=True, **opts)
+                buf[:nvar] = result[::decimate].T
+            else:
+                t_fine = t
+                result, info = scipy.integrate.odeint(self.derivatives, init_state, t, tfirst=True, **opts)
+                buf[:nvar] = result.T
+            for ev, i in zip(events, ev_index):
+                event_data.append(ev.find_crossings(t_fine, result.T, i))
+            state = buf[:nvar]
             # print(f"   {self.integrator:s}  final state = {str(result.T[:, -1]):s}")
             # print("   start, finished at : ", t[0],t[-1])
-            # print("   np.min(result.T): ", np.min(result.T), np.max(result.T))
-            return SimState(difeq_vars, dep_vars, result.T, integrator=self.integrator, t=t)
 
         elif self.integrator == 'solve_ivp':
             """Notes:
@@ -136,19 +286,95 @@ class Sim(object):
                 rtol = opts['rtol'], #**opts,
                 atol = opts['atol'],
                 max_step = opts['hmax'],
+                events=[ev.solver_function(i) for ev, i in zip(events, ev_index)] or None,
             )
-            # Update current state variables
-            p = 0
-            for i, o in enumerate(all_objs):
-                nvar = len(o.difeq_state())
-                # print("solve ivp state: ", p, nvar, result.y[p:p+nvar, -1])
-                o.update_state(result.y[p:p+nvar, -1])
-                p += nvar
-            self._time = t[-1]
+            state = result.y
+            for j in range(len(events)):
+                ev_t = result.t_events[j]
+                keep = ev_t > t[0]  # events at t[0] belong to the previous block
+                event_data.append((ev_t[keep], result.y_events[j][keep].T.reshape(nvar, -1)))
             # print(f"\n   {self.integrator:s}  {str(result.y[:, -1]):s}")
             # print("   start, finished at : ", t[0],t[-1])
-            # print("    np.min(result.y): ", np.min(result.y), np.max(result.y))
-            return SimState(difeq_vars, dep_vars, result.y, integrator=self.integrator, t=t)
+
+        # Update current state variables
+        p = 0
+        for o in all_objs:
+            nvar = len(o.difeq_state())
+            o.update_state(state[p : p + nvar, -1])
+            p += nvar
+        self._time = t[-1]
+        result = SimState(difeq_vars, dep_vars, state, integrator=self.integrator, t=t)
+        for ev, (ev_t, ev_state) in zip(events, event_data):
+            result.events[ev.name] = SimState(difeq_vars, dep_vars, ev_state, integrator=self.integrator, t=ev_t)
+        if record is not None:
+            if record.keys is not None:
+                result = result.reduce(record.keys, record.dtype)
+            elif record.dtype is not None:
+                result = result.copy(difeq_state=state.astype(record.dtype))
+        return result
+
+    def release(self, result):
+        """Allow the storage of *result*, a block returned by `run()`, to be
+        reused for later odeint blocks (see BlockPool). Only call this once
+        neither *result* nor any slice of it is used any more. Has no effect
+        for solve_ivp results, which are not pooled.
+        """
+        self.pool.release(result.state.base)
+
+    def iter_blocks(self, blocksize:int=1000, duration=None, **kwds):
+        """Generator that runs the simulation continuously, yielding one
+        SimState per block of *blocksize* samples.
+
+        The solver state is carried from one block to the next, so commands
+        queued on a clamp and parameter changes (temp, gmax, dt, ...) made
+        between yields take effect at the start of the next block. A callable
+        may also be passed in with ``send()``; it is called with this Sim just
+        before the next block is run.
+
+        If *duration* is given, iteration stops once that much simulated time
+        has elapsed; otherwise the generator runs until it is closed.
+        Extra keyword arguments are passed to `run()`.
+        """
+        stop_time = None if duration is None else self._time + duration
+        while stop_time is None or stop_time - self._time > 0.5 * self.dt:
+            npts = blocksize
+            if stop_time is not None:
+                # don't run past the requested duration
+                remaining = int(np.ceil((stop_time - self._time) / self.dt - 1e-6)) + 1
+                npts = max(2, min(blocksize, remaining))
+            change = yield self.run(npts, **kwds)
+            if change is not None:
+                change(self)
+
+    async def aiter_blocks(self, blocksize:int=1000, duration=None, executor=None, **kwds):
+        """Asynchronous version of `iter_blocks()`.
+
+        Each block is computed in *executor* (the default thread pool if None)
+        so that the event loop stays responsive. A block is only computed when
+        the consumer asks for it, so a slow consumer simply slows the
+        simulation down. Values passed with ``asend()`` are handled as in
+        `iter_blocks()`.
+        """
+        loop = asyncio.get_running_loop()
+        blocks = self.iter_blocks(blocksize, duration, **kwds)
+        change = None
+        job = None
+        try:
+            while True:
+                job = loop.run_in_executor(executor, _next_block, blocks, change)
+                # shielded, so that cancelling the consumer does not abandon
+                # a block that is still being computed in the executor
+                result = await asyncio.shield(job)
+                if result is None:
+                    return
+                change = yield result
+        finally:
+            if job is not None and not job.done():
+                # the generator cannot be closed while a worker runs it
+                await asyncio.wait([job])
+                if not job.cancelled():
+                    job.exception()  # retrieved; the cancellation takes precedence
+            blocks.close()
 
     def derivatives(self, t, state):
         objs = self.all_objects().values()
@@ -170,6 +396,79 @@ class Sim(object):
         return state
 
 
+class BlockPool(object):
+    """Reusable output arrays for odeint results.
+
+    Only the odeint path of `Sim.run()` uses the pool; solve_ivp results are
+    the solver's own (freshly allocated) arrays. Pooling saves an allocation
+    per block only for callers that give each block back with
+    `Sim.release()` when they are done with it, such as the headless
+    `SimServer.run()`. The GUI does not, because the display history,
+    trigger capture and analyzers keep views of earlier blocks.
+
+    A buffer handed out by `acquire()` is only handed out again after it has
+    been given back with `release()`; buffers that are never released are
+    simply left to the garbage collector. Only release a buffer once nothing,
+    including slices of the results stored in it, refers to it any more.
+    """
+
+    def __init__(self, max_buffers=16):
+        self.max_buffers = max_buffers
+        self._free = []
+        # buffers handed out by acquire(), by id; unreleased ones are not kept alive
+        self._in_use = weakref.WeakValueDictionary()
+        self.n_allocated = 0
+
+    def acquire(self, shape, dtype=float):
+        shape = tuple(shape)
+        dtype = np.dtype(dtype)
+        for i, buf in enumerate(self._free):
+            if buf.shape == shape and buf.dtype == dtype:
+                del self._free[i]
+                break
+        else:
+            buf = np.empty(shape, dtype=dtype)
+            self.n_allocated += 1
+        self._in_use[id(buf)] = buf
+        return buf
+
+    def release(self, buf):
+        """Give *buf* back to the pool. Arrays that did not come from
+        `acquire()` (or were already released) are ignored.
+        """
+        if self._in_use.pop(id(buf), None) is None:
+            return
+        if len(self._free) >= self.max_buffers:
+            self._free.pop(0)
+        self._free.append(buf)
+
+
+def _grid_key(V):
+    """Return (shape, first, last) if *V* is an evenly spaced voltage grid
+    (a 1-D array, or a row or column vector), or None.
+    """
+    if V.size < 2 or max(V.shape) != V.size:
+        return None
+    flat = V.ravel()
+    step = (flat[-1] - flat[0]) / (len(flat) - 1)
+    mid = len(flat) // 2
+    if step == 0 or abs(flat[mid] - flat[0] - mid * step) > 1e-9 * abs(step):
+        return None  # quick rejection before checking every interval
+    if np.abs(np.diff(flat) - step).max() > 1e-9 * abs(step):
+        return None
+    return (V.shape, float(flat[0]), float(flat[-1]))
+
+
+def _next_block(blocks, change):
+    """Advance a block generator; return None instead of raising StopIteration
+    (which cannot be passed through an asyncio future).
+    """
+    try:
+        return blocks.send(change)
+    except StopIteration:
+        return None
+
+
 class SimState(object):
     """Contains the state of all diff. eq. variables in the simulation.
 
@@ -198,24 +497,70 @@ class SimState(object):
         self.state = difeq_state
         self.extra = extra
         self.integrator = integrator
+        # name: SimState of the variables at each event found during the run
+        self.events = {}
+
+        # dependent variables already computed for the current block of state
+        self._cache = {}
+        self._cache_state = None
 
     def set_state(self, difeq_state):
         self.state = difeq_state
 
+    @property
+    def memoize(self):
+        """True if this state holds a block of samples, in which case
+        dependent variables are cached. Single time points (as used during
+        integration) are never cached.
+        """
+        return isinstance(self.state, np.ndarray) and self.state.ndim == 2
+
+    def dep_var(self, obj, name, func):
+        """Return dependent variable *name* of *obj*, which is computed by
+        *func*. Used by mechanisms to read each other's dependent variables:
+        on a block of state the cached value is shared, while at single time
+        points *func* is called directly to keep the solver's inner loop fast.
+        """
+        if not self.memoize:
+            return func(self)
+        return self.get_dep_var(obj.name + "." + name)
+
     def __getitem__(self, key):
         if isinstance(key, slice):
             return self.get_slice(key)
         # allow lookup by (object, var)
         if isinstance(key, tuple):
             key = key[0].name + "." + key[1]
+        # check this first for speed
+        i = self.indexes.get(key)
+        if i is not None:
+            return self.state[i]
+        if key in self.dep_vars:
+            return self.get_dep_var(key)
+        else:
+            return self.extra[key]
+
+    def get_dep_var(self, key):
+        """Return the dependent variable *key*, computing it at most once per
+        block of state.
+
+        Dependent variables read each other through this object (a current
+        reads its conductance, which reads the open probability), so every
+        quantity in the chain is shared by all readers. Nothing is cached for
+        single time points, where the state changes on every solver step.
+        """
+        state = self.state
+        if not self.memoize:
+            return self.dep_vars[key](self)
+        if self._cache_state is not state:
+            self._cache = {}
+            self._cache_state = state
         try:
-            # try this first for speed
-            return self.state[self.indexes[key]]
+            return self._cache[key]
         except KeyError:
-            if key in self.dep_vars:
-                return self.dep_vars[key](self)
-            else:
-                return self.extra[key]
+            val = self.dep_vars[key](self)
+            self._cache[key] = val
+            return val
 
     def keys(self):
         return list(self.indexes.keys()) + list(self.dep_vars.keys()) + list(self.extra.keys())
@@ -232,6 +577,23 @@ class SimState(object):
             rep += f"  {k} = {self.state[i][-1]}\n"
         return rep
 
+    def reduce(self, keys, dtype=None):
+        """Return a SimState holding only *keys* (plus 't') as plain arrays.
+
+        Dependent variables are evaluated once here and the full diff. eq.
+        state is not kept, so the result is small and does not hold on to
+        the original buffer. Keys that are not present are skipped.
+        """
+        cols = {}
+        for k in keys:
+            if k != 't' and k in self:
+                cols[k] = np.array(self[k], dtype=dtype)
+        cols['t'] = np.array(self['t'])
+        n = len(cols['t']) if cols['t'].ndim > 0 else 0
+        reduced = SimState([], {}, np.empty((0, n)), integrator=self.integrator, **cols)
+        reduced.events = self.events
+        return reduced
+
     def get_final_state(self):
         """Return a dictionary of all diff. eq. state variables and dependent
         variables for all objects in the simulation.
@@ -266,22 +628,76 @@ class SimState(object):
 
         return state
 
+    def get_values_at_index(self, index, keys):
+        """Return a dictionary of only *keys* at sample *index*.
+
+        Unlike `get_state_at_index()`, dependent variables that were not
+        asked for are not evaluated, and values already computed for the
+        whole block are reused. Keys that are not present are skipped.
+        """
+        clip = not np.isscalar(self["t"])
+        values = {}
+        point = None
+        for k in keys:
+            i = self.indexes.get(k)
+            if i is not None:
+                values[k] = self.state[i, index] if clip else self.state[i]
+            elif k in self.extra:
+                v = self.extra[k]
+                values[k] = v[index] if clip else v
+            elif k in self.dep_vars:
+                if clip and self._cache_state is self.state and k in self._cache:
+                    values[k] = self._cache[k][index]
+                    continue
+                if point is None:
+                    point = self.copy()
+                    if clip:
+                        point.set_state(self.state[:, index])
+                        point.extra = {ek: ev[index] for ek, ev in self.extra.items()}
+                values[k] = point[k]
+        return values
+
     def get_slice(self, sl):
+        """Return a SimState for a range of samples. Arrays are views into
+        this state's buffer, not copies.
+        """
         kwds = {'difeq_state': self.state[:, sl]}
         for k,v in self.extra.items():
             kwds[k] = v[sl]
-        return self.copy(**kwds)
+        s = self.copy(**kwds)
+        if len(self.events) > 0 and len(s['t']) > 0:
+            # keep only the events within the slice
+            t0, t1 = s['t'][0], s['t'][-1]
+            s.events = {k: ev.get_slice((ev['t'] >= t0) & (ev['t'] <= t1)) for k, ev in self.events.items()}
+        if self._cache_state is self.state and len(self._cache) > 0:
+            # dependent variables computed so far are sliced along with the state
+            s._cache = {k: v[sl] for k, v in self._cache.items() if isinstance(v, np.ndarray)}
+            s._cache_state = s.state
+        return s
 
     def copy(self, **kwds):
-        default_kwds = {
-            'difeq_vars': self.difeq_vars,
-            'dep_vars': self.dep_vars,
-            'difeq_state': self.state, 
-            'integrator': self.integrator,
-        }
-        default_kwds.update(self.extra)
-        default_kwds.update(kwds)
-        return SimState(**default_kwds)
+        """Return a shallow copy that shares all arrays with this state.
+
+        Keyword arguments replace the matching constructor arguments or extra
+        values.
+        """
+        s = object.__new__(type(self))
+        s.__dict__.update(self.__dict__)
+        s.extra = dict(self.extra)
+        if 'difeq_vars' in kwds:
+            s.difeq_vars = kwds.pop('difeq_vars')
+            s.indexes = dict([(k, i) for i, k in enumerate(s.difeq_vars)])
+        if 'difeq_state' in kwds:
+            s.state = kwds.pop('difeq_state')
+        if 'dep_vars' in kwds:
+            s.dep_vars = kwds.pop('dep_vars')
+        if 'integrator' in kwds:
+            s.integrator = kwds.pop('integrator')
+        s.extra.update(kwds)
+        # the copy may see different inputs, so it starts with an empty cache
+        s._cache = {}
+        s._cache_state = None
+        return s
 
 
 class SimObject(object):
@@ -433,6 +849,8 @@ class Channel(Mechanism):
             type(self).compute_rates()
         self.dep_state_vars["G"] = self.conductance
         self.dep_state_vars["OP"] = self.open_probability
+        self._curve_cache = OrderedDict()
+        self._last_curves = None  # (key, curves) of the last array that is not a grid
 
     @property
     def gmax(self):
@@ -459,14 +877,104 @@ class Channel(Mechanism):
         self._gmax = None
 
     def conductance(self, state):
-        op = self.open_probability(state)
+        op = state.dep_var(self, "OP", self.open_probability)
         return self.gmax * op
 
     def current(self, state):
         vm = state[self.section, "V"]
-        g = self.conductance(state)
+        g = state.dep_var(self, "G", self.conductance)
         return -g * (vm - self.erev)
 
+    def gate_curves(self, V, temp):
+        """Return an OrderedDict of gate name: (steady-state value, time
+        constant in s) evaluated at the membrane potentials *V* (V, array)
+        and temperature *temp* (C). Implemented by channels that have gates.
+        """
+        return OrderedDict()
+
+    def gate_inf_tau(self, V, temp=None):
+        """Steady-state value and time constant (s) of each gating variable
+        at membrane potentials *V* (V), as an OrderedDict of gate name:
+        (inf, tau), computed together in one evaluation of the kinetics.
+
+        Evenly spaced voltage grids (such as plot axes) are cached per range,
+        number of points, shift and temperature (the simulation's temperature
+        if *temp* is None), and returned read-only. Other arrays, such as the
+        points probed while locating fixed points, are computed every time
+        and do not displace cached grids; only the last of them is kept, as
+        the same points are often evaluated several times in a row.
+        """
+        if temp is None:
+            temp = self.sim.temp
+        V = np.asarray(V, dtype=float)
+        params = (float(temp), float(getattr(self, "shift", 0)))
+        key = _grid_key(V)
+        if key is None:
+            key = (V.shape, V.tobytes()) + params
+            if self._last_curves is None or self._last_curves[0] != key:
+                self._last_curves = (key, self._eval_gate_curves(V, temp))
+            return self._last_curves[1]
+        key += params
+        curves = self._curve_cache.get(key)
+        if curves is not None:
+            self._curve_cache.move_to_end(key)
+            return curves
+        curves = self._eval_gate_curves(V, temp)
+        for inf, tau in curves.values():
+            inf.flags.writeable = False
+            tau.flags.writeable = False
+        self._curve_cache[key] = curves
+        if len(self._curve_cache) > 16:
+            self._curve_cache.popitem(last=False)
+        return curves
+
+    def _eval_gate_curves(self, V, temp):
+        # rate equations like x / (exp(x) - 1) are 0/0 at isolated voltages
+        # and lose all precision close to them; there, use the mean of the
+        # curves 0.1 uV to either side. All three are evaluated in one call.
+        curves = OrderedDict()
+        with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+            stacked = self.gate_curves(np.stack([V, V - 1e-7, V + 1e-7]), temp)
+            for gate, (inf, tau) in stacked.items():
+                fixed = []
+                for c in (inf, tau):
+                    c = np.broadcast_to(c, (3,) + V.shape)
+                    mean = 0.5 * (c[1] + c[2])
+                    bad = ~np.isfinite(c[0]) | (np.abs(c[0] - mean) > 1e-6 * np.abs(mean))
+                    fixed.append(np.where(bad, mean, c[0]))
+                curves[gate] = tuple(fixed)
+        return curves
+
+    def gate_inf(self, V, temp=None):
+        """Steady-state value of each gating variable at membrane potentials
+        *V* (V), as an OrderedDict of gate name: array. See `gate_inf_tau()`.
+        """
+        return OrderedDict((k, v[0]) for k, v in self.gate_inf_tau(V, temp).items())
+
+    def gate_tau(self, V, temp=None):
+        """Time constant (s) of each gating variable at membrane potentials
+        *V* (V), as an OrderedDict of gate name: array. See `gate_inf_tau()`.
+        """
+        return OrderedDict((k, v[1]) for k, v in self.gate_inf_tau(V, temp).items())
+
+    def open_probability_inf(self, V, temp=None, gates=None):
+        """Open probability at membrane potentials *V* (V, array) with every
+        gate at its steady state, except those given in *gates* (a dict of
+        gate name: values), which are broadcast against *V*.
+
+        This evaluates the channel's own `open_probability()` on a SimState
+        built from the gate curves, so it works for any channel.
+        """
+        V = np.asarray(V, dtype=float)
+        values = OrderedDict(self.gate_inf(V, temp))
+        if gates is not None:
+            values.update(gates)
+        arrays = np.broadcast_arrays(V, *values.values())
+        keys = [self.section.name + ".V"] + [self.name + "." + g for g in values]
+        state = SimState(keys, {}, np.vstack([a.ravel() for a in arrays]))
+        op = np.broadcast_to(self.open_probability(state), (arrays[0].size,))
+        return op.reshape(arrays[0].shape)
+
     @staticmethod
     def interpolate_rates(rates, val, minval, step):
         """Helper function for interpolating kinetic rates from precomputed
@@ -524,7 +1032,7 @@ class Section(SimObject):
         for mech in self.mechanisms:
             if not mech.enabled:
                 continue
-            Im += mech.current(state)
+            Im += state.dep_var(mech, "I", mech.current)
 
         dv = Im / self.cap
         return [dv]
@@ -619,7 +1127,7 @@ class PatchClamp(Mechanism):
 
     def get_cmd_from_state(self, state):
         if isinstance(state['t'], np.ndarray):
-            return [self.get_cmd(t) for t in state['t']]            
+            return np.array([self.get_cmd(t) for t in state['t']])
         else:
             return self.get_cmd(state['t'])
 
@@ -744,6 +1252,17 @@ class HHK(Channel):
             n = 0.
         return n, n
 
+    def gate_kinetics(self, vm):
+        """Rate constants (1/ms) at *vm* (mV relative to rest, shifted)."""
+        an = (0.1 - 0.01 * vm) / (np.exp(1.0 - 0.1 * vm) - 1.0)
+        bn = 0.125 * np.exp(-vm / 80.0)
+        return an, bn
+
+    def gate_curves(self, V, temp):
+        q10 = 3 ** ((temp - 6.3) / 10.0)
+        an, bn = self.gate_kinetics((V - self.shift + 65e-3) * 1000.0)
+        return OrderedDict([("n", (an / (an + bn), 1e-3 / (q10 * (an + bn))))])
+
     def derivatives(self, state):
         # temperature dependence of rate constants
         q10 = 3 ** ((self.sim.temp - 6.3) / 10.0)
@@ -757,8 +1276,7 @@ class HHK(Channel):
         # disabled for now -- does not seem to improve speed.
         # an, bn = self.interpolate_rates(self.rates, vm, self.rates_vmin, self.rates_vstep)
 
-        an = (0.1 - 0.01 * vm) / (np.exp(1.0 - 0.1 * vm) - 1.0)
-        bn = 0.125 * np.exp(-vm / 80.0)
+        an, bn = self.gate_kinetics(vm)
         dn = q10 * (an * (1.0 - n) - bn * n)
         return [dn * 1e3]
 
@@ -808,6 +1326,22 @@ class HHNa(Channel):
             n = 0.
         return n, n
 
+    def gate_kinetics(self, vm):
+        """Rate constants (1/ms) at *vm* (mV relative to rest, shifted)."""
+        am = (2.5 - 0.1 * vm) / (np.exp(2.5 - 0.1 * vm) - 1.0)
+        bm = 4.0 * np.exp(-vm / 18.0)
+        ah = 0.07 * np.exp(-vm / 20.0)
+        bh = 1.0 / (np.exp(3.0 - 0.1 * vm) + 1.0)
+        return am, bm, ah, bh
+
+    def gate_curves(self, V, temp):
+        q10 = 3 ** ((temp - 6.3) / 10.0)
+        am, bm, ah, bh = self.gate_kinetics((V - self.shift + 65e-3) * 1000.0)
+        return OrderedDict([
+            ("m", (am / (am + bm), 1e-3 / (q10 * (am + bm)))),
+            ("h", (ah / (ah + bh), 1e-3 / (q10 * (ah + bh)))),
+        ])
+
     def derivatives(self, state):
         # temperature dependence of rate constants
         q10 = 3 ** ((self.sim.temp - 6.3) / 10.0)
@@ -824,12 +1358,8 @@ class HHNa(Channel):
         # am, bm, ah, bh = self.interpolate_rates(self.rates, vm, self.rates_vmin, self.rates_vstep)
 
         with warnings.catch_warnings(record=True) as w:
-            am = (2.5 - 0.1 * vm) / (np.exp(2.5 - 0.1 * vm) - 1.0)
-            bm = 4.0 * np.exp(-vm / 18.0)
+            am, bm, ah, bh = self.gate_kinetics(vm)
             dm = q10 * (am * (1.0 - m) - bm * m)
-
-            ah = 0.07 * np.exp(-vm / 20.0)
-            bh = 1.0 / (np.exp(3.0 - 0.1 * vm) + 1.0)
             dh = q10 * (ah * (1.0 - h) - bh * h)
             # if abs(vm) > 1:
             #     print("Vm: ", vm)
@@ -874,6 +1404,18 @@ class IH(Channel):
             n = 0.
         return n, n
 
+    def gate_kinetics(self, vm):
+        """Steady state and time constants (ms) at *vm* (mV, shifted)."""
+        Hinf = 1.0 / (1.0 + np.exp((vm + 68.9) / 6.5))
+        tauF = np.exp((vm + 158.6) / 11.2) / (1.0 + np.exp((vm + 75.0) / 5.5))
+        tauS = np.exp((vm + 183.6) / 15.24)
+        return Hinf, tauF, tauS
+
+    def gate_curves(self, V, temp):
+        # no temperature dependence
+        Hinf, tauF, tauS = self.gate_kinetics((V - self.shift) * 1000.0)
+        return OrderedDict([("f", (Hinf, tauF * 1e-3)), ("s", (Hinf.copy(), tauS * 1e-3))])
+
     def derivatives(self, state):
         vm = state[self.section, "V"] - self.shift
         # f, self.lastf = self.check_state(state, "f", self.lastf) # [self, "f"]
@@ -881,9 +1423,7 @@ class IH(Channel):
         f = state[self, "f"]
         s = state[self, "s"]
         vm *= 1000.0  ##  ..and that Vm is in mV
-        Hinf = 1.0 / (1.0 + np.exp((vm + 68.9) / 6.5))
-        tauF = np.exp((vm + 158.6) / 11.2) / (1.0 + np.exp((vm + 75.0) / 5.5))
-        tauS = np.exp((vm + 183.6) / 15.24)
+        Hinf, tauF, tauS = self.gate_kinetics(vm)
         df = (Hinf - f) / tauF
         ds = (Hinf - s) / tauS
         return [df * 1e3, ds * 1e3]
@@ -924,6 +1464,27 @@ class KA(Channel):
     #         n = 0.
     #     return n, n
 
+    def gate_kinetics(self, vm):
+        """Steady states and time constants (ms, at 22 C) at *vm* (mV, shifted)."""
+        Ainf = np.power(1.0 + np.exp(-(vm + 31.0) / 6.0), -0.25)
+        Binf = np.power(1.0 + np.exp((vm+66.0)/7.0), -0.5)
+        Cinf = Binf
+        tauA = (7.0*np.exp((vm + 60.0) / 14.0) + 29* np.exp(-(vm + 60.0) / 24))
+        tauA = 100.0*(1.0/tauA) + 0.1
+        tauB = (14.0*np.exp((vm+60.0)/27.0) + 29 * np.exp(-(vm+60.0)/24))
+        tauB = 1000.0*(1.0/tauB) + 1.0
+        tauC = 10.0 + 90.0/(1.0 + np.exp((-66.0 - vm) / 17.0))
+        return Ainf, Binf, Cinf, tauA, tauB, tauC
+
+    def gate_curves(self, V, temp):
+        q10 = 3 ** ((temp - 22.0) / 10.0)
+        Ainf, Binf, Cinf, tauA, tauB, tauC = self.gate_kinetics((V - self.shift) * 1000.0)
+        return OrderedDict([
+            ("a", (Ainf, tauA * 1e-3 / q10)),
+            ("b", (Binf, tauB * 1e-3 / q10)),
+            ("c", (Cinf.copy(), tauC * 1e-3 / q10)),
+        ])
+
     def derivatives(self, state):
         self.q10 = 3 ** ((self.sim.temp - 22.0) / 10.0)
         vm = state[self.section, "V"] - self.shift
@@ -932,16 +1493,9 @@ class KA(Channel):
         c = state[self, "c"]
 
         vm *= 1000.0  ##  ..and that Vm is in mV
-        Ainf = np.power(1.0 + np.exp(-(vm + 31.0) / 6.0), -0.25)
-        Binf = np.power(1.0 + np.exp((vm+66.0)/7.0), -0.5)
-        Cinf = Binf
-        tauA = (7.0*np.exp((vm + 60.0) / 14.0) + 29* np.exp(-(vm + 60.0) / 24))
-        tauA = 100.0*(1.0/tauA) + 0.1
+        Ainf, Binf, Cinf, tauA, tauB, tauC = self.gate_kinetics(vm)
         tauA = tauA/self.q10
-        tauB = (14.0*np.exp((vm+60.0)/27.0) + 29 * np.exp(-(vm+60.0)/24))
-        tauB = 1000.0*(1.0/tauB) + 1.0
         tauB = tauB/self.q10
-        tauC = 10.0 + 90.0/(1.0 + np.exp((-66.0 - vm) / 17.0))
         tauC = tauC/self.q10
         da = (Ainf - a) / tauA
         db = (Binf - b) / tauB
@@ -987,14 +1541,8 @@ class CaL(Channel):
     #         n = 0.
     #     return n, n
 
-    def derivatives(self, state):
-
-
-        vm = state[self.section, "V"] - self.shift
-        m = state[self, "m"]
-        h = state[self, "m"]
-
-        vm *= 1000.0  ##  ..and that Vm is in mV
+    def gate_kinetics(self, vm):
+        """Steady states and time constants (ms) at *vm* (mV, shifted)."""
         am = 0.055*(-27.0-vm)/(np.exp((-27.0-vm)/3.8) - 1)
         bm =  0.94*np.exp((-75.0-vm)/17.0)
         mtau = 1./(am + bm)
@@ -1003,6 +1551,22 @@ class CaL(Channel):
         bh = 0.0065 / (np.exp((-vm - 15.0)/28.0)+1.0)
         htau = 1./(ah + bh)
         hinf = ah * htau
+        return minf, mtau, hinf, htau
+
+    def gate_curves(self, V, temp):
+        # no temperature dependence
+        minf, mtau, hinf, htau = self.gate_kinetics((V - self.shift) * 1000.0)
+        return OrderedDict([("m", (minf, mtau * 1e-3)), ("h", (hinf, htau * 1e-3))])
+
+    def derivatives(self, state):
+
+
+        vm = state[self.section, "V"] - self.shift
+        m = state[self, "m"]
+        h = state[self, "m"]
+
+        vm *= 1000.0  ##  ..and that Vm is in mV
+        minf, mtau, hinf, htau = self.gate_kinetics(vm)
         dm = (minf - m) / mtau
         dh = (hinf - h) / htau
         return [dm * 1e3, dh * 1e3]
@@ -1047,6 +1611,20 @@ class CaT(Channel):
     #         n = 0.
     #     return n, n
 
+    def gate_kinetics(self, vm):
+        """Steady states and time constants (ms, at 24 C) at *vm* (mV, shifted)."""
+        minf = 1.0 / (1.0 + np.exp(-(vm  + 57.0)/6.2))
+        hinf = 1.0 / (1.0 + np.exp((vm + 81.0)/4.0))
+        mtau = 0.612 + 1.0/(np.exp((vm + 16.8)/18.2) + np.exp(-(vm+ 132.)/16.7))
+        htau = 85.0 + 1.0/(np.exp((vm + 46.0)/4.0) + np.exp(-(vm + 405.0)/50.0))
+        return minf, mtau, hinf, htau
+
+    def gate_curves(self, V, temp):
+        # only m is temperature dependent; shift is in mV for this channel
+        q10m = 5 ** ((temp - 24.0) / 10.0)
+        minf, mtau, hinf, htau = self.gate_kinetics((V - self.shift / 1000.0) * 1000.0)
+        return OrderedDict([("m", (minf, mtau * 1e-3 / q10m)), ("h", (hinf, htau * 1e-3))])
+
     def derivatives(self, state):
         self.q10m = 5 ** ((self.sim.temp - 24.0) / 10.0)
         self.q10h = 3 ** ((self.sim.temp - 24.0) / 10.0)
@@ -1055,12 +1633,9 @@ class CaT(Channel):
         h = state[self, "h"]
 
         vm *= 1000.0  ##  ..and that Vm is in mV
-        minf = 1.0 / (1.0 + np.exp(-(vm  + 57.0)/6.2))
-        hinf = 1.0 / (1.0 + np.exp((vm + 81.0)/4.0))
-        mtau = 0.612 + 1.0/(np.exp((vm + 16.8)/18.2) + np.exp(-(vm+ 132.)/16.7))
+        minf, mtau, hinf, htau = self.gate_kinetics(vm)
         mtau = mtau/self.q10m
         #if vm < -80.0:
-        htau = 85.0 + 1.0/(np.exp((vm + 46.0)/4.0) + np.exp(-(vm + 405.0)/50.0))
         #    htau = np.exp((vm + 467.0/66.6)) / self.q10h
         #else:
         #    htau = (28.0 + np.exp(-(vm+22.0)/10.5)) / self.q10h
@@ -1093,6 +1668,27 @@ class LGNa(Channel):
     def open_probability(self, state):
         return state[self, "m"] ** 3 * state[self, "h"]
 
+    def gate_kinetics(self, vm):
+        """Steady states and time constants (ms, at 37 C) at *vm* (mV)."""
+        am = (-3020 + 40 * vm) / (1.0 - np.exp(-(vm - 75.5) / 13.5))
+        bm = 1.2262 / np.exp(vm / 42.248)
+        mtau = 1 / (am + bm)
+        minf = am * mtau
+
+        ah = 0.0035 / np.exp(vm / 24.186)
+        # note: bh as originally written causes integration failures; we use
+        # an equivalent expression that behaves nicely under floating point stress.
+        # bh = (0.8712 + 0.017 * vm) / (1.0 - np.exp(-(51.25 + vm) / 5.2))
+        bh = 0.017 * (51.25 + vm) / (1.0 - np.exp(-(51.25 + vm) / 5.2))
+        htau = 1.0 / (ah + bh)
+        hinf = ah * htau
+        return minf, mtau, hinf, htau
+
+    def gate_curves(self, V, temp):
+        q10 = 3 ** ((temp - 37.0) / 10.0)
+        minf, mtau, hinf, htau = self.gate_kinetics(V * 1000.0)
+        return OrderedDict([("m", (minf, mtau * 1e-3 / q10)), ("h", (hinf, htau * 1e-3 / q10))])
+
     def derivatives(self, state):
         # temperature dependence of rate constants
         # TODO: not sure about the base temp:
@@ -1105,19 +1701,8 @@ class LGNa(Channel):
         # vm = vm + 65e-3   ## gating parameter eqns assume resting is 0mV
         vm *= 1000.0  ##  ..and that Vm is in mV
 
-        am = (-3020 + 40 * vm) / (1.0 - np.exp(-(vm - 75.5) / 13.5))
-        bm = 1.2262 / np.exp(vm / 42.248)
-        mtau = 1 / (am + bm)
-        minf = am * mtau
+        minf, mtau, hinf, htau = self.gate_kinetics(vm)
         dm = q10 * (minf - m) / mtau
-
-        ah = 0.0035 / np.exp(vm / 24.186)
-        # note: bh as originally written causes integration failures; we use
-        # an equivalent expression that behaves nicely under floating point stress.
-        # bh = (0.8712 + 0.017 * vm) / (1.0 - np.exp(-(51.25 + vm) / 5.2))
-        bh = 0.017 * (51.25 + vm) / (1.0 - np.exp(-(51.25 + vm) / 5.2))
-        htau = 1.0 / (ah + bh)
-        hinf = ah * htau
         dh = q10 * (hinf - h) / htau
         return [dm * 1e3, dh * 1e3]
 
@@ -1141,6 +1726,19 @@ class LGKfast(Channel):
     def open_probability(self, state):
         return state[self, "n"] ** 2
 
+    def gate_kinetics(self, vm):
+        """Steady state and time constant (ms, at 37 C) at *vm* (mV)."""
+        an = (vm - 95) / (1.0 - np.exp(-(vm - 95) / 11.8))
+        bn = 0.025 / np.exp(vm / 22.22)
+        ntau = 1 / (an + bn)
+        ninf = an * ntau
+        return ninf, ntau
+
+    def gate_curves(self, V, temp):
+        q10 = 3 ** ((temp - 37.0) / 10.0)
+        ninf, ntau = self.gate_kinetics(V * 1000.0)
+        return OrderedDict([("n", (ninf, ntau * 1e-3 / q10))])
+
     def derivatives(self, state):
         # temperature dependence of rate constants
         # TODO: not sure about the base temp:
@@ -1152,10 +1750,7 @@ class LGKfast(Channel):
         # vm = vm + 65e-3   ## gating parameter eqns assume resting is 0mV
         vm *= 1000.0  ##  ..and that Vm is in mV
 
-        an = (vm - 95) / (1.0 - np.exp(-(vm - 95) / 11.8))
-        bn = 0.025 / np.exp(vm / 22.22)
-        ntau = 1 / (an + bn)
-        ninf = an * ntau
+        ninf, ntau = self.gate_kinetics(vm)
         dn = q10 * (ninf - n) / ntau
         return [dn * 1e3]
 
@@ -1179,6 +1774,19 @@ class LGKslow(Channel):
     def open_probability(self, state):
         return state[self, "n"] ** 4
 
+    def gate_kinetics(self, vm):
+        """Steady state and time constant (ms, at 37 C) at *vm* (mV)."""
+        an = 0.014 * (vm + 44) / (1.0 - np.exp(-(44 + vm) / 2.3))
+        bn = 0.0043 / np.exp((vm + 44) / 34)
+        ntau = 1 / (an + bn)
+        ninf = an * ntau
+        return ninf, ntau
+
+    def gate_curves(self, V, temp):
+        q10 = 3 ** ((temp - 37.0) / 10.0)
+        ninf, ntau = self.gate_kinetics(V * 1000.0)
+        return OrderedDict([("n", (ninf, ntau * 1e-3 / q10))])
+
     def derivatives(self, state):
         # temperature dependence of rate constants
         # TODO: not sure about the base temp:
@@ -1190,10 +1798,7 @@ class LGKslow(Channel):
         # vm = vm + 65e-3   ## gating parameter eqns assume resting is 0mV
         vm *= 1000.0  ##  ..and that Vm is in mV
 
-        an = 0.014 * (vm + 44) / (1.0 - np.exp(-(44 + vm) / 2.3))
-        bn = 0.0043 / np.exp((vm + 44) / 34)
-        ntau = 1 / (an + bn)
-        ninf = an * ntau
+        ninf, ntau = self.gate_kinetics(vm)
         dn = q10 * (ninf - n) / ntau
 
         return [dn * 1e3]
@@ -135,6 +135,17 @@ class NeuronView(pg.GraphicsLayoutWidget):
         for item in self.items:
             item.update_state(state)
 
+    def state_keys(self):
+        """Names of the state variables read by `update_state()`."""
+        if getattr(self, '_state_keys', None) is None:
+            keys = []
+            for item in self.items:
+                for k in item.state_keys():
+                    if k not in keys:
+                        keys.append(k)
+            self._state_keys = keys
+        return list(self._state_keys)
+
     def show_circuit(self, show):
         self.mask.setVisible(show)
         for i in self.items:
@@ -208,6 +219,9 @@ class Cell(NeuronItem):
         self.soma.setBrush(pg.mkBrush(v_color(vm)))
         self.current.update_state(state)
 
+    def state_keys(self):
+        return [self.key + ".V", self.current.key]
+
     def show_circuit(self, show):
         self.cap.setVisible(show)
     
@@ -349,6 +363,9 @@ class Channel(NeuronItem):
         nop = np.clip(op / self.maxop, 0, 1)
         self.current.update_state(state)
 
+    def state_keys(self):
+        return [self.key, self.current.key]
+
     def show_circuit(self, show):
         self.batt.setVisible(show)
         self.res.setVisible(show)
@@ -474,6 +491,9 @@ class Pipette(NeuronItem):
         self.voltage.setBrush(QtGui.QBrush(grad))
         self.current.update_state(state)
 
+    def state_keys(self):
+        return [self.key + ".V", ".".join(self.key.split(".")[:-1]) + ".V", self.current.key]
+
     def show_circuit(self, show):
         self.cap.setVisible(show)
         self.res.setVisible(show)
@@ -0,0 +1,325 @@
+# -*- coding: utf-8 -*-
+"""
+NeuroDemo - Physiological neuron sandbox for educational purposes
+
+Phase-plane analysis of a section's excitability.
+
+`PhasePlane` reduces the dynamics of a section to the membrane potential V
+and one gating variable y (for example the HH potassium gate n); every other
+gate is held at its steady state for the current V. The fixed points of this
+reduction are those of the full model. Nullclines, fixed points and the
+vector field are computed on a (V, y) grid with array operations.
+
+Each channel's open probability over the grid depends only on its gating
+kinetics, so it is cached per temperature and shift. Changing a channel's
+Gmax or Erev, enabling a channel or changing the injected current only
+re-weights the cached grids, which takes a millisecond or two.
+"""
+import numpy as np
+import pyqtgraph as pg
+from pyqtgraph.Qt import QtGui
+import neurodemo.units as NU
+from .neuronsim import Channel, PatchClamp
+
+
+class PhasePlane(object):
+    """Nullclines, fixed points and vector field of *section* in the plane of
+    V and the gating variable *y_key* (e.g. 'soma.IK.n').
+
+    The grid has shape[0] voltages spanning *v_range* and shape[1] values of
+    y spanning *y_range*. Results reflect the section's current parameters
+    each time they are requested.
+    """
+
+    def __init__(self, section, y_key, v_range=(-100 * NU.mV, 60 * NU.mV), y_range=(0.0, 1.0), shape=(321, 201)):
+        self.section = section
+        self._op_cache = {}
+        self.set_variable(y_key)
+        self.set_range(v_range, y_range, shape)
+
+    @staticmethod
+    def variables(section):
+        """Keys of the gating variables of all enabled channels in *section*."""
+        keys = []
+        for mech in section.mechanisms:
+            if isinstance(mech, Channel) and mech.enabled:
+                keys.extend(mech.name + "." + gate for gate in mech.difeq_state())
+        return keys
+
+    def set_variable(self, y_key):
+        chan_name, _, gate = y_key.rpartition(".")
+        for mech in self.section.mechanisms:
+            if isinstance(mech, Channel) and mech.name == chan_name and gate in mech.difeq_state():
+                break
+        else:
+            raise ValueError("%r is not a gating variable of section %s" % (y_key, self.section.name))
+        self.y_key = y_key
+        self.channel = mech
+        self.gate = gate
+        self._op_cache = {}
+
+    def set_range(self, v_range, y_range, shape):
+        self.v = np.linspace(v_range[0], v_range[1], shape[0])
+        self.y = np.linspace(y_range[0], y_range[1], shape[1])
+        self._op_cache = {}
+
+    @property
+    def temp(self):
+        return self.section.sim.temp
+
+    def channels(self):
+        return [m for m in self.section.mechanisms if isinstance(m, Channel) and m.enabled]
+
+    def injected_current(self):
+        """Holding current of any enabled current clamp on the section."""
+        i_inj = 0.0
+        for mech in self.section.mechanisms:
+            if isinstance(mech, PatchClamp) and mech.enabled and mech.mode == "ic":
+                i_inj += mech.holding["ic"]
+        return i_inj
+
+    def _open_probability(self, chan):
+        """Open probability of *chan* on the grid: shape (len(v), len(y)) for
+        the channel that owns y, (len(v), 1) for the others.
+        """
+        key = (self.temp, float(getattr(chan, "shift", 0)))
+        cached = self._op_cache.get(chan.name)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        V = self.v[:, np.newaxis]
+        if chan is self.channel:
+            op = chan.open_probability_inf(V, self.temp, {self.gate: self.y[np.newaxis, :]})
+        else:
+            op = chan.open_probability_inf(V, self.temp)
+        self._op_cache[chan.name] = (key, op)
+        return op
+
+    def dvdt(self, i_inj=None):
+        """dV/dt (V/s) on the grid, shape (len(v), len(y))."""
+        if i_inj is None:
+            i_inj = self.injected_current()
+        V = self.v[:, np.newaxis]
+        im = np.full((len(self.v), len(self.y)), float(i_inj))
+        for chan in self.channels():
+            im -= chan.gmax * self._open_probability(chan) * (V - chan.erev)
+        return im / self.section.cap
+
+    def y_nullcline(self):
+        """Steady state of y at each grid voltage."""
+        return self.channel.gate_inf(self.v, self.temp)[self.gate]
+
+    def v_nullcline(self, i_inj=None):
+        """Branches of the V nullcline as an array (n_branches, len(v)) of y
+        values, NaN where a branch does not exist at that voltage. Branch k
+        holds the k-th crossing (in increasing y) at each voltage.
+        """
+        f = self.dvdt(i_inj)
+        pos = f > 0
+        iv, iy = np.nonzero(pos[:, :-1] != pos[:, 1:])
+        f0 = f[iv, iy]
+        f1 = f[iv, iy + 1]
+        y = self.y[iy] + (self.y[iy + 1] - self.y[iy]) * f0 / (f0 - f1)
+        # crossings come sorted by voltage, then y
+        branch = np.arange(len(iv)) - np.searchsorted(iv, iv)
+        out = np.full((branch.max() + 1 if len(iv) > 0 else 0, len(self.v)), np.nan)
+        out[branch, iv] = y
+        return out
+
+    def rates(self, V, y, i_inj=None):
+        """Return (dV/dt, dy/dt) at arbitrary points (*V*, *y*)."""
+        if i_inj is None:
+            i_inj = self.injected_current()
+        V, y = np.broadcast_arrays(np.asarray(V, dtype=float), np.asarray(y, dtype=float))
+        im = np.full(V.shape, float(i_inj))
+        for chan in self.channels():
+            gates = {self.gate: y} if chan is self.channel else None
+            im -= chan.gmax * chan.open_probability_inf(V, self.temp, gates) * (V - chan.erev)
+        inf, tau = self.channel.gate_inf_tau(V, self.temp)[self.gate]
+        return im / self.section.cap, (inf - y) / tau
+
+    def fixed_points(self, i_inj=None, passes=3, refine=64):
+        """Intersections of the nullclines.
+
+        Sign changes of dV/dt along the y nullcline are located on the grid,
+        then narrowed by *refine* in each of *passes* passes.
+
+        Returns a dict of arrays: 'V', 'y', and 'kind', which classifies each
+        point of the reduced system from its Jacobian as 'stable node',
+        'stable focus', 'unstable node', 'unstable focus' or 'saddle'.
+        """
+        if i_inj is None:
+            i_inj = self.injected_current()
+        yinf = lambda v: self.channel.gate_inf(v, self.temp)[self.gate]
+        f = self.rates(self.v, yinf(self.v), i_inj)[0]
+        i = np.nonzero((f[:-1] > 0) != (f[1:] > 0))[0]
+        # zoom in on all brackets at once: sample each one at refine + 1
+        # points and keep the sub-interval where the sign changes
+        lo = self.v[i]
+        width = self.v[1] - self.v[0]
+        frac = np.linspace(0, 1, refine + 1)
+        for _ in range(passes):
+            pts = lo[:, np.newaxis] + width * frac[np.newaxis, :]
+            pos = self.rates(pts, yinf(pts), i_inj)[0] > 0
+            j = np.argmax(pos[:, :-1] != pos[:, 1:], axis=1)
+            lo = pts[np.arange(len(lo)), j]
+            width = width / refine
+        V = lo + 0.5 * width
+        y = yinf(V)
+
+        # Jacobian by central differences, all points in one evaluation
+        hv, hy = 1e-6, 1e-6
+        n = len(V)
+        dv, dy = self.rates(
+            np.concatenate([V - hv, V + hv, V, V]),
+            np.concatenate([y, y, y - hy, y + hy]),
+            i_inj,
+        )
+        dv = dv.reshape(4, n)
+        dy = dy.reshape(4, n)
+        a = (dv[1] - dv[0]) / (2 * hv)
+        b = (dv[3] - dv[2]) / (2 * hy)
+        c = (dy[1] - dy[0]) / (2 * hv)
+        d = (dy[3] - dy[2]) / (2 * hy)
+        tr = a + d
+        det = a * d - b * c
+        kind = np.where(tr < 0, "stable ", "unstable ").astype(object)
+        kind += np.where(tr ** 2 < 4 * det, "focus", "node")
+        kind[det < 0] = "saddle"
+        return {"V": V, "y": y, "kind": kind.astype(str)}
+
+    def vector_field(self, step=(16, 10), i_inj=None):
+        """(V, y, dV/dt, dy/dt) on every *step*-th grid point."""
+        sv = slice(step[0] // 2, None, step[0])
+        sy = slice(step[1] // 2, None, step[1])
+        V, Y = np.meshgrid(self.v[sv], self.y[sy], indexing="ij")
+        inf, tau = self.channel.gate_inf_tau(self.v, self.temp)[self.gate]
+        inf, tau = inf[sv], tau[sv]
+        dy = (inf[:, np.newaxis] - Y) / tau[:, np.newaxis]
+        return V, Y, self.dvdt(i_inj)[sv, sy], dy
+
+
+class PhasePlaneWindow(QtGui.QWidget):
+    """Plot the phase plane of *section*, with the trajectory of the running
+    simulation drawn over the nullclines.
+    """
+
+    def __init__(self, section, trail=5000):
+        QtGui.QWidget.__init__(self)
+        self.section = section
+        self.trail = trail
+        self.engine = None
+        self.setWindowTitle("Phase plane")
+        self.resize(600, 600)
+        self.layout = QtGui.QGridLayout()
+        self.layout.setContentsMargins(0, 0, 0, 0)
+        self.setLayout(self.layout)
+        self.var_combo = QtGui.QComboBox()
+        self.layout.addWidget(self.var_combo, 0, 0)
+        self.var_combo.currentTextChanged.connect(self.set_variable)
+
+        self.plot = pg.PlotWidget(labels={'bottom': ('Membrane potential', 'V')})
+        self.layout.addWidget(self.plot, 1, 0)
+        self.field = self.plot.plot(pen=(90, 90, 90), connect='pairs')
+        self.y_null = self.plot.plot(pen=pg.mkPen('c', width=2))
+        self.v_null = []
+        self.fixed = pg.ScatterPlotItem(size=12, pen='w')
+        self.plot.addItem(self.fixed)
+        self.trajectory = self.plot.plot(pen='y')
+        self.trail_v = np.empty(0)
+        self.trail_y = np.empty(0)
+        self.refresh_variables()
+
+    def refresh_variables(self):
+        """Update the list of gating variables after channels are toggled.
+        Return True if the list changed (and the plot was redrawn).
+        """
+        keys = PhasePlane.variables(self.section)
+        current = self.var_combo.currentText()
+        if keys == [self.var_combo.itemText(i) for i in range(self.var_combo.count())]:
+            return False
+        self.var_combo.blockSignals(True)
+        self.var_combo.clear()
+        self.var_combo.addItems(keys)
+        if current in keys:
+            self.var_combo.setCurrentText(current)
+        else:
+            # start in the classic V-n plane when there is a potassium n gate
+            n_gates = [k for k in keys if k.endswith(".n")]
+            if len(n_gates) > 0:
+                self.var_combo.setCurrentText(n_gates[0])
+        self.var_combo.blockSignals(False)
+        self.set_variable(self.var_combo.currentText())
+        return True
+
+    def set_variable(self, y_key):
+        if y_key == "":
+            self.engine = None
+        elif self.engine is None:
+            self.engine = PhasePlane(self.section, y_key)
+        elif y_key != self.engine.y_key:
+            self.engine.set_variable(y_key)
+        self.trail_v = np.empty(0)
+        self.trail_y = np.empty(0)
+        self.trajectory.setData([], [])
+        self.plot.setLabels(left=y_key)
+        self.update_plot()
+
+    def update_plot(self):
+        """Redraw nullclines, fixed points and vector field for the current
+        parameters of the section.
+        """
+        if self.refresh_variables():
+            return
+        eng = self.engine
+        if eng is None:
+            return
+        i_inj = eng.injected_current()
+        self.y_null.setData(eng.v, eng.y_nullcline())
+
+        branches = eng.v_nullcline(i_inj)
+        while len(self.v_null) < len(branches):
+            self.v_null.append(self.plot.plot(pen=pg.mkPen('m', width=2), connect='finite'))
+        for i, curve in enumerate(self.v_null):
+            if i < len(branches):
+                curve.setData(eng.v, branches[i])
+            else:
+                curve.setData([], [])
+
+        # vector field as short segments of equal length in screen proportion
+        V, Y, dv, dy = eng.vector_field(i_inj=i_inj)
+        vspan = eng.v[-1] - eng.v[0]
+        yspan = eng.y[-1] - eng.y[0]
+        nv = dv / vspan
+        ny = dy / yspan
+        norm = np.hypot(nv, ny)
+        norm[norm == 0] = 1
+        length = 0.6 / V.shape[0]
+        x = np.stack([V, V + nv / norm * length * vspan], axis=-1).ravel()
+        y = np.stack([Y, Y + ny / norm * length * yspan], axis=-1).ravel()
+        self.field.setData(x, y)
+
+        fp = eng.fixed_points(i_inj)
+        spots = []
+        for v, y, kind in zip(fp['V'], fp['y'], fp['kind']):
+            spots.append({
+                'pos': (v, y),
+                'brush': pg.mkBrush('g') if kind.startswith('stable') else None,
+                'symbol': 't' if kind == 'saddle' else 'o',
+                'data': kind,
+            })
+        self.fixed.setData(spots)
+
+    def add_results(self, results):
+        """Extend the trajectory with simulated blocks (each of which starts
+        with the last sample of the previous one).
+        """
+        if self.engine is None:
+            return
+        key = self.engine.y_key
+        vkey = self.section.name + ".V"
+        blocks = [r for r in results if key in r]
+        if len(blocks) == 0:
+            return
+        self.trail_v = np.concatenate([self.trail_v] + [r[vkey][1:] for r in blocks])[-self.trail:]
+        self.trail_y = np.concatenate([self.trail_y] + [r[key][1:] for r in blocks])[-self.trail:]
+        self.trajectory.setData(self.trail_v, self.trail_y)
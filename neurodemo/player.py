@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+NeuroDemo - Physiological neuron sandbox for educational purposes
+
+Replay of recorded sessions.
+"""
+import numpy as np
+from pyqtgraph.Qt import QtCore
+from .archive import ResultArchive
+from .runner import SimRunner
+
+
+class SessionPlayer(SimRunner):
+    """Play back a recorded session (a ResultArchive) in place of SimRunner.
+
+    Timing, speed and the display queue are inherited from SimRunner, so the
+    display, trigger capture and everything else connected to ``new_result``
+    work unchanged; only `next_block()` differs. Blocks are read from the
+    memory-mapped archive instead of being computed, so playback at any speed
+    costs only I/O and drawing. As with the simulation, each block starts with
+    the last sample of the previous one.
+    """
+    finished = QtCore.Signal()  # emitted when the end of the recording is reached
+
+    def __init__(self, archive, keys=None):
+        SimRunner.__init__(self, sim=None)
+        if not isinstance(archive, ResultArchive):
+            archive = ResultArchive(archive)
+        self.archive = archive
+        self.keys = archive.keys() if keys is None else keys
+        self.blocksize = 500
+        self.index = 0  # sample that starts the next block
+
+    @property
+    def time(self):
+        """Time of the current playback position."""
+        if len(self.archive) == 0:
+            return 0.0
+        return float(self.archive['t'][self.index])
+
+    @property
+    def dt(self):
+        t = self.archive['t']
+        return float(t[1] - t[0]) if len(t) > 1 else 0.0
+
+    def seek(self, t):
+        """Move the playback position to the first sample at or after *t*."""
+        i = int(np.searchsorted(self.archive['t'], t))
+        self.index = max(0, min(i, len(self.archive) - 1))
+
+    def at_end(self):
+        return self.index >= len(self.archive) - 1
+
+    def next_block(self, blocksize):
+        if self.at_end():
+            self.stop()
+            self.finished.emit()
+            return None
+        stop = min(len(self.archive), self.index + blocksize)
+        result = self.archive.get_samples(slice(self.index, stop), self.keys)
+        self.index = stop - 1
+        return result
+
+    def start_recording(self, path, keys, **kwds):
+        raise RuntimeError("A replayed session cannot be recorded again.")
@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+"""
+NeuroDemo - Physiological neuron sandbox for educational purposes
+
+Streaming recorder that appends selected keys of every simulation block to a
+chunked, compressed store on disk. Writing happens in a background thread so
+the simulation loop never waits on the disk.
+
+Three storage formats are supported:
+
+* HDF5 (if h5py is installed): one resizable, chunked, gzip-compressed
+  dataset per key in a single file.
+* A directory of compressed ``chunk_NNNNNN.npz`` files plus ``index.json``,
+  which lists the keys and the time range and sample count of every chunk.
+* A memory-mapped ResultArchive (see archive.py), for recordings that will
+  be re-opened for random access.
+
+Use `read_recording()` to load a recording back regardless of its format.
+"""
+import json
+import os
+import queue
+import threading
+import numpy as np
+from .archive import ArchiveWriter, ResultArchive
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+
+class HDF5Writer(object):
+    """Append columns to resizable datasets in an HDF5 file."""
+
+    def __init__(self, path, keys, dtype, chunk_size, compress=True):
+        self.file = h5py.File(path, 'w')
+        self.file.attrs['keys'] = json.dumps(keys)
+        self.events = []
+        self.datasets = {}
+        for k in keys:
+            self.datasets[k] = self.file.create_dataset(
+                k,
+                shape=(0,),
+                maxshape=(None,),
+                dtype=np.float64 if k == 't' else dtype,
+                chunks=(chunk_size,),
+                compression='gzip' if compress else None,
+            )
+
+    def write(self, columns):
+        for k, v in columns.items():
+            ds = self.datasets[k]
+            n = ds.shape[0]
+            ds.resize((n + len(v),))
+            ds[n:] = v
+
+    def add_event(self, event):
+        self.events.append(event)
+        self.file.attrs['events'] = json.dumps(self.events)
+
+    def close(self):
+        self.file.close()
+
+
+class NpyChunkWriter(object):
+    """Write each chunk of columns to its own compressed ``.npz`` file and
+    keep ``index.json`` up to date, so a recording interrupted at any point
+    can still be read up to its last complete chunk.
+    """
+
+    def __init__(self, path, keys, dtype, chunk_size, compress=True):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.keys = keys
+        self.dtype = dtype
+        self.compress = compress
+        self.index = {'keys': keys, 'dtype': np.dtype(dtype).name, 'chunks': [], 'events': []}
+        self._write_index()
+
+    def write(self, columns):
+        t = columns['t']
+        fname = 'chunk_%06d.npz' % len(self.index['chunks'])
+        save = np.savez_compressed if self.compress else np.savez
+        save(os.path.join(self.path, fname), **columns)
+        self.index['chunks'].append({
+            'file': fname,
+            't0': float(t[0]),
+            't1': float(t[-1]),
+            'n': len(t),
+        })
+        self._write_index()
+
+    def add_event(self, event):
+        self.index['events'].append(event)
+        self._write_index()
+
+    def _write_index(self):
+        tmp = os.path.join(self.path, 'index.json.tmp')
+        with open(tmp, 'w') as fh:
+            json.dump(self.index, fh, indent=1)
+        os.replace(tmp, os.path.join(self.path, 'index.json'))
+
+    def close(self):
+        pass
+
+
+class ChunkedRecorder(object):
+    """Continuously record selected keys of simulation results to disk.
+
+    Call `add()` with every result block (for example from
+    ``SimRunner.new_result``). The requested keys are extracted on the
+    caller's thread (dependent variables must be evaluated while the
+    simulation's parameters match the block) and handed to a writer thread,
+    which collects them into chunks of *chunk_size* samples and writes each
+    chunk to disk. Only unwritten chunks are held in memory: at most
+    *max_queued* blocks wait for the writer thread, and blocks that arrive
+    while the queue is full are dropped (and counted in ``n_dropped``) rather
+    than letting memory grow when the disk cannot keep up.
+
+    The first sample of each block repeats the last sample of the previous
+    block and is not recorded twice. Events such as clamp triggers can be
+    stored alongside the data with `add_event()`.
+
+    Parameters
+    ----------
+    path : str
+        Output file (HDF5) or directory (npy chunks, archive).
+    keys : list
+        Names of the variables to record; 't' is always included.
+    backend : str | None
+        'hdf5', 'npy', 'archive', or None to use HDF5 when h5py is available.
+    max_queued : int
+        Number of blocks that may wait for the writer thread.
+    """
+
+    backends = {'hdf5': HDF5Writer, 'npy': NpyChunkWriter, 'archive': ArchiveWriter}
+
+    def __init__(self, path, keys, chunk_size=65536, dtype=np.float32, compress=True, backend=None,
+                 max_queued=256):
+        if backend is None:
+            backend = 'npy' if h5py is None else 'hdf5'
+        if backend not in self.backends:
+            raise ValueError("Backend must be one of %s" % list(self.backends))
+        if backend == 'hdf5' and h5py is None:
+            raise ImportError("Recording to HDF5 requires h5py.")
+        self.path = path
+        self.keys = ['t'] + [k for k in keys if k != 't']
+        self.chunk_size = chunk_size
+        self.dtype = dtype
+        self.compress = compress
+        self.backend = backend
+        self.n_samples = 0  # samples handed to the writer thread
+        self.n_written = 0  # samples written to disk
+        self.n_dropped = 0  # samples not recorded because the queue was full
+        self.error = None  # exception raised in the writer thread, if any
+        self._last_t = None
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._thread = None
+
+    def start(self):
+        writer = self.make_writer()
+        self._thread = threading.Thread(target=self._write_loop, args=(writer,), daemon=True)
+        self._thread.start()
+
+    def make_writer(self):
+        return self.backends[self.backend](self.path, self.keys, self.dtype, self.chunk_size, self.compress)
+
+    def running(self):
+        return self._thread is not None
+
+    def add(self, result):
+        """Queue the recorded keys of one result block for writing."""
+        if self._thread is None:
+            return
+        t = result['t']
+        start = 1 if self._last_t is not None and len(t) > 0 and t[0] <= self._last_t else 0
+        if len(t) <= start:
+            return
+        columns = {'t': np.array(t[start:], dtype=np.float64)}
+        for k in self.keys[1:]:
+            if k in result:
+                columns[k] = np.array(result[k][start:], dtype=self.dtype)
+            else:
+                # keep columns aligned if a mechanism is disabled
+                columns[k] = np.full(len(columns['t']), np.nan, dtype=self.dtype)
+        self._last_t = t[-1]
+        try:
+            self._queue.put_nowait(('data', columns))
+        except queue.Full:
+            # the writer is behind; drop the block rather than grow the queue
+            self.n_dropped += len(columns['t'])
+            return
+        self.n_samples += len(columns['t'])
+
+    def add_event(self, event):
+        """Queue a JSON-serializable *event* to be stored with the recording.
+        Events are never dropped; this waits if the queue is full.
+        """
+        if self._thread is not None:
+            self._queue.put(('event', event))
+
+    def stop(self):
+        """Write everything still queued, close the file and stop the thread."""
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        if self.error is not None:
+            raise self.error
+
+    def _write_loop(self, writer):
+        pending = []
+        npending = 0
+        try:
+            while True:
+                item = self._queue.get()
+                columns = None
+                if item is not None:
+                    kind, payload = item
+                    if kind == 'event':
+                        writer.add_event(payload)
+                        continue
+                    columns = payload
+                    pending.append(columns)
+                    npending += len(columns['t'])
+                while npending >= self.chunk_size or (item is None and npending > 0):
+                    chunk, pending, npending = self._take_chunk(pending, npending)
+                    writer.write(chunk)
+                    self.n_written += len(chunk['t'])
+                if item is None:
+                    break
+        except Exception as exc:
+            self.error = exc
+            # keep taking items so that callers never wait on a full queue
+            while item is not None:
+                item = self._queue.get()
+        finally:
+            writer.close()
+
+    def _take_chunk(self, pending, npending):
+        """Split at most chunk_size samples off the front of *pending*."""
+        n = min(self.chunk_size, npending)
+        joined = {k: np.concatenate([c[k] for c in pending]) for k in self.keys}
+        chunk = {k: v[:n] for k, v in joined.items()}
+        rest = [{k: v[n:] for k, v in joined.items()}] if npending > n else []
+        return chunk, rest, npending - n
+
+
+def read_recording(path, keys=None):
+    """Load a recording made by ChunkedRecorder into a dict of arrays."""
+    if ResultArchive.is_archive(path):
+        archive = ResultArchive(path)
+        keys = archive.keys() if keys is None else ['t'] + [k for k in keys if k != 't']
+        return {k: np.array(archive[k]) for k in keys}
+    if os.path.isdir(path):
+        with open(os.path.join(path, 'index.json')) as fh:
+            index = json.load(fh)
+        keys = index['keys'] if keys is None else ['t'] + [k for k in keys if k != 't']
+        parts = {k: [] for k in keys}
+        for chunk in index['chunks']:
+            with np.load(os.path.join(path, chunk['file'])) as data:
+                for k in keys:
+                    parts[k].append(data[k])
+        return {k: np.concatenate(v) if len(v) > 0 else np.empty(0) for k, v in parts.items()}
+    if h5py is None:
+        raise ImportError("Reading HDF5 recordings requires h5py.")
+    with h5py.File(path, 'r') as f:
+        if keys is None:
+            keys = json.loads(f.attrs['keys'])
+        return {k: f[k][:] for k in keys}
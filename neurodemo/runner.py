@@ -3,14 +3,79 @@
 NeuroDemo - Physiological neuron sandbox for educational purposes
 Luke Campagnola 2015
 """
+from collections import deque
 from pyqtgraph.Qt import QtCore
 from timeit import default_timer as def_timer
+from .recorder import ChunkedRecorder
+
+
+class BlockQueue(object):
+    """Queue of result blocks waiting to be displayed.
+
+    Every block is handed to the display; none are discarded, so plots never
+    lose samples. What the policies decide is how the display keeps up:
+
+    * 'coalesce': all pending blocks are handed to the display at once, so
+      it appends all of their data but redraws only once.
+    * 'block': as 'coalesce', but the producer is also expected to check
+      `full()` and wait while *maxlen* blocks are pending.
+    """
+
+    policies = ['coalesce', 'block']
+
+    def __init__(self, maxlen=8, policy='coalesce'):
+        self.maxlen = maxlen
+        self.set_policy(policy)
+        self.blocks = deque()
+        self.reset_counters()
+
+    def set_policy(self, policy):
+        if policy not in self.policies:
+            raise ValueError("Policy must be one of %s" % self.policies)
+        self.policy = policy
+
+    def reset_counters(self):
+        self.n_queued = 0  # blocks added
+        self.n_displayed = 0  # blocks handed to the display
+        self.n_frames = 0  # calls to take() that returned blocks, i.e. redraws
+        self.n_coalesced = 0  # blocks drawn without a redraw of their own
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def full(self):
+        return len(self.blocks) >= self.maxlen
+
+    def put(self, block):
+        """Add a block. Return True if the queue was empty before."""
+        was_empty = len(self.blocks) == 0
+        self.blocks.append(block)
+        self.n_queued += 1
+        return was_empty
+
+    def take(self):
+        """Remove and return all pending blocks, to be drawn in one redraw."""
+        blocks = list(self.blocks)
+        self.blocks.clear()
+        self.n_displayed += len(blocks)
+        if len(blocks) > 0:
+            self.n_frames += 1
+            self.n_coalesced += len(blocks) - 1
+        return blocks
 
 
 class SimRunner(QtCore.QObject):
     """Run a simulation continuously and emit signals whenever results are ready.    
+
+    ``new_result`` is emitted for every block and is meant for consumers that
+    must see all of the data (trigger capture, recording). Blocks for display
+    go through `display_queue`; ``display_ready`` is emitted when the queue
+    becomes non-empty, and the display collects them with
+    `take_display_blocks()`. Because the signal is not re-emitted while blocks
+    are still pending, a slow display cannot make Qt's event queue grow.
     """
     new_result = QtCore.Signal(object)
+    display_ready = QtCore.Signal()
     
     def __init__(self, sim):
         QtCore.QObject.__init__(self)
@@ -28,6 +93,9 @@ class SimRunner(QtCore.QObject):
         self.timer = QtCore.QTimer()
         self.timer.timeout.connect(self.run_once)
         self.counter = 0
+        self.display_queue = BlockQueue()
+        self.n_stalled = 0  # timer ticks skipped because the display was behind
+        self.recorder = None
         
     def start(self, blocksize=500, **kwds):
         self.starttime = def_timer()
@@ -42,10 +110,52 @@ class SimRunner(QtCore.QObject):
         return self.timer.isActive()
 
     def run_once(self):
+        if self.display_queue.policy == 'block' and self.display_queue.full():
+            # wait for the display to catch up before computing more
+            self.n_stalled += 1
+            return
         self.counter += 1
         blocksize = int(max(2, self.blocksize * self.speed))
-        result = self.sim.run(blocksize, **self.run_args)
+        result = self.next_block(blocksize)
+        if result is None:
+            return
+        if self.recorder is not None:
+            self.recorder.add(result)
         self.new_result.emit(result)
+        if self.display_queue.put(result):
+            self.display_ready.emit()
         
+    def next_block(self, blocksize):
+        """Produce the next result block of *blocksize* samples, or None if
+        there is nothing more to run. Subclasses override this to get blocks
+        from somewhere other than the simulation (see SessionPlayer).
+        """
+        return self.sim.run(blocksize, **self.run_args)
+
+    def take_display_blocks(self):
+        """Return the list of blocks the display should draw now."""
+        return self.display_queue.take()
+
+    def set_display_policy(self, policy):
+        self.display_queue.set_policy(policy)
+
     def set_speed(self, speed):
         self.speed = speed
+
+    def start_recording(self, path, keys, **kwds):
+        """Record *keys* of every block to *path* until `stop_recording()`.
+
+        Extra keyword arguments are passed to ChunkedRecorder.
+        """
+        self.stop_recording()
+        self.recorder = ChunkedRecorder(path, keys, **kwds)
+        self.recorder.start()
+        return self.recorder
+
+    def stop_recording(self):
+        """Finish writing the current recording and return its recorder."""
+        recorder = self.recorder
+        self.recorder = None
+        if recorder is not None:
+            recorder.stop()
+        return recorder
@@ -91,7 +91,7 @@ class SequencePlotWindow(QtGui.QWidget):
         
         try:
             self.analyzer.add_data(t, data, info)
-        except:
+        except Exception:
             pg.debug.printExc('Error analyzing data:')
         self.show()
         
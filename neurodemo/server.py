@@ -0,0 +1,372 @@
+# -*- coding: utf-8 -*-
+"""
+NeuroDemo - Physiological neuron sandbox for educational purposes
+
+Local streaming server: runs one simulation (or mirrors the results of a
+running DemoWindow) and fans decimated result blocks out to many lightweight
+viewer clients over TCP or Unix sockets.
+
+Wire protocol
+-------------
+A client connects and sends one line of JSON describing its subscription::
+
+    {"keys": ["soma.V", "soma.PatchClamp.I"], "decimate": 10}
+
+The server then sends one frame per result block. Each frame is a 4-byte
+big-endian header length, a JSON header ``{"t0", "dt", "n", "keys"}``, and
+``len(keys) * n`` float32 values in key-major order.
+
+Frames are encoded once per distinct subscription, so serving N viewers costs
+one simulation plus one encoding per subscription. A client that has not
+finished receiving the previous frame simply skips the new one; slow viewers
+never block the simulation.
+"""
+import argparse
+import errno
+import json
+import logging
+import os
+import selectors
+import socket
+import struct
+import threading
+import time
+import numpy as np
+import neurodemo.units as NU
+
+logger = logging.getLogger(__name__)
+
+_header_len = struct.Struct('!I')
+
+
+def _make_socket(address):
+    """Return an unconnected socket for *address*: a (host, port) tuple for
+    TCP, or a filesystem path for a Unix socket.
+    """
+    if isinstance(address, (tuple, list)):
+        return socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    return socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+
+def _remove_stale_socket(path):
+    """Delete the Unix socket file at *path* if no server is listening on it
+    any more (left behind by a server that did not shut down cleanly).
+    """
+    if not os.path.exists(path):
+        return
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except ConnectionRefusedError:
+        os.unlink(path)
+    except OSError:
+        pass  # not a socket; let bind() report the problem
+    else:
+        raise OSError(errno.EADDRINUSE, "A server is already listening on %s" % path)
+    finally:
+        probe.close()
+
+
+def parse_address(text):
+    """Convert "host:port" to a TCP address tuple; anything else is taken as
+    a Unix socket path.
+    """
+    host, sep, port = text.rpartition(':')
+    if sep and port.isdigit():
+        return (host or '127.0.0.1', int(port))
+    return text
+
+
+def encode_block(result, keys, decimate=1):
+    """Encode the requested *keys* of a SimState as one frame.
+
+    The first sample of each block repeats the last sample of the previous
+    block, so it is skipped.
+    """
+    keys = [k for k in keys if k in result]
+    t = result['t']
+    sl = slice(1, None, max(1, int(decimate)))
+    tsub = t[sl]
+    payload = np.empty((len(keys), len(tsub)), dtype=np.float32)
+    for i, k in enumerate(keys):
+        payload[i] = result[k][sl]
+    header = json.dumps({
+        't0': float(tsub[0]) if len(tsub) > 0 else float(t[-1]),
+        'dt': float(t[1] - t[0]) * max(1, int(decimate)) if len(t) > 1 else 0.0,
+        'n': len(tsub),
+        'keys': keys,
+    }).encode()
+    return _header_len.pack(len(header)) + header + payload.tobytes()
+
+
+class _Client:
+    def __init__(self, sock):
+        self.sock = sock
+        self.inbuf = b''
+        self.spec = None  # (keys, decimate) once the subscription line arrives
+        self.pending = memoryview(b'')  # unsent part of the current frame
+        self.sent = 0
+        self.dropped = 0
+
+
+class SimServer(object):
+    """Fan simulation result blocks out to viewer clients.
+
+    Results are given to `publish()`, either by `run()` (headless mode) or by
+    connecting it to a SimRunner's ``new_result`` signal. Socket I/O happens
+    in a background thread started by `start()`.
+    """
+
+    def __init__(self, address=('127.0.0.1', 7723), backlog=64):
+        self.address = address
+        self.backlog = backlog
+        self.clients = []
+        self.frames_published = 0
+        self._lock = threading.Lock()
+        self._listener = None
+        self._thread = None
+        self._running = False
+        self._selector = None
+
+    def start(self):
+        sock = _make_socket(self.address)
+        if sock.family == socket.AF_INET:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        else:
+            _remove_stale_socket(self.address)
+        sock.bind(self.address)
+        sock.listen(self.backlog)
+        sock.setblocking(False)
+        # report the real port if 0 was requested
+        self.address = sock.getsockname()
+        self._listener = sock
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(sock, selectors.EVENT_READ, None)
+        self._running = True
+        self._thread = threading.Thread(target=self._io_loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        with self._lock:
+            for c in self.clients:
+                c.sock.close()
+            self.clients = []
+        if self._listener is not None:
+            unix = self._listener.family == socket.AF_UNIX
+            self._listener.close()
+            self._listener = None
+            if unix and os.path.exists(self.address):
+                os.unlink(self.address)
+        if self._selector is not None:
+            self._selector.close()
+            self._selector = None
+
+    def publish(self, result):
+        """Encode *result* once per distinct subscription and queue it to every
+        client that is ready for another frame. Never blocks.
+        """
+        frames = {}
+        with self._lock:
+            # _send_pending() may drop clients from the list
+            for c in list(self.clients):
+                if c.spec is None:
+                    continue
+                if len(c.pending) > 0:
+                    # client is still receiving the previous frame
+                    c.dropped += 1
+                    continue
+                if c.spec not in frames:
+                    frames[c.spec] = encode_block(result, *c.spec)
+                c.pending = memoryview(frames[c.spec])
+                self._send_pending(c)
+        self.frames_published += 1
+
+    def run(self, sim, blocksize=2048, duration=None, speed=1.0):
+        """Run *sim* headless, publishing every block.
+
+        Blocks are paced so that simulated time advances at *speed* times wall
+        clock time; use speed=None to run as fast as possible.
+        """
+        start = time.perf_counter()
+        t_start = sim.time
+        for result in sim.iter_blocks(blocksize, duration):
+            self.publish(result)
+            # publish() has encoded the block, so its storage can be reused
+            sim.release(result)
+            if speed is not None:
+                wait = (sim.time - t_start) / speed - (time.perf_counter() - start)
+                if wait > 0:
+                    time.sleep(wait)
+
+    def _send_pending(self, client):
+        # must be called with self._lock held
+        try:
+            n = client.sock.send(client.pending)
+        except BlockingIOError:
+            return
+        except OSError:
+            self._drop_client(client)
+            return
+        client.pending = client.pending[n:]
+        if len(client.pending) == 0:
+            client.sent += 1
+
+    def _drop_client(self, client):
+        # must be called with self._lock held
+        if client in self.clients:
+            self.clients.remove(client)
+            try:
+                self._selector.unregister(client.sock)
+            except (KeyError, ValueError):
+                pass
+            client.sock.close()
+
+    def _io_loop(self):
+        while self._running:
+            with self._lock:
+                for c in list(self.clients):
+                    events = selectors.EVENT_READ
+                    if len(c.pending) > 0:
+                        events |= selectors.EVENT_WRITE
+                    self._selector.modify(c.sock, events, c)
+            for key, events in self._selector.select(timeout=0.02):
+                if key.data is None:
+                    self._accept()
+                    continue
+                with self._lock:
+                    client = key.data
+                    if client not in self.clients:
+                        continue
+                    if events & selectors.EVENT_READ:
+                        self._read(client)
+                    if events & selectors.EVENT_WRITE and client in self.clients:
+                        self._send_pending(client)
+
+    def _accept(self):
+        try:
+            sock, addr = self._listener.accept()
+        except BlockingIOError:
+            return
+        sock.setblocking(False)
+        client = _Client(sock)
+        with self._lock:
+            self.clients.append(client)
+            self._selector.register(sock, selectors.EVENT_READ, client)
+
+    def _read(self, client):
+        # must be called with self._lock held
+        try:
+            data = client.sock.recv(4096)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b''
+        if data == b'':
+            self._drop_client(client)
+            return
+        client.inbuf += data
+        while b'\n' in client.inbuf:
+            line, client.inbuf = client.inbuf.split(b'\n', 1)
+            try:
+                msg = json.loads(line)
+                client.spec = (tuple(msg['keys']), max(1, int(msg.get('decimate', 1))))
+            except (ValueError, KeyError, TypeError):
+                self._drop_client(client)
+                return
+
+
+class ViewerClient(object):
+    """Minimal blocking client for a SimServer.
+
+    Iterating over the client yields ``(t, data)`` for every frame received,
+    where *data* maps each key to a float32 array.
+    """
+
+    def __init__(self, address, keys, decimate=1):
+        self.address = address
+        self.keys = list(keys)
+        self.decimate = decimate
+        self.sock = _make_socket(address)
+        self.sock.connect(address)
+        self.subscribe(self.keys, decimate)
+
+    def subscribe(self, keys, decimate=1):
+        """Change the keys and decimation used for subsequent frames."""
+        self.keys = list(keys)
+        self.decimate = decimate
+        msg = json.dumps({'keys': self.keys, 'decimate': decimate}) + '\n'
+        self.sock.sendall(msg.encode())
+
+    def _recv_exact(self, n):
+        buf = bytearray(n)
+        view = memoryview(buf)
+        while n > 0:
+            got = self.sock.recv_into(view, n)
+            if got == 0:
+                raise ConnectionError("Server closed the connection.")
+            view = view[got:]
+            n -= got
+        return bytes(buf)
+
+    def recv_block(self):
+        """Block until the next frame arrives and return ``(t, data)``."""
+        (hlen,) = _header_len.unpack(self._recv_exact(_header_len.size))
+        header = json.loads(self._recv_exact(hlen))
+        keys, n = header['keys'], header['n']
+        payload = np.frombuffer(self._recv_exact(4 * len(keys) * n), dtype=np.float32)
+        payload = payload.reshape(len(keys), n)
+        t = header['t0'] + np.arange(n) * header['dt']
+        return t, dict(zip(keys, payload))
+
+    def __iter__(self):
+        while True:
+            try:
+                yield self.recv_block()
+            except ConnectionError:
+                return
+
+    def close(self):
+        self.sock.close()
+
+
+def default_sim(temp=6.3, dt=20e-6):
+    """Build a single-compartment HH neuron with a patch clamp, matching the
+    'HH AP' preset of the demo window.
+    """
+    import neurodemo as ND
+    sim = ND.Sim(temp=temp, dt=dt)
+    soma = sim.add(ND.Section(name='soma'))
+    soma.add(ND.HHNa())
+    leak = soma.add(ND.Leak())
+    leak.gmax = 1 * NU.nS
+    soma.add(ND.HHK())
+    soma.add(ND.PatchClamp(mode='ic'))
+    return sim
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless NeuroDemo streaming server")
+    parser.add_argument('--address', default='127.0.0.1:7723',
+                        help="host:port to listen on, or a Unix socket path")
+    parser.add_argument('--blocksize', type=int, default=2048)
+    parser.add_argument('--speed', type=float, default=1.0)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    server = SimServer(parse_address(args.address))
+    server.start()
+    logger.info("Serving on %s", server.address)
+    try:
+        server.run(default_sim(), blocksize=args.blocksize, speed=args.speed)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""
+NeuroDemo - Physiological neuron sandbox for educational purposes
+
+Vectorized action potential feature extraction.
+
+`spike_features()` takes a whole stack of sweeps (n_sweeps x n_samples) and
+finds every spike in a single pass with array operations; there is no
+Python loop over sweeps or spikes. Spike times are interpolated between
+samples.
+"""
+import numpy as np
+
+# per-sweep features returned by spike_features(), in display order
+sweep_features = [
+    'count', 'latency', 'threshold', 'amplitude', 'half_width',
+    'ahp_depth', 'isi_mean', 'isi_cv', 'adaptation',
+]
+
+
+def _segment_reduce(ufunc, flat, starts, n_total):
+    """Apply *ufunc*.reduceat over the segments of *flat* that begin at the
+    sorted, unique indexes *starts* (each runs to the next start or to
+    *n_total*).
+    """
+    if len(starts) == 0:
+        return np.empty(0, dtype=flat.dtype)
+    return ufunc.reduceat(flat[:n_total], starts)
+
+
+def _interp_crossing(y0, y1, level):
+    """Fraction of a sample between y0 and y1 where *level* is crossed."""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        frac = (level - y0) / (y1 - y0)
+    return np.where(np.isfinite(frac), np.clip(frac, 0, 1), 0.0)
+
+
+def spike_features(data, dt, threshold=-30e-3, dvdt_threshold=20.0, dvdt_fraction=0.2, max_width=5e-3):
+    """Measure action potentials in a stack of voltage traces.
+
+    Parameters
+    ----------
+    data : array
+        Membrane potential, shape (n_sweeps, n_samples) or (n_samples,).
+    dt : float
+        Sample interval.
+    threshold : float
+        Voltage that must be crossed upward for a spike to be detected.
+    dvdt_threshold, dvdt_fraction : float
+        The spike threshold voltage is taken where dV/dt last rises above
+        the larger of *dvdt_threshold* (V/s) and *dvdt_fraction* times the
+        spike's maximum rate of rise, before the detection crossing. The
+        relative criterion keeps strong depolarizing steps, which charge the
+        membrane quickly, from pulling the threshold down to rest.
+    max_width : float
+        Longest rise time / half-width searched, in seconds.
+
+    Returns
+    -------
+    sweeps : dict
+        One array of length n_sweeps per name in `sweep_features`. Threshold,
+        amplitude, half-width and AHP depth are those of the first spike;
+        latency is the interpolated time of the first detection crossing.
+        Values are NaN where a sweep has too few spikes.
+    spikes : dict
+        Per-spike arrays: 'sweep', 'time', 'threshold', 'peak', 'amplitude',
+        'half_width' and 'ahp_depth', ordered by sweep and time.
+    """
+    data = np.asarray(data, dtype=float)
+    if data.ndim == 1:
+        data = data[np.newaxis]
+    nsw, ns = data.shape
+    if nsw == 0 or ns == 0:
+        # nothing to measure; every sweep has no spikes
+        sweeps = {k: np.full(nsw, np.nan) for k in sweep_features}
+        sweeps['count'] = np.zeros(nsw, dtype=int)
+        spikes = {k: np.empty(0) for k in ['time', 'threshold', 'peak', 'amplitude', 'half_width', 'ahp_depth']}
+        spikes['sweep'] = np.empty(0, dtype=int)
+        return sweeps, spikes
+    flat = data.ravel()
+    ntot = flat.size
+    lookback = max(2, int(np.ceil(max_width / dt)))
+
+    # upward crossings of the detection threshold
+    above = data >= threshold
+    sw, i = np.nonzero(~above[:, :-1] & above[:, 1:])
+    nsp = len(sw)
+    start = sw * ns + i  # flat index of the sample before each crossing
+    time = (i + _interp_crossing(flat[start], flat[start + 1], threshold)) * dt
+    sweep_start = sw * ns
+    sweep_end = sweep_start + ns
+
+    # each spike extends to the next spike in the same sweep or the sweep end
+    bounds = np.union1d(start, np.arange(nsw) * ns)
+    seg = np.searchsorted(bounds, start)
+
+    # peak value and (first) position of the peak in each spike segment
+    seg_max = _segment_reduce(np.maximum, flat, bounds, ntot)
+    peak = seg_max[seg]
+    seg_id = np.repeat(np.arange(len(bounds)), np.diff(np.append(bounds, ntot)))
+    is_peak = flat == seg_max[seg_id]
+    pos = np.where(is_peak, np.arange(ntot), ntot)
+    peak_idx = np.minimum.reduceat(pos, bounds)[seg] if nsp > 0 else np.empty(0, dtype=int)
+
+    dvdt = np.empty(ntot)
+    dvdt[:-1] = np.diff(flat) / dt
+    dvdt[-1] = 0
+
+    # samples before each peak, going back (used for the rise and half-width)
+    rise = peak_idx[:, np.newaxis] - np.arange(lookback)[np.newaxis, :]
+    rise_ok = rise > sweep_start[:, np.newaxis]
+    rise_c = np.clip(rise, 1, ntot - 1)
+    max_rise = np.where(rise_ok, dvdt[rise_c - 1], -np.inf).max(axis=1) if nsp > 0 else np.empty(0)
+    criterion = np.maximum(dvdt_threshold, dvdt_fraction * max_rise)
+
+    # threshold voltage: where dV/dt last rises above the criterion before
+    # the detection crossing
+    back = start[:, np.newaxis] - np.arange(lookback)[np.newaxis, ::-1]  # oldest first
+    back_valid = back >= sweep_start[:, np.newaxis]
+    slow = (dvdt[np.clip(back, 0, ntot - 1)] < criterion[:, np.newaxis]) & back_valid
+    has_slow = slow.any(axis=1)
+    last_slow = lookback - 1 - np.argmax(slow[:, ::-1], axis=1)
+    thr_idx = np.where(has_slow, back[np.arange(nsp), last_slow] + 1, np.maximum(back[:, 0], sweep_start))
+    thr_idx = np.minimum(thr_idx, start)
+    thr_v = flat[thr_idx] if nsp > 0 else np.empty(0)
+    amplitude = peak - thr_v
+
+    # half-width: interpolated crossings of the half-amplitude level on
+    # either side of the peak
+    half = thr_v + amplitude / 2
+    rise_below = (flat[rise_c - 1] < half[:, np.newaxis]) & rise_ok
+    r = np.argmax(rise_below, axis=1)
+    found_rise = rise_below.any(axis=1)
+    r_idx = rise_c[np.arange(nsp), r] - 1  # sample below half, before the crossing
+    t_rise = r_idx + _interp_crossing(flat[r_idx], flat[np.minimum(r_idx + 1, ntot - 1)], half)
+
+    fall = peak_idx[:, np.newaxis] + np.arange(lookback)[np.newaxis, :]
+    fall_ok = fall < sweep_end[:, np.newaxis] - 1
+    fall_c = np.clip(fall, 0, ntot - 2)
+    fall_below = (flat[fall_c + 1] < half[:, np.newaxis]) & fall_ok
+    f = np.argmax(fall_below, axis=1)
+    found_fall = fall_below.any(axis=1)
+    f_idx = fall_c[np.arange(nsp), f]  # sample above half, before the crossing
+    t_fall = f_idx + _interp_crossing(flat[f_idx], flat[np.minimum(f_idx + 1, ntot - 1)], half)
+    half_width = np.where(found_rise & found_fall, (t_fall - t_rise) * dt, np.nan)
+
+    # AHP: minimum between the peak and the next spike (or the sweep end)
+    ahp_bounds, ahp_inv = np.unique(np.concatenate([bounds, peak_idx]), return_inverse=True)
+    ahp_min = _segment_reduce(np.minimum, flat, ahp_bounds, ntot)
+    ahp_depth = thr_v - ahp_min[ahp_inv[len(bounds):]] if nsp > 0 else np.empty(0)
+
+    spikes = {
+        'sweep': sw,
+        'time': time,
+        'threshold': thr_v,
+        'peak': peak,
+        'amplitude': amplitude,
+        'half_width': half_width,
+        'ahp_depth': ahp_depth,
+    }
+
+    # per-sweep summaries
+    count = np.bincount(sw, minlength=nsw)
+    first = np.full(nsw, -1)
+    is_first = np.ones(nsp, dtype=bool)
+    is_first[1:] = sw[1:] != sw[:-1]
+    first[sw[is_first]] = np.nonzero(is_first)[0]
+    has = first >= 0
+
+    def first_of(values):
+        out = np.full(nsw, np.nan)
+        out[has] = values[first[has]]
+        return out
+
+    same = sw[1:] == sw[:-1]
+    isi = np.diff(time)[same]
+    isi_sw = sw[1:][same]
+    n_isi = np.bincount(isi_sw, minlength=nsw)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        isi_mean = np.bincount(isi_sw, isi, minlength=nsw) / n_isi
+        isi_var = np.bincount(isi_sw, isi ** 2, minlength=nsw) / n_isi - isi_mean ** 2
+        isi_cv = np.sqrt(np.maximum(isi_var, 0)) / isi_mean
+        isi_cv[n_isi < 2] = np.nan
+        # adaptation index: mean normalized difference of consecutive ISIs
+        pair = isi_sw[1:] == isi_sw[:-1]
+        adapt = ((isi[1:] - isi[:-1]) / (isi[1:] + isi[:-1]))[pair]
+        adapt_sw = isi_sw[1:][pair]
+        adaptation = np.bincount(adapt_sw, adapt, minlength=nsw) / np.bincount(adapt_sw, minlength=nsw)
+
+    sweeps = {
+        'count': count,
+        'latency': first_of(time),
+        'threshold': first_of(thr_v),
+        'amplitude': first_of(amplitude),
+        'half_width': first_of(half_width),
+        'ahp_depth': first_of(ahp_depth),
+        'isi_mean': isi_mean,
+        'isi_cv': isi_cv,
+        'adaptation': adaptation,
+    }
+    return sweeps, spikes
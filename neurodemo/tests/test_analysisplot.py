@@ -0,0 +1,17 @@
+import numpy as np
+from neurodemo.analysisplot import TrialStore
+
+
+def test_trial_store():
+    t = np.arange(100) * 1e-4
+    store = TrialStore([{'name': 'Vm', 'units': 'V'}, {'name': 'Ipip', 'units': 'A'}], t, capacity=2)
+    trials = [np.random.normal(size=(2, 100)) for i in range(5)]
+    for i, d in enumerate(trials):
+        store.add(d, i * 1e-11)
+    data = store.view()
+    assert data.shape == (2, 5, 100)
+    assert np.array_equal(data.asarray(), np.stack(trials, axis=1))
+    assert np.allclose(data.xvals('Trial'), np.arange(5) * 1e-11)
+    # the view is not a copy of the stored trials
+    assert np.shares_memory(data.asarray(), store.data)
+    assert data['Time': 0.0:0.001]['Vm'].mean(axis='Time').shape == (5,)
@@ -0,0 +1,94 @@
+import numpy as np
+import pytest
+from neurodemo.archive import ArchiveWriter, ResultArchive
+from neurodemo.recorder import ChunkedRecorder
+from neurodemo.tests.test_sim import make_hh_sim
+
+
+def test_result_archive(tmp_path):
+    sim, clamp = make_hh_sim()
+    path = str(tmp_path / 'archive')
+    rec = ChunkedRecorder(path, ['soma.V', 'soma.INa.I'], chunk_size=300, backend='archive')
+    rec.start()
+    blocks = []
+    for r in sim.iter_blocks(200, duration=10e-3):
+        rec.add(r)
+        blocks.append(r)
+    rec.stop()
+
+    arch = ResultArchive(path)
+    assert len(arch) == rec.n_written
+    assert isinstance(arch['soma.V'], np.memmap)
+    assert np.allclose(arch.t1, sim.time)
+
+    t0, t1 = 2e-3, 3e-3
+    sl = arch[t0:t1, 'soma.V']
+    assert sl.keys() == ['soma.V', 't']
+    assert sl['t'][0] >= t0 and sl['t'][-1] < t1
+    assert len(sl['t']) == 50
+
+    # same sample as SimState.get_state_at_time()
+    for r in blocks:
+        if r['t'][0] <= 4.5e-3 <= r['t'][-1]:
+            expected = r.get_state_at_time(4.5e-3)
+    state = arch.get_state_at_time(4.5e-3)
+    assert np.isclose(state['t'], expected['t'])
+    assert np.isclose(state['soma.V'], expected['soma.V'], atol=1e-6)
+
+
+def test_archive_growing(tmp_path):
+    path = str(tmp_path / 'archive')
+    writer = ArchiveWriter(path, ['soma.V'])
+    writer.write({'t': np.arange(10) * 1e-3, 'soma.V': np.zeros(10)})
+    arch = ResultArchive(path)
+    assert len(arch) == 10
+    v = arch['soma.V']
+
+    # data and events written after opening are picked up
+    writer.write({'t': np.arange(10, 25) * 1e-3, 'soma.V': np.ones(15)})
+    writer.add_event({'type': 'trigger', 't': 12e-3})
+    assert len(arch) == 25
+    assert np.allclose(arch.t1, 24e-3)
+    assert arch['soma.V'][-1] == 1 and len(v) == 10
+    assert arch.events == [{'type': 'trigger', 't': 12e-3}]
+
+    # malformed chunks are rejected before anything is written
+    with pytest.raises(ValueError):
+        writer.write({'t': np.arange(3) * 1e-3, 'soma.V': np.zeros(2)})
+    with pytest.raises(ValueError):
+        writer.write({'t': np.arange(3) * 1e-3})
+    writer.close()
+    assert len(ResultArchive(path)) == 25
+
+
+def test_session_player(tmp_path):
+    from neurodemo.player import SessionPlayer
+    sim, clamp = make_hh_sim()
+    path = str(tmp_path / 'session')
+    rec = ChunkedRecorder(path, ['soma.V'], backend='archive')
+    rec.start()
+    for r in sim.iter_blocks(200, duration=5e-3):
+        rec.add(r)
+    rec.add_event({'type': 'trigger', 't': 1e-3})
+    rec.stop()
+
+    player = SessionPlayer(path)
+    assert player.archive.events == [{'type': 'trigger', 't': 1e-3}]
+    blocks = []
+    player.new_result.connect(blocks.append)
+    player.blocksize = 100
+    while not player.at_end():
+        player.run_once()
+    # blocks overlap by one sample, like simulated blocks
+    assert all(b1['t'][0] == b0['t'][-1] for b0, b1 in zip(blocks[:-1], blocks[1:]))
+    v = np.concatenate([blocks[0]['soma.V']] + [b['soma.V'][1:] for b in blocks[1:]])
+    assert np.array_equal(v, player.archive['soma.V'])
+    # display queue and speed are shared with SimRunner
+    assert len(player.take_display_blocks()) == len(blocks)
+    finished = []
+    player.finished.connect(lambda: finished.append(True))
+    player.run_once()
+    assert finished == [True] and not player.running()
+
+    player.seek(2e-3)
+    assert np.isclose(player.time, 2e-3)
@@ -0,0 +1,166 @@
+import numpy as np
+import pytest
+import neurodemo.units as NU
+from neurodemo.buffers import RingBuffer, MinMaxPyramid, ResultBuffer, SampleRing
+from neurodemo.tests.test_sim import make_hh_sim
+
+
+def test_ring_buffer():
+    rb = RingBuffer(10)
+    rb.append(np.arange(4))
+    assert np.all(rb.view() == np.arange(4))
+    rb.append(np.arange(4, 13))
+    assert len(rb) == 10
+    assert np.all(rb.view() == np.arange(3, 13))
+    assert np.all(rb.view(3) == np.arange(10, 13))
+    # blocks larger than the capacity keep only the newest samples
+    rb.append(np.arange(13, 40))
+    assert np.all(rb.view() == np.arange(30, 40))
+    assert rb.n_written == 40
+    rb.resize(5)
+    assert np.all(rb.view() == np.arange(35, 40))
+
+    multi = RingBuffer(4, shape=(2,))
+    multi.append(np.arange(6).reshape(2, 3))
+    multi.append(np.arange(6, 10).reshape(2, 2))
+    assert np.all(multi.view() == [[1, 2, 6, 7], [4, 5, 8, 9]])
+
+
+def test_minmax_pyramid():
+    rng = np.random.default_rng(0)
+    pyr = MinMaxPyramid(5000, factor=4, min_buckets=16)
+    blocks = [rng.normal(size=rng.integers(1, 700)) for i in range(60)]
+    for b in blocks:
+        pyr.append(b)
+    x = np.concatenate(blocks)
+    n = len(x)
+    assert np.all(pyr.view() == x[-5000:])
+
+    # each level holds the min/max of complete, aligned buckets
+    for size, level in pyr.levels:
+        nb = n // size
+        ref = x[:nb * size].reshape(nb, size)[-len(level):]
+        assert np.all(level.view()[0] == ref.min(axis=1))
+        assert np.all(level.view()[1] == ref.max(axis=1))
+
+    # coarse reads stay small but keep the extremes
+    index, values = pyr.get(n - 5000, n, max_points=100)
+    assert len(values) <= 2 * 100 + 2
+    assert values.max() == x[-5000:].max()
+    assert values.min() == x[-5000:].min()
+
+    # short ranges come back at full resolution
+    index, values = pyr.get(n - 50, n, max_points=100)
+    assert np.all(values == x[-50:])
+    assert np.all(index == np.arange(n - 50, n))
+
+
+def test_minmax_pyramid_edges():
+    # the envelope of any range matches the samples in it exactly, including
+    # the partial buckets at either end (e.g. one partly evicted from the ring)
+    rng = np.random.default_rng(1)
+    for capacity in [777, 1953, 4097]:
+        pyr = MinMaxPyramid(capacity, min_buckets=16)
+        blocks = []
+        for i in range(40):
+            blocks.append(rng.normal(size=rng.integers(1, 1500)))
+            pyr.append(blocks[-1])
+            x = np.concatenate(blocks)
+            n, oldest = len(x), len(x) - len(pyr)
+            start = oldest + int(rng.integers(0, len(pyr)))
+            for a, b in [(oldest, n), (start, n), (oldest, max(start, oldest + 1))]:
+                index, values = pyr.get(a, b, max_points=50)
+                assert values.max() == x[a:b].max() and values.min() == x[a:b].min()
+                assert np.all(np.diff(index) >= 0)
+
+
+def test_result_buffer():
+    sim, clamp = make_hh_sim()
+    buf = ResultBuffer(max_duration=9 * NU.ms)
+    blocks = [sim.run(101) for i in range(10)]  # 2 ms each
+    for r in blocks:
+        buf.add(r)
+    # only enough blocks to cover the last 9 ms are kept
+    assert len(buf) == 5
+    assert buf.find_block(blocks[4]['t'][50]) is None
+    assert buf.find_block(blocks[7]['t'][50]) is blocks[7]
+    state = buf.get_state_at_time(blocks[8]['t'][20])
+    assert np.isclose(state['soma.V'], blocks[8]['soma.V'][20])
+    # negative times are relative to the newest sample
+    state = buf.get_state_at_time(-1 * NU.ms)
+    assert np.isclose(state['t'], blocks[-1]['t'][-1] - 1 * NU.ms, atol=sim.dt)
+
+    small = ResultBuffer(max_duration=None, max_bytes=3 * blocks[0].state.nbytes, keys=['soma.V', 'soma.INa.OP'])
+    for r in blocks:
+        small.add(r)
+    assert small.nbytes <= 3 * blocks[0].state.nbytes
+    state = small.get_state_at_time(blocks[-1]['t'][10])
+    assert set(state.keys()) == {'soma.V', 'soma.INa.OP', 't'}
+    assert np.isclose(state['soma.INa.OP'], blocks[-1]['soma.INa.OP'][10])
+
+
+def test_sample_ring():
+    sim, clamp = make_hh_sim()
+    ring = SampleRing(['soma.V', 'soma.missing'], capacity=1000)
+    blocks = [sim.run(300) for i in range(5)]
+    for b in blocks:
+        ring.append(b)
+    # the repeated first sample of each block is stored once
+    assert ring.n_written == 300 + 4 * 299
+    assert len(ring) == 1000
+    t = np.concatenate([blocks[0]['t']] + [b['t'][1:] for b in blocks[1:]])
+    v = np.concatenate([blocks[0]['soma.V']] + [b['soma.V'][1:] for b in blocks[1:]])
+    assert np.array_equal(ring.times(), t[-1000:])
+
+    # a window spanning several blocks, found by time
+    start = ring.index_at(t[500] + 0.3 * sim.dt)
+    assert start == 500
+    window = ring.get(start, start + 400)
+    assert np.array_equal(window[ring.rows['t']], t[500:900])
+    assert np.array_equal(window[ring.rows['soma.V']], v[500:900])
+    assert np.all(np.isnan(window[ring.rows['soma.missing']]))
+
+    # time going backward starts over without reusing absolute indexes
+    n = ring.n_written
+    sim2, clamp2 = make_hh_sim()
+    ring.append(sim2.run(100))
+    assert len(ring) == 100 and ring.oldest == n
+
+
+def test_sweep_view():
+    sim, clamp = make_hh_sim()
+    ring = SampleRing(['soma.V'], capacity=500)
+    ring.append(sim.run(300))
+    sweep = ring.sweep(100, 200)
+    assert sweep.dtype.names == ('soma.V', 't')
+    assert np.shares_memory(sweep['soma.V'], ring.ring._data)
+    assert not sweep['t'].flags.writeable
+    kept = sweep.materialize()
+    assert not np.shares_memory(kept['soma.V'], ring.ring._data)
+    v = sweep['soma.V'].copy()
+    # push the sweep's samples out of the ring
+    ring.append(sim.run(500))
+    assert not sweep.valid()
+    assert np.array_equal(kept['soma.V'], v)
+    with pytest.raises(RuntimeError):
+        sweep['soma.V']
+
+
+def test_result_buffer_scrub():
+    sim, clamp = make_hh_sim()
+    clamp.queue_command(np.ones(2000) * 300 * NU.pA, sim.dt)
+    rb = ResultBuffer(max_duration=None)
+    for i in range(4):
+        rb.add(sim.run(500))
+    keys = ['soma.V', 'soma.INa.OP', 'soma.IK.I', 'soma.missing', 't']
+    t = 23.3 * NU.ms
+    full = rb.get_state_at_time(t)
+    vals = rb.scrub(t, keys)
+    assert 'soma.missing' not in vals
+    for k in keys[:-2] + ['t']:
+        assert np.isclose(vals[k], full[k])
+    # cached per sample
+    assert rb.scrub(t, keys) is vals
+    # negative times are relative to the newest sample
+    assert rb.scrub(t - sim.time, keys)['t'] == vals['t']
+    assert rb.scrub(-1.0, keys) is None
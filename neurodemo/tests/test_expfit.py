@@ -0,0 +1,28 @@
+import numpy as np
+from neurodemo.expfit import fit_exponential
+
+
+def test_fit_exponential():
+    rng = np.random.default_rng(1)
+    t = 0.01 + np.arange(400) * 25e-6
+    taus = np.array([0.5e-3, 1e-3, 2e-3, 4e-3])
+    amps = np.array([10e-3, -15e-3, 5e-3, -20e-3])
+    y = -65e-3 + amps[:, None] * np.exp(-(t - t[0]) / taus[:, None])
+    noisy = y + rng.normal(0, 50e-6, y.shape)
+
+    # free offset, from the Prony estimate
+    fit = fit_exponential(t, noisy)
+    assert np.allclose(fit['tau'], taus, rtol=0.03)
+    assert np.allclose(fit['amp'], amps, rtol=0.03)
+    assert np.allclose(fit['offset'], -65e-3, atol=0.2e-3)
+
+    # fixed offset, from the log-linear estimate; exact data fit exactly
+    fit = fit_exponential(t, y, offset=-65e-3)
+    assert np.allclose(fit['tau'], taus, rtol=1e-6)
+    assert np.all(fit['offset'] == -65e-3)
+
+    # a trace with NaNs gives NaN without affecting the others
+    y[1, 10] = np.nan
+    fit = fit_exponential(t, y)
+    assert np.isnan(fit['tau'][1])
+    assert np.allclose(fit['tau'][[0, 2, 3]], taus[[0, 2, 3]], rtol=1e-6)
@@ -0,0 +1,23 @@
+import numpy as np
+import neurodemo.units as NU
+from neurodemo.ivcurve import steady_state_iv
+from neurodemo.tests.test_sim import make_hh_sim
+
+
+def test_steady_state_iv():
+    sim, clamp = make_hh_sim()
+    soma = clamp.section
+    V = np.linspace(-120, 60, 361) * NU.mV
+    total, currents = steady_state_iv(soma, V)
+    assert list(currents) == ['soma.INa', 'soma.Ileak', 'soma.IK']
+    assert np.allclose(total, sum(currents.values()))
+    assert np.allclose(currents['soma.Ileak'], soma.mechanisms[1].gmax * (V - soma.eleak))
+
+    # matches the current a simulated voltage clamp settles to
+    clamp.set_mode('vc')
+    for v in [-90 * NU.mV, -30 * NU.mV]:
+        clamp.set_holding('vc', v)
+        for i in range(10):
+            r = sim.run(2000)
+        vm = r['soma.V'][-1]
+        assert np.allclose(steady_state_iv(soma, [vm])[0], r['soma.PatchClamp.I'][-1], rtol=1e-3)
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+import neurodemo as ND
+import neurodemo.units as NU
+from neurodemo.phaseplane import PhasePlane
+from neurodemo.tests.test_sim import make_hh_sim
+
+
+def test_phase_plane():
+    sim, clamp = make_hh_sim()
+    soma = clamp.section
+    hhna = [m for m in soma.mechanisms if isinstance(m, ND.HHNa)][0]
+    assert PhasePlane.variables(soma) == ['soma.INa.m', 'soma.INa.h', 'soma.IK.n']
+    with pytest.raises(ValueError):
+        PhasePlane(soma, 'soma.IK.q')
+    pp = PhasePlane(soma, 'soma.IK.n')
+
+    # the fixed point is the resting state of the full simulation
+    for i in range(5):
+        r = sim.run(2000)
+    fp = pp.fixed_points()
+    assert len(fp['V']) == 1 and fp['kind'][0].startswith('stable')
+    assert np.allclose(fp['V'], r['soma.V'][-1], atol=1e-6)
+    assert np.allclose(fp['y'], r['soma.IK.n'][-1], atol=1e-5)
+
+    # dV/dt vanishes along the V nullcline
+    branch = pp.v_nullcline()[0]
+    ok = np.isfinite(branch)
+    assert ok.sum() > 100
+    dv = pp.rates(pp.v[ok], branch[ok])[0]
+    assert np.all(np.abs(dv) < 2.0)  # V/s; grid interpolation error only
+    assert np.allclose(pp.rates(pp.v, pp.y_nullcline())[1], 0)
+
+    # Gmax changes re-weight the cached open probability grids
+    op = pp._open_probability(hhna)
+    hhna.gbar *= 0.5
+    assert not np.allclose(pp.v_nullcline()[0], branch, equal_nan=True)
+    assert pp._open_probability(hhna) is op
+    sim.temp = 10.0
+    assert pp._open_probability(hhna) is not op
+
+    # injected current moves the fixed point up the V axis
+    clamp.set_holding('ic', 20 * NU.pA)
+    assert pp.fixed_points()['V'][0] > fp['V'][0]
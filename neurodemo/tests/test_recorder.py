@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+from neurodemo.recorder import ChunkedRecorder, read_recording, h5py
+from neurodemo.tests.test_sim import make_hh_sim
+
+
+@pytest.mark.parametrize('backend', ['npy', 'hdf5'])
+def test_chunked_recorder(tmp_path, backend):
+    if backend == 'hdf5' and h5py is None:
+        pytest.skip("h5py not installed")
+    sim, clamp = make_hh_sim()
+    keys = ['soma.V', 'soma.INa.I']
+    path = str(tmp_path / ('rec.h5' if backend == 'hdf5' else 'rec'))
+    rec = ChunkedRecorder(path, keys, chunk_size=250, backend=backend)
+    rec.start()
+    t, v = [], []
+    for r in sim.iter_blocks(100, duration=6e-3):
+        rec.add(r)
+        t.append(r['t'][len(t) > 0:])
+        v.append(r['soma.V'][len(v) > 0:])
+    rec.stop()
+    t = np.concatenate(t)
+    data = read_recording(path)
+    assert sorted(data.keys()) == ['soma.INa.I', 'soma.V', 't']
+    assert rec.n_written == rec.n_samples == len(t)
+    assert np.all(np.diff(data['t']) > 0)
+    assert np.allclose(data['t'], t)
+    assert data['soma.V'].dtype == np.float32
+    assert np.allclose(data['soma.V'], np.concatenate(v), atol=1e-6)
+
+
+def test_recorder_bounded_queue(tmp_path):
+    import threading
+    sim, clamp = make_hh_sim()
+    path = str(tmp_path / 'rec')
+    rec = ChunkedRecorder(path, ['soma.V'], chunk_size=50, backend='npy', max_queued=3)
+    # a disk that stalls until released
+    release = threading.Event()
+    make_writer = rec.make_writer
+
+    def stalled_writer():
+        writer = make_writer()
+        write = writer.write
+        writer.write = lambda columns: release.wait() and write(columns)
+        return writer
+
+    rec.make_writer = stalled_writer
+    rec.start()
+    n_total = 0
+    for r in sim.iter_blocks(101, duration=10e-3):
+        rec.add(r)
+        n_total += len(r['t']) - (n_total > 0)
+    # RAM stays bounded: blocks beyond the queue size are dropped and counted
+    assert rec.n_dropped > 0
+    assert rec.n_samples + rec.n_dropped == n_total
+    release.set()
+    rec.stop()
+    data = read_recording(path)
+    assert rec.n_written == rec.n_samples == len(data['t'])
+    assert np.all(np.diff(data['t']) > 0)
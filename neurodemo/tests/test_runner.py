@@ -0,0 +1,23 @@
+from neurodemo.runner import BlockQueue
+
+
+def test_block_queue_policies():
+    # blocks are never discarded; pending blocks share one redraw
+    q = BlockQueue(maxlen=3, policy='coalesce')
+    assert q.put(0) is True
+    assert q.put(1) is False
+    for i in range(2, 6):
+        q.put(i)
+    assert q.take() == [0, 1, 2, 3, 4, 5]
+    assert (q.n_queued, q.n_displayed, q.n_frames, q.n_coalesced) == (6, 6, 1, 5)
+    q.put(6)
+    assert q.take() == [6]
+    assert q.n_coalesced == 5
+
+    q = BlockQueue(maxlen=2, policy='block')
+    for i in range(4):
+        q.put(i)
+    assert q.full()
+    assert q.take() == [0, 1, 2, 3]
+    assert q.take() == []
+    assert q.n_frames == 1
@@ -0,0 +1,77 @@
+import os
+import socket
+import time
+import numpy as np
+import pytest
+from neurodemo.server import SimServer, ViewerClient, default_sim
+
+
+def test_server_fanout():
+    server = SimServer(('127.0.0.1', 0))
+    server.start()
+    try:
+        clients = [ViewerClient(server.address, ['soma.V'], decimate=d) for d in (1, 1, 4)]
+        # wait for the subscriptions to arrive
+        deadline = time.time() + 5
+        while sum(c.spec is not None for c in server.clients) < 3 and time.time() < deadline:
+            time.sleep(0.01)
+
+        sim = default_sim()
+        result = sim.run(201)
+        server.publish(result)
+        for c, n in zip(clients, (200, 200, 50)):
+            t, data = c.recv_block()
+            assert len(t) == n
+            assert np.allclose(t[0], result['t'][1])
+            assert np.allclose(data['soma.V'], result['soma.V'][1::len(result['t'][1:]) // n], atol=1e-6)
+            c.close()
+    finally:
+        server.stop()
+
+
+def wait_for_subscriptions(server, n):
+    deadline = time.time() + 5
+    while sum(c.spec is not None for c in server.clients) < n and time.time() < deadline:
+        time.sleep(0.01)
+
+
+def test_server_drops_client_during_publish():
+    server = SimServer(('127.0.0.1', 0))
+    server.start()
+    try:
+        clients = [ViewerClient(server.address, ['soma.V']) for i in range(3)]
+        wait_for_subscriptions(server, 3)
+        # a broken connection is dropped without skipping the next client
+        server.clients[0].sock.close()
+        server.publish(default_sim().run(11))
+        assert len(server.clients) == 2
+        for c in clients[1:]:
+            c.sock.settimeout(5)  # a skipped client would otherwise wait forever
+            t, data = c.recv_block()
+            assert len(t) == 10
+        for c in clients:
+            c.close()
+    finally:
+        server.stop()
+
+
+def test_server_unix_socket_restart(tmp_path):
+    path = str(tmp_path / 'nd.sock')
+    for i in range(2):
+        server = SimServer(path)
+        server.start()
+        server.stop()
+        assert not os.path.exists(path)
+
+    # a socket file left behind by a server that died is replaced
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(path)
+    stale.close()
+    server = SimServer(path)
+    server.start()
+    try:
+        # but a live server's socket is not
+        with pytest.raises(OSError):
+            SimServer(path).start()
+    finally:
+        server.stop()
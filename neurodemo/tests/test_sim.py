@@ -0,0 +1,226 @@
+import asyncio
+import threading
+import numpy as np
+import pytest
+import neurodemo as ND
+import neurodemo.units as NU
+
+
+def make_hh_sim(dt=20e-6):
+    sim = ND.Sim(temp=6.3, dt=dt)
+    soma = ND.Section(name='soma')
+    sim.add(soma)
+    soma.add(ND.HHNa())
+    soma.add(ND.Leak())
+    soma.add(ND.HHK())
+    clamp = soma.add(ND.PatchClamp(mode='ic'))
+    return sim, clamp
+
+
+def test_iter_blocks_matches_run():
+    sim1, clamp1 = make_hh_sim()
+    sim2, clamp2 = make_hh_sim()
+    cmd = np.ones(500) * 200 * NU.pA
+    clamp1.queue_command(cmd, sim1.dt)
+    clamp2.queue_command(cmd, sim2.dt)
+
+    expected = [sim1.run(400) for i in range(3)]
+    blocks = sim2.iter_blocks(400)
+    for r1 in expected:
+        r2 = next(blocks)
+        assert np.allclose(r1['t'], r2['t'])
+        assert np.allclose(r1['soma.V'], r2['soma.V'])
+    blocks.close()
+
+
+def test_iter_blocks_duration_and_send():
+    sim, clamp = make_hh_sim()
+    blocks = sim.iter_blocks(100, duration=10 * NU.ms)
+    r = next(blocks)
+    assert len(r['t']) == 100
+    # change a parameter between blocks
+    r = blocks.send(lambda s: setattr(s, 'temp', 20.0))
+    assert sim.temp == 20.0
+    for r in blocks:
+        pass
+    assert np.allclose(sim.time, 10 * NU.ms)
+    assert np.allclose(r['t'][-1], 10 * NU.ms)
+
+
+def test_aiter_blocks():
+    sim, clamp = make_hh_sim()
+
+    async def consume():
+        times = []
+        async for r in sim.aiter_blocks(100, duration=4 * NU.ms):
+            times.append(r['t'][-1])
+        return times
+
+    times = asyncio.run(consume())
+    assert len(times) == 3
+    assert np.allclose(times[-1], 4 * NU.ms)
+
+
+def test_aiter_blocks_cancel():
+    sim, clamp = make_hh_sim()
+    computing = threading.Event()
+
+    async def consume():
+        async for r in sim.aiter_blocks(20000):
+            pass
+
+    async def main():
+        task = asyncio.create_task(consume())
+        # cancel while the executor is still computing a block
+        await asyncio.get_running_loop().run_in_executor(None, computing.wait, 5)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    derivatives = sim.derivatives
+
+    def signal_derivatives(t, state):
+        computing.set()
+        return derivatives(t, state)
+
+    sim.derivatives = signal_derivatives
+    asyncio.run(main())
+
+
+def test_block_pool_reuse():
+    sim, clamp = make_hh_sim()
+    # solve_ivp output is handed out without a copy and is never pooled
+    r = sim.run(100)
+    assert r.state.flags['C_CONTIGUOUS']
+    sim.release(r)
+    assert sim.pool.n_allocated == 0
+
+    sim.set_integrator('odeint')
+    r1 = sim.run(100)
+    assert r1.state.flags['C_CONTIGUOUS']
+    # slices share the pooled buffer
+    sl = r1[10:20]
+    assert np.shares_memory(sl['soma.V'], r1['soma.V'])
+    assert sl['t'].base is r1.state.base
+    # without release(), buffers are never reused
+    r2 = sim.run(100)
+    assert not np.shares_memory(sl['soma.V'], r2['soma.V'])
+    assert sim.pool.n_allocated == 2
+    sim.release(r2)
+    sim.release(r2)  # releasing twice is harmless
+    for i in range(5):
+        r = sim.run(100)
+        sim.release(r)
+    assert sim.pool.n_allocated == 2
+    assert np.allclose(sl['t'], r1['t'][10:20])
+
+
+def test_dep_vars_memoized():
+    sim, clamp = make_hh_sim()
+    r = sim.run(200)
+    i1 = r['soma.INa.I']
+    assert r['soma.INa.I'] is i1
+    # conductance computed while evaluating the current is shared
+    assert 'soma.INa.G' in r._cache
+    # slices reuse values already computed for the block
+    sl = r[10:20]
+    assert np.shares_memory(sl['soma.INa.I'], i1)
+    # single time points are not cached
+    s = r.get_state_at_index(5)
+    assert np.allclose(s['soma.INa.I'], i1[5])
+
+
+def test_recording_spec():
+    sim1, clamp1 = make_hh_sim()
+    sim2, clamp2 = make_hh_sim()
+    cmd = np.ones(500) * 200 * NU.pA
+    clamp1.queue_command(cmd, sim1.dt)
+    clamp2.queue_command(cmd, sim2.dt)
+
+    full = sim1.run(401)
+    spec = ND.RecordingSpec(keys=['soma.V', 'soma.INa.I'], decimate=10, dtype=np.float32)
+    rec = sim2.run(401, record=spec)
+    assert sorted(rec.keys()) == ['soma.INa.I', 'soma.V', 't']
+    assert len(rec['t']) == 41
+    assert rec['soma.V'].dtype == np.float32
+    assert np.allclose(rec['t'], full['t'][::10])
+    assert np.allclose(rec['soma.V'], full['soma.V'][::10], atol=1e-4)
+    # both sims end at the same time and state, so the next block lines up
+    assert sim1.time == sim2.time
+    assert np.allclose(sim1.run(100)['soma.V'], sim2.run(100)['soma.V'], atol=1e-4)
+
+    # blocks are extended to a whole number of output intervals
+    r = sim2.run(95, record=ND.RecordingSpec(interval=10 * sim2.dt))
+    assert len(r['t']) == 11
+    assert np.allclose(np.diff(r['t']), 10 * sim2.dt)
+
+
+def test_threshold_events():
+    ev = ND.ThresholdEvent('soma.V', -20 * NU.mV)
+    for integrator in ['odeint', 'solve_ivp']:
+        results = []
+        for decimate in [1, 25]:
+            sim, clamp = make_hh_sim()
+            sim.set_integrator(integrator)
+            sim.run(200)
+            clamp.queue_command(np.ones(3000) * 300 * NU.pA, sim.dt)
+            results.append(sim.run(4000, record=ND.RecordingSpec(keys=['soma.V'], decimate=decimate), events=[ev]))
+        fine, coarse = results
+        v, t = fine['soma.V'], fine['t']
+        k = np.nonzero((v[:-1] < -20e-3) & (v[1:] >= -20e-3))[0]
+        assert len(k) > 2
+        # spike times from 500 us output samples match the 20 us trace
+        spikes = coarse.events['soma.V']
+        assert np.allclose(spikes['t'], t[k] + (-20e-3 - v[k]) / (v[k + 1] - v[k]) * sim.dt, atol=2e-6)
+        assert np.allclose(spikes['soma.V'], -20e-3, atol=0.1e-3)
+        assert np.all(spikes['soma.INa.I'] > 0)  # dependent variables at each event
+        # slices keep only their own events
+        assert len(fine[:len(t) // 2].events['soma.V']['t']) == np.sum(t[k] < t[len(t) // 2 - 1])
+
+
+def test_gate_curves():
+    sim = ND.Sim(temp=6.3)
+    soma = sim.add(ND.Section(name='soma'))
+    hhk = soma.add(ND.HHK())
+    V = np.linspace(-120, 60, 181) * NU.mV
+    inf = hhk.gate_inf(V)
+    tau = hhk.gate_tau(V)
+    vm = V * 1000 + 65
+    with np.errstate(invalid='ignore'):
+        an = (0.1 - 0.01 * vm) / (np.exp(1.0 - 0.1 * vm) - 1.0)
+    bn = 0.125 * np.exp(-vm / 80.0)
+    ok = np.isfinite(an)
+    assert not ok.all()  # the removable singularity at vm = 10 mV is filled in
+    assert np.allclose(inf['n'][ok], (an / (an + bn))[ok])
+    assert np.allclose(tau['n'][ok], (1e-3 / (an + bn))[ok])
+    assert np.all(np.isfinite(inf['n'])) and np.all(np.isfinite(tau['n']))
+
+    # cached per voltage grid and temperature; warmer is faster
+    assert hhk.gate_inf(V)['n'] is inf['n']
+    assert not inf['n'].flags.writeable
+    assert np.allclose(hhk.gate_tau(V, temp=16.3)['n'], tau['n'] / 3)
+
+    # only evenly spaced grids are cached, keyed by range and size; other
+    # arrays (e.g. fixed-point probes) are computed without evicting them
+    assert hhk.gate_inf(V.copy())['n'] is inf['n']
+    assert hhk.gate_inf(V[:, np.newaxis])['n'].shape == (len(V), 1)
+    n_cached = len(hhk._curve_cache)
+    rng = np.random.default_rng(0)
+    for i in range(40):
+        probe = rng.uniform(-0.1, 0.05, size=(3, 10))
+        pinf, ptau = hhk.gate_inf_tau(probe)['n']
+        assert pinf.shape == (3, 10) and np.all(np.isfinite(ptau))
+    assert len(hhk._curve_cache) == n_cached
+    assert hhk.gate_inf(V)['n'] is inf['n']
+    assert np.allclose(hhk.gate_inf_tau(V[::3] + 0)['n'][1], tau['n'][::3])
+
+    # every gated channel agrees with its own derivatives at steady state
+    # (off the grid points where the rate equations are 0/0)
+    V = V + 0.25 * NU.mV
+    for chan in [ND.HHNa(), ND.IH(), ND.KA(), ND.CaT(), ND.LGNa(), ND.LGKfast(), ND.LGKslow()]:
+        soma.add(chan)
+        inf = chan.gate_inf(V)
+        keys = ['soma.V'] + [chan.name + '.' + g for g in inf]
+        state = ND.SimState(keys, {}, np.vstack([V] + list(inf.values())))
+        assert np.allclose(chan.derivatives(state), 0, atol=1e-9)
+    assert len(ND.Leak().gate_inf(V, temp=6.3)) == 0
@@ -0,0 +1,56 @@
+import numpy as np
+import neurodemo.units as NU
+from neurodemo.spikefeatures import spike_features, sweep_features
+from neurodemo.tests.test_sim import make_hh_sim
+
+
+def make_sweeps(amps, n=5000):
+    sweeps = []
+    for amp in amps:
+        sim, clamp = make_hh_sim()
+        sim.run(500)  # settle
+        clamp.queue_command(np.ones(4500) * amp, sim.dt)
+        sweeps.append(sim.run(n)['soma.V'])
+    return np.array(sweeps), sim.dt
+
+
+def test_spike_features_hh():
+    data, dt = make_sweeps([0, 100 * NU.pA, 300 * NU.pA, 600 * NU.pA])
+    sweeps, spikes = spike_features(data, dt)
+    for j, v in enumerate(data):
+        crossings = np.argwhere((v[1:] > -30e-3) & (v[:-1] < -30e-3))[:, 0]
+        assert sweeps['count'][j] == len(crossings)
+        if len(crossings) > 0:
+            # interpolated latency falls between the samples around the crossing
+            assert crossings[0] * dt <= sweeps['latency'][j] <= (crossings[0] + 1) * dt
+    assert sweeps['count'][0] == 0 and np.isnan(sweeps['latency'][0])
+    # 600 pA drives the cell into depolarization block after a few spikes
+    assert sweeps['count'][2] >= 3
+    spiking = sweeps['count'] > 0
+    assert np.all(sweeps['amplitude'][spiking] > 60e-3)
+    assert np.all((sweeps['half_width'][spiking] > 0.2e-3) & (sweeps['half_width'][spiking] < 3e-3))
+    assert np.all(sweeps['threshold'][spiking] < -30e-3)
+    assert np.all(sweeps['ahp_depth'][1:3] > 0)
+    assert np.all(np.diff(spikes['sweep']) >= 0)
+    assert np.isfinite(sweeps['isi_mean'][2]) and np.isfinite(sweeps['adaptation'][2])
+
+
+def test_spike_features_interpolation():
+    # a ramp crossing -30 mV exactly 0.25 samples after sample 11
+    dt = 1e-4
+    v = np.full(60, -70e-3)
+    v[10:20] = -70e-3 + np.arange(10) * 32e-3
+    v = np.minimum(v, 20e-3)
+    sweeps, spikes = spike_features(v, dt)
+    assert sweeps['count'][0] == 1
+    assert np.isclose(sweeps['latency'][0], 11.25 * dt)
+
+
+def test_spike_features_empty():
+    for shape in [(0, 100), (3, 0), (0,)]:
+        sweeps, spikes = spike_features(np.empty(shape), 1e-4)
+        nsw = shape[0] if len(shape) == 2 else 1
+        assert set(sweeps) == set(sweep_features)
+        assert all(len(v) == nsw for v in sweeps.values())
+        assert np.all(sweeps['count'] == 0) and np.all(np.isnan(sweeps['latency']))
+        assert all(len(v) == 0 for v in spikes.values())
@@ -0,0 +1,153 @@
+import numpy as np
+import pyqtgraph as pg
+from neurodemo.buffers import SampleRing
+from neurodemo.sequenceplot import SequencePlotWindow
+from neurodemo.tests.test_sim import make_hh_sim
+
+
+def test_trace_analyzer_workers():
+    pg.mkQApp()
+    win = SequencePlotWindow()
+    win.add_plot('soma.V', 'V')
+    an = win.analyzer
+    an.params.set_inputs(['soma.V', 't'])
+    an.params.addNew('max')
+    an.params.addNew('spike_count')
+
+    sim, clamp = make_hh_sim()
+    ring = SampleRing(['soma.V'], capacity=20000)
+    t = np.arange(1000) * sim.dt
+    for i in range(4):
+        clamp.queue_command(np.ones(1500) * i * 100e-12, sim.dt)
+        ring.append(sim.run(2000))
+    sweeps = [ring.sweep(ring.oldest + i * 1999, ring.oldest + i * 1999 + 1000) for i in range(4)]
+    for i, s in enumerate(sweeps):
+        win.plot(t, s, {'mode': 'ic', 'amp': i * 100e-12, 'seq_ind': i, 'seq_len': 4})
+    an.wait()
+    traces = [(t, s.materialize()) for s in sweeps]
+    for anal in an.params.children():
+        expected = anal.process_many(traces)
+        assert np.allclose(an.results[anal.name()], expected, equal_nan=True)
+
+    # changing an analyzer recomputes its column and drops stale results
+    anal = an.params.children()[0]
+    anal['End'] = 5e-3
+    an.wait()
+    assert np.allclose(an.results['max'], anal.process_many(traces))
+    assert all(config == anal.config() for tid, config in an.cache if config[1] == ('Type', 'max'))
+
+    an.clear()
+    assert len(an.pending) == 0 and len(an.cache) == 0
+
+
+def test_expression_evaluator():
+    from neurodemo.traceanalyzer import ExpressionEvaluator
+
+    def table(cmd, vmax):
+        data = np.empty(len(cmd), dtype=[('cmd', float), ('v max', float)])
+        data['cmd'] = cmd
+        data['v max'] = vmax
+        return data
+
+    ev = ExpressionEvaluator()
+    ev.set_data(table([1, 2], [10, 20]))
+    assert np.all(ev.evaluate('v_max / cmd') == [10, 10])
+    assert ev.compile('v_max / cmd')[2] is True
+    assert ev.compile('v_max - v_max.mean()')[2] is False
+
+    # appended rows: only the new rows are evaluated for elementwise code
+    ev.set_data(table([1, 2, 4], [10, 20, 44]))
+    cached = ev.results['v_max / cmd'][2]
+    assert np.all(ev.evaluate('v_max / cmd') == [10, 10, 11])
+    assert np.all(ev.evaluate('v_max / cmd')[:2] == cached)
+    assert np.allclose(ev.evaluate('v_max - v_max.mean()'), [-14.67, -4.67, 19.33], atol=0.01)
+
+    # a changed value invalidates expressions that use its column
+    ev.set_data(table([1, 2, 4], [10, 30, 44]))
+    assert np.all(ev.evaluate('v_max / cmd') == [10, 15, 11])
+    assert ev.versions['v_max'] == 2 and ev.versions['cmd'] == 1
+
+    held = [table([1, 2], [3, 4]), table([5], [6])]
+    assert [list(v) for v in ev.evaluate_many('cmd + v_max', held)] == [[4, 6], [11]]
+    assert [float(v) for v in ev.evaluate_many('v_max.max()', held)] == [4, 6]
+
+
+def test_trace_analyzer_cache():
+    from neurodemo.traceanalyzer import TraceAnalyzer
+    pg.mkQApp()
+    win = SequencePlotWindow()
+    win.add_plot('soma.V', 'V')
+    an = TraceAnalyzer(win, workers=0)  # analyze synchronously
+    an.params.set_inputs(['soma.V', 't'])
+    an.params.addNew('max')
+    anal = an.params.children()[0]
+
+    # count the traces analyzed and the rows sent to the table
+    processed, appended, replaced = [], [], []
+    process_many = anal.process_many
+    anal.process_many = lambda traces, opts=None: processed.append(len(traces)) or process_many(traces, opts)
+    append_data, set_data = an.table.appendData, an.table.setData
+    an.table.appendData = lambda data: appended.append(len(data)) or append_data(data)
+    an.table.setData = lambda data: replaced.append(len(data)) or set_data(data)
+
+    t = np.arange(500) * 1e-4
+    for i in range(3):
+        data = np.empty(len(t), dtype=[('soma.V', float), ('t', float)])
+        data['soma.V'] = -70e-3 + i * 10e-3 * np.sin(t / 5e-3)
+        data['t'] = t
+        an.add_data(t, data, {'amp': i * 100e-12})
+    # each new trace is analyzed once and adds one row
+    assert processed == [1, 1, 1]
+    assert appended == [1, 1, 1] and replaced == []
+    assert len(an.cache) == 3
+
+    # nothing changed: every value comes from the cache
+    an.update_analysis()
+    assert processed == [1, 1, 1] and appended == [1, 1, 1] and replaced == []
+
+    # a new setting invalidates the column: all traces are analyzed again in
+    # one batch, stale entries are dropped and the table is rebuilt
+    old_config = anal.config()
+    anal['End'] = 5e-3
+    assert processed[-1] == 3 and replaced == [3]
+    assert len(an.cache) == 3
+    assert all(config == anal.config() != old_config for tid, config in an.cache)
+    assert np.allclose(an.results['max'], process_many([trace[:2] for trace in an.data]))
+
+
+def test_trace_analyzer_workers_incremental():
+    # results arriving from worker threads fill in their placeholder rows
+    # instead of rebuilding the table or invalidating the plotted expressions
+    pg.mkQApp()
+    win = SequencePlotWindow()
+    win.add_plot('soma.V', 'V')
+    an = win.analyzer
+    assert an.pool is not None
+    an.params.set_inputs(['soma.V', 't'])
+    an.params.addNew('max')
+    an.analysis_plot.y_code.setText('max')
+    evaluator = an.analysis_plot.evaluator
+
+    processed, appended, replaced = [], [], []
+    anal = an.params.children()[0]
+    process_many = anal.process_many
+    anal.process_many = lambda traces, opts=None: processed.append(len(traces)) or process_many(traces, opts)
+    append_data, set_data = an.table.appendData, an.table.setData
+    an.table.appendData = lambda data: appended.append(len(data)) or append_data(data)
+    an.table.setData = lambda data: replaced.append(len(data)) or set_data(data)
+
+    t = np.arange(500) * 1e-4
+    for i in range(5):
+        data = np.empty(len(t), dtype=[('soma.V', float), ('t', float)])
+        data['soma.V'] = -70e-3 + i * 10e-3 * np.sin(t / 5e-3)
+        data['t'] = t
+        an.add_data(t, data, {'amp': i * 100e-12})
+        an.wait()
+        if i == 0:
+            versions = dict(evaluator.versions)
+    assert processed == [1] * 5
+    assert appended == [1] * 5 and replaced == []
+    assert evaluator.versions == versions
+    assert np.all(evaluator.evaluate('max') == an.results['max'])
+    table = [float(an.table.item(r, 1).value) for r in range(an.table.rowCount())]
+    assert np.allclose(table, an.results['max'])
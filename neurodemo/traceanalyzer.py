@@ -4,17 +4,58 @@ NeuroDemo - Physiological neuron sandbox for educational purposes
 Luke Campagnola 2015
 """
 
+import ast
+import queue
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import pyqtgraph as pg
 from pyqtgraph.Qt import QtGui, QtCore
 import pyqtgraph.parametertree as pt
-from lmfit import Model
-from lmfit.models import ExponentialModel
+from .expfit import fit_exponential
+from .spikefeatures import spike_features
+
+try:
+    from lmfit import Model
+    from lmfit.models import ExponentialModel
+except ImportError:
+    Model = ExponentialModel = None
+
+# ways of fitting exp_tau; 'lmfit' is slower and only offered if installed
+fit_methods = ['fast'] if Model is None else ['fast', 'lmfit']
+
+# analyzer types measured by spike_features(), and the feature each reports
+spike_analyses = {
+    'spike_count': 'count',
+    'spike_latency': 'latency',
+    'spike_threshold': 'threshold',
+    'spike_amplitude': 'amplitude',
+    'spike_half_width': 'half_width',
+    'ahp_depth': 'ahp_depth',
+    'isi_mean': 'isi_mean',
+    'isi_cv': 'isi_cv',
+    'adaptation_index': 'adaptation',
+}
 
 class TraceAnalyzer(QtGui.QWidget):
-    def __init__(self, seq_plotter):
+    """Table and plot of analyses of the traces in a SequencePlotWindow.
+
+    Analyses run in a pool of *workers* background threads (or synchronously
+    if *workers* is 0), so sweeps keep being plotted while fits run. Each
+    analyzer's uncached traces are submitted as one job; finished jobs are
+    handed back to the GUI thread through ``results_ready`` and the table is
+    updated as each arrives. Jobs whose analyzer settings have changed since
+    they were submitted are cancelled, or their results discarded.
+    """
+    results_ready = QtCore.Signal()
+
+    def __init__(self, seq_plotter, workers=2):
         QtGui.QWidget.__init__(self)
         self.plotter = seq_plotter
+        self.pool = ThreadPoolExecutor(max_workers=workers) if workers > 0 else None
+        self.pending = {}  # (trace ids, config): Future of a submitted job
+        self.finished_jobs = queue.Queue()  # (generation, keys, values) from workers
+        self.generation = 0  # incremented by clear() to invalidate running jobs
+        self.results_ready.connect(self.collect_results, QtCore.Qt.ConnectionType.QueuedConnection)
         
         self.layout = QtGui.QGridLayout()
         self.layout.setContentsMargins(0, 0, 0, 0)
@@ -41,12 +82,27 @@ class TraceAnalyzer(QtGui.QWidget):
         self.ptree.setParameters(self.params)
 
     def clear(self):
+        self.generation += 1
+        for job in self.pending.values():
+            job.cancel()
+        self.pending = {}
         self.data = []
+        self.trace_ids = []  # unique id of each entry in self.data
+        self._next_trace_id = 0
+        # analysis results keyed by (trace id, analyzer configuration)
+        self.cache = {}
+        self.results = None  # last table contents
+        self.missing = None  # {field: mask of results that are placeholders}
         self.table.clear()
         
     def add_data(self, t, data, info):
         self.params.set_inputs(data.dtype.names)
+        # sweeps arrive as views of recent samples; keep a copy for re-analysis
+        if hasattr(data, 'materialize'):
+            data = data.materialize()
         self.data.append((t, data, info))
+        self.trace_ids.append(self._next_trace_id)
+        self._next_trace_id += 1
         self.update_analysis()
 
     def update_analyzers(self):
@@ -55,23 +111,137 @@ class TraceAnalyzer(QtGui.QWidget):
         self.update_analysis()
         
     def update_analysis(self):
-        fields = ['cmd'] + [anal.name() for anal in self.params.children()]
+        """Rebuild the results table, running each analyzer only on traces it
+        has not yet processed with its current settings. A new trace costs
+        one new row; changing one analyzer recomputes only its column.
+        Values still being computed are shown as NaN placeholders; when they
+        arrive only their cells are rewritten, and the plot is only given the
+        rows that are complete.
+        """
+        analyzers = self.params.children()
+        fields = ['cmd'] + [anal.name() for anal in analyzers]
         data = np.empty(len(self.data), dtype=[(str(f), float) for f in fields])
-        for i, rec in enumerate(self.data):
-            # print(rec)
-            t, d, info = rec
-            data['cmd'][i] = info['amp']
-            for analysis in self.params.children():
-                data[analysis.name()][i] = analysis.process(t, d)
-        self.table.setData(data)
-        self.analysis_plot.update_data(data)
+        data['cmd'] = [info['amp'] for t, d, info in self.data]
+        missing = {'cmd': np.zeros(len(data), dtype=bool)}
+        wanted = set()
+        for analysis in analyzers:
+            config = analysis.config()
+            keys = [(tid, config) for tid in self.trace_ids]
+            # all traces missing from the cache are analyzed in one batch
+            todo = [i for i, key in enumerate(keys)
+                    if key not in self.cache and not self.is_pending(key)]
+            if len(todo) > 0:
+                self.submit(analysis, [keys[i] for i in todo], [self.data[i][:2] for i in todo])
+            missing[analysis.name()] = np.array([key not in self.cache for key in keys], dtype=bool)
+            for i, key in enumerate(keys):
+                wanted.add(key)
+                data[analysis.name()][i] = self.cache.get(key, np.nan)
+        # results for settings no longer in use are dropped, and jobs that
+        # would produce them are cancelled
+        self.cache = {k: v for k, v in self.cache.items() if k in wanted}
+        for job_key in list(self.pending):
+            if not any((tid, job_key[1]) in wanted for tid in job_key[0]):
+                self.pending.pop(job_key).cancel()
+
+        old = self.results
+        n_old = 0 if old is None else len(old)
+        same = old is not None and old.dtype == data.dtype and n_old <= len(data)
+        for f in fields if same else []:
+            # placeholders in the old table may since have been filled in;
+            # any other difference means existing results changed
+            known = ~self.missing[f]
+            same = same and np.array_equal(old[f][known], data[f][:n_old][known], equal_nan=True)
+        if same:
+            filled = np.zeros(n_old, dtype=bool)
+            for f in fields:
+                filled |= self.missing[f] & ~missing[f][:n_old]
+            if filled.any():
+                self.update_rows(np.nonzero(filled)[0], data)
+            if len(data) > n_old:
+                self.table.appendData(data[n_old:])
+        else:
+            self.table.setData(data)
+        self.results = data
+        self.missing = missing
+        # rows up to the first placeholder; rows after it are plotted once
+        # it is filled in, so the plot sees them as appended
+        incomplete = np.zeros(len(data), dtype=bool)
+        for m in missing.values():
+            incomplete |= m
+        n_complete = int(np.argmax(incomplete)) if incomplete.any() else len(data)
+        self.analysis_plot.update_data(data[:n_complete])
+
+    def update_rows(self, rows, data):
+        """Rewrite the table cells of the results in *rows* (indexes into
+        *data*). The table may be sorted, so rows are found by the index of
+        their items, which is the order in which they were added.
+        """
+        table = self.table
+        sorting = table.isSortingEnabled()
+        table.setSortingEnabled(False)
+        position = {table.item(r, 0).index: r for r in range(table.rowCount())}
+        for i in rows:
+            for col, name in enumerate(data.dtype.names):
+                table.item(position[i], col).setValue(data[name][i])
+        table.setSortingEnabled(sorting)
+
+    def is_pending(self, key):
+        tid, config = key
+        return any(config == c and tid in tids for tids, c in self.pending)
+
+    def submit(self, analysis, keys, traces):
+        """Run *analysis* on *traces* (whose cache keys are *keys*) in the
+        worker pool, or immediately if there is no pool.
+        """
+        opts = analysis.settings()
+        if self.pool is None:
+            for key, val in zip(keys, analysis.process_many(traces, opts)):
+                self.cache[key] = val
+            return
+        job_key = (tuple(k[0] for k in keys), keys[0][1])
+        job = self.pool.submit(self.run_job, analysis, keys, traces, opts, self.generation)
+        self.pending[job_key] = job
+
+    def run_job(self, analysis, keys, traces, opts, generation):
+        """Worker thread: analyze the traces and queue the results."""
+        try:
+            values = analysis.process_many(traces, opts)
+        except Exception:
+            pg.debug.printExc('Error analyzing data:')
+            values = [np.nan] * len(traces)
+        self.finished_jobs.put((generation, keys, values))
+        self.results_ready.emit()
+
+    def collect_results(self):
+        """Move finished job results into the cache and update the table."""
+        changed = False
+        while True:
+            try:
+                generation, keys, values = self.finished_jobs.get_nowait()
+            except queue.Empty:
+                break
+            job_key = (tuple(k[0] for k in keys), keys[0][1])
+            if generation != self.generation or self.pending.pop(job_key, None) is None:
+                continue  # stale: the data were cleared or the settings changed
+            self.cache.update(zip(keys, values))
+            changed = True
+        if changed:
+            self.update_analysis()
+
+    def wait(self):
+        """Block until all submitted analyses have finished and are shown."""
+        while len(self.pending) > 0:
+            for job in list(self.pending.values()):
+                if not job.cancelled():
+                    job.exception()
+            self.collect_results()
         
 
 class TraceAnalyzerGroup(pt.parameterTypes.GroupParameter):
     need_update = QtCore.Signal()
 
     def __init__(self, **kwds):
-        analyses = ['min', 'max', 'mean', 'exp_tau', 'spike_count', 'spike_latency']
+        analyses = ['min', 'max', 'mean', 'exp_tau'] + list(spike_analyses)
         self.inputs = []
         pt.parameterTypes.GroupParameter.__init__(self, addText='Add analysis..', addList=analyses, **kwds)
 
@@ -95,10 +265,11 @@ class TraceAnalyzerParameter(pt.parameterTypes.GroupParameter):
         kwds.update({'removable': True, 'renamable': False})
         childs = [
             dict(name='Input', type='list', values=kwds.pop('inputs')),
-            dict(name='Type', type='list', value=kwds.pop('analysis_type'), values=['mean', 'min', 'max', 'exp_tau', 'spike_count', 'spike_latency']),
+            dict(name='Type', type='list', value=kwds.pop('analysis_type'), values=['mean', 'min', 'max', 'exp_tau'] + list(spike_analyses)),
             dict(name='Start', type='float', value=0, suffix='s', siPrefix=True, step=5e-3),
             dict(name='End', type='float', value=10e-3, suffix='s', siPrefix=True, step=5e-3),
             dict(name='Threshold', type='float', value=-30e-3, suffix='V', siPrefix=True, step=5e-3, visible=False),
+            dict(name='Fit method', type='list', value='fast', values=fit_methods, visible=False),
         ]
         kwds['children'] = childs + kwds.get('children', [])
         
@@ -108,7 +279,7 @@ class TraceAnalyzerParameter(pt.parameterTypes.GroupParameter):
         self.rgn = pg.LinearRegionItem([self['Start'], self['End']])
         self.rgn.sigRegionChanged.connect(self.region_changed)
 
-        self.show_threshold_param()
+        self.show_type_params()
     
     def tree_changed(self, root, changes):
         for param, change, val in changes:
@@ -121,12 +292,12 @@ class TraceAnalyzerParameter(pt.parameterTypes.GroupParameter):
                 finally:
                     self.rgn.sigRegionChanged.connect(self.region_changed)
             elif param is self.child('Type'):
-                self.show_threshold_param()
+                self.show_type_params()
             self.need_update.emit(self)
 
-    def show_threshold_param(self):
-        needs_threshold = self['Type'] in ['spike_count', 'spike_latency']
-        self.child('Threshold').setOpts(visible=needs_threshold)
+    def show_type_params(self):
+        self.child('Threshold').setOpts(visible=self['Type'] in spike_analyses)
+        self.child('Fit method').setOpts(visible=self['Type'] == 'exp_tau')
 
     def region_changed(self):
         """If the region is changed, read the position and update the values
@@ -144,13 +315,66 @@ class TraceAnalyzerParameter(pt.parameterTypes.GroupParameter):
     def set_input_list(self, inputs):
         self.child('Input').setLimits(inputs)
 
-    def process(self, t, data):
+    def config(self):
+        """Hashable summary of all settings that affect the result."""
+        return tuple((ch.name(), ch.value()) for ch in self.children())
+
+    def settings(self):
+        """Plain dict of the current settings. The analysis methods read
+        their settings from it, so they can run in a worker thread while
+        the parameters are being edited.
+        """
+        return dict(self.config())
+
+    def batched(self, opts=None):
+        """Whether this analysis is computed for many traces at once."""
+        opts = self.settings() if opts is None else opts
+        typ = opts['Type']
+        return typ in spike_analyses or (typ == 'exp_tau' and opts['Fit method'] == 'fast')
+
+    def process_many(self, traces, opts=None):
+        """Analyze a list of (t, data) traces and return one value per trace.
+
+        Spike features and fast exponential fits of all traces that share a
+        sample interval and length are computed together in one batch.
+        *opts* is a settings dict from `settings()` (default: the current
+        settings).
+        """
+        opts = self.settings() if opts is None else opts
+        typ = opts['Type']
+        if not self.batched(opts):
+            return [self.process(t, d, opts) for t, d in traces]
+        values = [np.nan] * len(traces)
+        groups = {}
+        for i, (t, d) in enumerate(traces):
+            dt = t[1] - t[0]
+            i1 = int(opts['Start'] / dt)
+            i2 = int(opts['End'] / dt)
+            y = d[opts['Input']][i1:i2]
+            groups.setdefault((dt, len(y)), []).append((i, t[i1:i2], y))
+        for (dt, n), group in groups.items():
+            if n < 3:
+                continue
+            stack = np.stack([y for i, t, y in group])
+            if typ == 'exp_tau':
+                # same model as measure_tauDecay: offset fixed at the last sample
+                result = fit_exponential(group[0][1], stack, offset=stack[:, -1])['tau']
+            else:
+                result = spike_features(stack, dt, threshold=opts['Threshold'])[0][spike_analyses[typ]]
+            for (i, t, y), val in zip(group, result):
+                values[i] = val
+        return values
+
+    def process(self, t, data, opts=None):
+        opts = self.settings() if opts is None else opts
+        if self.batched(opts):
+            return self.process_many([(t, data)], opts)[0]
         dt = t[1] - t[0]
-        i1 = int(self['Start'] / dt)
-        i2 = int(self['End'] / dt)
-        data = data[self['Input']][i1:i2]
+        i1 = int(opts['Start'] / dt)
+        i2 = int(opts['End'] / dt)
+        data = data[opts['Input']][i1:i2]
         sign = 1.0
-        if self['Input'] in [
+        if opts['Input'] in [
             "soma.INa.I", "soma.IK.I", "soma.IKA.I", 
             "soma.ICaT.I", "soma.ICaL.I",
             "soma.IH.I",
@@ -159,22 +383,13 @@ class TraceAnalyzerParameter(pt.parameterTypes.GroupParameter):
             sign = -1.0   # flip sign of cation currents for display
         t = t[i1:i2]
  
-        typ = self['Type']
+        typ = opts['Type']
         if typ == 'mean':
             return sign*data.mean()
         elif typ == 'min':
             return sign*data.min()
         elif typ == 'max':
             return sign*data.max()
-        elif typ.startswith('spike'):
-            spikes = np.argwhere((data[1:] > self['Threshold']) & (data[:-1] < self['Threshold']))[:,0]
-            if typ == 'spike_count':
-                return len(spikes)
-            elif typ == 'spike_latency':
-                if len(spikes) == 0:
-                    return np.nan
-                else:
-                    return spikes[0] * dt
         elif typ == 'exp_tau':
             return self.measure_tauDecay(data, t)
         elif typ == 'expTauRise4':
@@ -210,12 +425,115 @@ class TraceAnalyzerParameter(pt.parameterTypes.GroupParameter):
         print(result.params)
         return result.params['tau'] # fit[0][2]       
 
+# syntax that operates on arrays element by element; an expression made only
+# of these gives the same result for appended rows whether it is evaluated
+# over all rows or just the new ones
+_elementwise_nodes = (
+    ast.Expression, ast.Name, ast.Load, ast.Constant, ast.BinOp, ast.UnaryOp,
+    ast.Compare, ast.operator, ast.unaryop, ast.cmpop,
+)
+_elementwise_funcs = {'abs'}
+
+
+def _is_elementwise(tree):
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Call):
+            if not (isinstance(node.func, ast.Name) and node.func.id in _elementwise_funcs and not node.keywords):
+                return False
+        elif not isinstance(node, _elementwise_nodes):
+            return False
+    return True
+
+
+class ExpressionEvaluator(object):
+    """Evaluate Python expressions over the columns of a table of results.
+
+    Column names (with spaces replaced by underscores) are the variables.
+    Each expression is compiled once and its result is cached together with
+    the versions of the columns it uses; a column's version changes only
+    when existing values change, not when rows are appended. When only rows
+    were appended, elementwise expressions are evaluated on the new rows
+    alone and joined to the cached result.
+    """
+
+    def __init__(self):
+        self.data = None
+        self.columns = {}
+        self.versions = {}  # column: version
+        self.compiled = {}  # text: (code, names, elementwise)
+        self.results = {}  # text: (column versions, rows, value)
+
+    def set_data(self, data):
+        old = self.data
+        n_old = 0 if old is None else len(old)
+        for name in data.dtype.names:
+            key = name.replace(' ', '_')
+            appended = (old is not None and name in old.dtype.names and n_old <= len(data)
+                        and np.array_equal(old[name], data[name][:n_old], equal_nan=True))
+            if not appended:
+                self.versions[key] = self.versions.get(key, 0) + 1
+        self.data = data
+        self.columns = {name.replace(' ', '_'): data[name] for name in data.dtype.names}
+
+    def compile(self, text):
+        """Return (code, names, elementwise) for *text*, compiling it once."""
+        entry = self.compiled.get(text)
+        if entry is None:
+            tree = ast.parse(text, mode='eval')
+            code = compile(tree, '<expression>', 'eval')
+            entry = (code, code.co_names, _is_elementwise(tree))
+            self.compiled[text] = entry
+        return entry
+
+    def evaluate(self, text):
+        """Evaluate *text* over the current data."""
+        code, names, elementwise = self.compile(text)
+        versions = tuple(self.versions.get(n) for n in names)
+        n = len(self.data)
+        cached = self.results.get(text)
+        if cached is not None and cached[0] == versions:
+            n_old, value = cached[1:]
+            if n_old == n:
+                return value
+            if elementwise and n_old < n and np.ndim(value) == 1 and len(value) == n_old:
+                tail = eval(code, {k: v[n_old:] for k, v in self.columns.items()})
+                value = np.concatenate([value, np.broadcast_to(tail, (n - n_old,))])
+                self.results[text] = (versions, n, value)
+                return value
+        value = eval(code, dict(self.columns))
+        self.results[text] = (versions, n, value)
+        return value
+
+    def evaluate_many(self, text, datasets):
+        """Evaluate *text* over each of several tables and return the list of
+        results. Elementwise expressions are evaluated in one call over the
+        concatenated columns.
+        """
+        code, names, elementwise = self.compile(text)
+        if len(datasets) == 0:
+            return []
+        columns = [{name.replace(' ', '_'): d[name] for name in d.dtype.names} for d in datasets]
+        used = [k for k in names if k in columns[0]]
+        if elementwise and all(k in c for c in columns for k in used):
+            lengths = [len(d) for d in datasets]
+            ns = {k: np.concatenate([c[k] for c in columns]) for k in used}
+            value = eval(code, ns)
+            if np.ndim(value) == 1 and len(value) == sum(lengths):
+                return np.split(value, np.cumsum(lengths)[:-1])
+        return [eval(code, dict(c)) for c in columns]
+
+
 class EvalPlotter(QtGui.QWidget):
     def __init__(self):
+        self.evaluator = ExpressionEvaluator()
         self.held_plots = []
+        self.held_data = []  # results table shown by each held plot
+        self.plotted_code = None
         self.last_curve = None
         self.held_index = 0
         self.cursor_visible = False
+        self.iv_source = None  # callable returning (cmd, I) of the steady-state I-V
+        self.iv_curve = None
         
         QtGui.QWidget.__init__(self)
         self.layout = QtGui.QGridLayout()
@@ -258,6 +576,9 @@ class EvalPlotter(QtGui.QWidget):
         self.show_cursor_check = QtGui.QCheckBox('Enable Cursor')
         self.show_cursor_check.setCheckState(QtCore.Qt.CheckState.Unchecked)
         self.layout.addWidget(self.show_cursor_check, 3, 4, 1, 1)
+        self.show_iv_check = QtGui.QCheckBox('Steady-state I-V')
+        self.show_iv_check.setVisible(False)
+        self.layout.addWidget(self.show_iv_check, 3, 5, 1, 1)
         
         self.x_code.editingFinished.connect(self.replot)
         self.y_code.editingFinished.connect(self.replot)
@@ -267,6 +588,7 @@ class EvalPlotter(QtGui.QWidget):
         self.clear_plot_btn.clicked.connect(self.clear_plot)
         self.replot_btn.clicked.connect(self.replot)
         self.show_cursor_check.stateChanged.connect(self.cursor_state_changed)
+        self.show_iv_check.stateChanged.connect(self.update_iv_curve)
 
         # add a crosshair to the plot, but hide until ready
         self.vLine = pg.InfiniteLine(angle=90, movable=False)
@@ -300,22 +622,43 @@ class EvalPlotter(QtGui.QWidget):
         yt = f"<span style='font-size: 10pt; color:cyan'>y={viewPos.y():0.3e}</span style>"
         self.mouse_label.setHtml(xt + yt)
     
+    def set_iv_source(self, source):
+        """Offer an overlay of the analytic steady-state I-V; *source* is
+        called with no arguments and returns (cmd, current) arrays, or None
+        when no curve applies.
+        """
+        self.iv_source = source
+        self.show_iv_check.setVisible(source is not None)
+
+    def update_iv_curve(self):
+        curve = None
+        if self.iv_source is not None and self.show_iv_check.isChecked():
+            curve = self.iv_source()
+        if curve is None:
+            if self.iv_curve is not None:
+                self.plot.removeItem(self.iv_curve)
+                self.iv_curve = None
+            return
+        if self.iv_curve is None:
+            self.iv_curve = self.plot.plot(pen=pg.mkPen('w', style=QtCore.Qt.PenStyle.DashLine))
+        self.iv_curve.setData(*curve)
+
     def update_data(self, data):
         self.data = data
+        self.evaluator.set_data(data)
         self.replot()
+        self.update_iv_curve()
         
     def replot(self):
-        data = self.data
-        ns = {}
-        for k in data.dtype.names:
-            ns[k.replace(' ', '_')] = data[k]
+        if self.evaluator.data is None:
+            return
         xcode = str(self.x_code.text())
         ycode = str(self.y_code.text())
         if xcode == '' or ycode == '':
             return
         
         try:
-            x = eval(xcode, ns)
+            x = self.evaluator.evaluate(xcode)
         except:
             pg.debug.printExc('Error evaluating plot x values:')
             self.x_code.setStyleSheet("QLineEdit { border: 2px solid red; }")
@@ -324,7 +667,7 @@ class EvalPlotter(QtGui.QWidget):
             self.x_code.setStyleSheet("")
             
         try:
-            y = eval(ycode, ns)
+            y = self.evaluator.evaluate(ycode)
         except:
             pg.debug.printExc('Error evaluating plot y values:')
             self.y_code.setStyleSheet("QLineEdit { border: 2px solid red; }")
@@ -340,20 +683,39 @@ class EvalPlotter(QtGui.QWidget):
         self.y_data = y  # for mouse   
         self.plot.setLabels(bottom=(xcode, self.x_units_text.text()),
                             left=(ycode, self.y_units_text.text()))
+        if (xcode, ycode) != self.plotted_code:
+            self.plotted_code = (xcode, ycode)
+            self.replot_held()
+
+    def replot_held(self):
+        """Show the current expressions for the held plots' data as well."""
+        if len(self.held_data) == 0:
+            return
+        try:
+            xs = self.evaluator.evaluate_many(self.plotted_code[0], self.held_data)
+            ys = self.evaluator.evaluate_many(self.plotted_code[1], self.held_data)
+        except Exception:
+            pg.debug.printExc('Error evaluating held plot values:')
+            return
+        for curve, x, y in zip(self.held_plots, xs, ys):
+            curve.setData(x, y)
 
         
     def hold_plot(self):
         if self.last_curve is None:
             return
         self.held_plots.append(self.last_curve)
+        self.held_data.append(self.data)
         self.held_index += 1
         self.last_curve = None
 
     def clear_plot(self):
         self.held_plots = []
+        self.held_data = []
         self.held_index = 0
         self.vLine.scene().sigMouseHover.disconnect(self.mouse_moved_over_plot)
         self.plot.clear()
+        self.iv_curve = None
         # re-add the cursor
         self.plot.addItem(self.vLine, ignoreBounds=False)
         self.plot.addItem(self.hLine, ignoreBounds=False)
@@ -363,6 +725,7 @@ class EvalPlotter(QtGui.QWidget):
         self.cursor_visible = False
         self.show_cursor_check.setCheckState(QtCore.Qt.CheckState.Unchecked)
         self.replot()
+        self.update_iv_curve()
 
     def cursor_state_changed(self):
         if self.show_cursor_check.checkState() == QtCore.Qt.CheckState.Checked: